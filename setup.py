@@ -62,6 +62,7 @@ setup(
     long_description=long_description,
     #packages=['w2d'],
     packages=find_packages(where=os.path.dirname(__file__), include=['*']),
+    package_data={'w2d': ['postlight_worker.js']},
     entry_points={
         'console_scripts': [
             'w2d = w2d:main',
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Test helpers, local http site (no network access) and a temporary scrape cache.
+Test cases derive from TempDirTestCase, TempCacheTestCase or LocalSiteTestCase rather than setting these up themselves.
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import w2d
+
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as w2d.ConnectionPool
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        site = self.server
+        with site.lock:
+            site.connection_count += 1
+        BaseHTTPRequestHandler.handle(self)
+
+    def do_GET(self):
+        site = self.server
+        with site.lock:
+            site.request_counts[self.path] = site.request_counts.get(self.path, 0) + 1
+            site.request_log.append((self.path, dict((name.lower(), value) for name, value in self.headers.items())))
+            site.in_flight += 1
+            site.max_in_flight = max(site.max_in_flight, site.in_flight)
+        try:
+            if site.delay:
+                time.sleep(site.delay)
+            self.send_page(site.pages.get(self.path))
+        finally:
+            with site.lock:
+                site.in_flight -= 1
+
+    def send_page(self, page):
+        if page is None:
+            page = {'body': b'not found', 'content_type': 'text/plain', 'status': 404, 'headers': {}, 'chunked': False}
+        body = page['body']
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        status = page['status']
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', page['content_type'])
+        if status in (200, 304):
+            self.send_header('ETag', etag)
+        for name, value in page['headers'].items():
+            self.send_header(name, value)
+        if page['chunked']:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for offset in range(0, len(body), 1000):
+                part = body[offset:offset + 1000]
+                self.wfile.write(('%x\r\n' % len(part)).encode('ascii') + part + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+class LocalSite(ThreadingMixIn, HTTPServer):
+    """Serves pages on 127.0.0.1, ephemeral port, in a thread. Responses have an ETag, If-None-Match gets a 304.
+    request_counts is path to number of GET requests, request_log is list of (path, request headers dict),
+    connection_count is number of connections accepted, max_in_flight the most concurrent requests seen.
+    delay is seconds to wait before each response.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), SiteHandler)
+        self.pages = {}
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self.request_log = []
+        self.connection_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0.0
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+    def add_page(self, path, body, content_type='text/html; charset=utf-8', status=200, headers=None, chunked=False):
+        """body is bytes, chunked sends it without a Content-Length. Returns the url"""
+        self.pages[path] = {'body': body, 'content_type': content_type, 'status': status, 'headers': headers or {}, 'chunked': chunked}
+        return self.url(path)
+
+    def add_html(self, path, html):
+        return self.add_page(path, html.encode('utf-8'))
+
+    def add_redirect(self, path, location, status=302):
+        return self.add_page(path, b'', content_type='text/plain', status=status, headers={'Location': location})
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def make_article(title, paragraphs=5):
+    text = ' '.join(['Words about %s, enough of them for an extractor to consider this the main content.' % title] * 4)
+    body = ''.join('<p>%s</p>' % text for _ in range(paragraphs))
+    return '<html><head><title>%s</title></head><body><nav><a href="/">Home</a></nav><article><h1>%s</h1>%s</article></body></html>' % (title, title, body)
+
+
+def read_file(filename):
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    return data
+
+
+FAKE_PANDOC = '''#!%s
+"""Fake pandoc for tests; output is "fake pandoc <to format> <title>" followed by the input, to stdout or -o filename"""
+import sys
+args = sys.argv[1:]
+def option(name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+metadata = option('--metadata', 'title=')
+output = ('fake pandoc %%s %%s\\n' %% (option('-t'), metadata[len('title='):])).encode('utf-8') + getattr(sys.stdin, 'buffer', sys.stdin).read()
+output_filename = option('-o')
+if output_filename:
+    f = open(output_filename, 'wb')
+    f.write(output)
+    f.close()
+else:
+    getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+'''
+
+
+def write_fake_pandoc(directory):
+    """Write a fake pandoc executable (no pandoc needed) into directory, returns its filename, for W2D_PANDOC_EXE"""
+    filename = os.path.join(directory, 'fake_pandoc')
+    f = open(filename, 'w')
+    f.write(FAKE_PANDOC % sys.executable)
+    f.close()
+    os.chmod(filename, 0o755)
+    return filename
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Test case with its own (empty) temporary directory, self.temp_dir, and set_env() for env vars restored afterwards"""
+    environ = {}  # env vars set for each test
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='w2d_test_')
+        self.saved_environ = {}
+        for name, value in self.environ.items():
+            self.set_env(name, value)
+
+    def set_env(self, name, value):
+        """Set (None removes) env var name for this test"""
+        if name not in self.saved_environ:
+            self.saved_environ[name] = os.environ.get(name)
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+    def tearDown(self):
+        for name, value in self.saved_environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.temp_dir)
+
+
+class TempCacheTestCase(TempDirTestCase):
+    """TempDirTestCase with its own scrape cache (w2d.cache_dir) and no cache limits from the environment.
+    Configuration is re-read (w2d.load_config()) before and after each test, call it after set_env() of a w2d setting
+    """
+    def setUp(self):
+        w2d.configure()
+        TempDirTestCase.setUp(self)
+        self.set_env('W2D_CACHE_DIR', os.path.join(self.temp_dir, 'scrape_cache'))
+        for name in ('W2D_CACHE_MAX_BYTES', 'W2D_CACHE_MAX_ENTRIES', 'W2D_CACHE_MAX_AGE'):
+            if name not in self.environ:
+                self.set_env(name, None)
+        w2d.load_config()
+
+    def tearDown(self):
+        TempDirTestCase.tearDown(self)
+        w2d.load_config()
+
+
+class LocalSiteTestCase(TempCacheTestCase):
+    """TempCacheTestCase with self.site, a LocalSite"""
+    def setUp(self):
+        TempCacheTestCase.setUp(self)
+        self.site = LocalSite()
+
+    def tearDown(self):
+        self.site.stop()
+        TempCacheTestCase.tearDown(self)
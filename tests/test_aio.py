@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""asyncio fetcher (w2d.aio), concurrency limits, politeness delay and the scrape cache
+"""
+
+import sys
+import time
+import unittest
+
+import w2d
+
+from tests import support
+
+if sys.version_info >= (3, 5):
+    from w2d import aio
+else:
+    aio = None
+
+
+@unittest.skipIf(aio is None, 'w2d.aio is Python 3 only')
+class AsyncFetcherTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.other_site = support.LocalSite()  # a second host, different port
+
+    def tearDown(self):
+        self.other_site.stop()
+        support.LocalSiteTestCase.tearDown(self)
+
+    def add_pages(self, site, count, delay):
+        site.delay = delay
+        return [site.add_html('/%d.html' % counter, support.make_article('Page %d' % counter)) for counter in range(count)]
+
+    def fetch_timed(self, urls, **kwargs):
+        """Returns list of (seconds to complete, page) in the same order as urls"""
+        async def fetch_all():
+            fetcher = aio.AsyncFetcher(**kwargs)
+            start = time.time()
+
+            async def fetch(url):
+                page = await fetcher.fetch(url)
+                return time.time() - start, page
+            try:
+                return await aio.asyncio.gather(*[fetch(url) for url in urls])
+            finally:
+                await fetcher.close()
+        return aio.run(fetch_all())
+
+    def test_per_host_limit(self):
+        busy_urls = self.add_pages(self.site, 6, delay=0.2)
+        other_urls = self.add_pages(self.other_site, 2, delay=0.2)
+        results = self.fetch_timed(busy_urls + other_urls, max_in_flight=3, per_host=2)
+        self.assertEqual(self.site.max_in_flight, 2)
+        self.assertEqual(self.other_site.request_counts, {'/0.html': 1, '/1.html': 1})
+        # the busy host's queue does not hold global slots, the other host finishes first
+        self.assertLess(max(seconds for seconds, page in results[6:]), max(seconds for seconds, page in results[:6]))
+        self.assertIn(b'Page 5', results[5][1])
+
+    def test_max_in_flight(self):
+        urls = self.add_pages(self.site, 4, delay=0.1)
+        self.fetch_timed(urls, max_in_flight=1, per_host=4)
+        self.assertEqual(self.site.max_in_flight, 1)
+
+    def test_host_delay(self):
+        urls = self.add_pages(self.site, 3, delay=0.0)
+        results = self.fetch_timed(urls, per_host=4, host_delay=0.2)
+        self.assertGreaterEqual(max(seconds for seconds, page in results), 0.4)
+
+    def test_cache(self):
+        urls = self.add_pages(self.site, 2, delay=0.0)
+        pages = aio.get_urls(urls)
+        self.assertEqual(aio.get_urls(urls), pages)
+        self.assertEqual(w2d.get_url(urls[0]), pages[0])  # same scrape cache as get_url()
+        self.assertEqual(self.site.request_counts, {'/0.html': 1, '/1.html': 1})
+
+    def test_revalidate(self):
+        url = self.add_pages(self.site, 1, delay=0.0)[0]
+        page = aio.get_urls([url])[0]
+        self.set_env('W2D_CACHE_REVALIDATE', 'true')
+        w2d.load_config()
+        self.assertEqual(aio.get_urls([url])[0], page)
+        self.assertEqual(self.site.request_counts['/0.html'], 2)
+        path, headers = self.site.request_log[-1]
+        self.assertIn('if-none-match', headers)  # answered with 304, page from the cache
+
+    def test_ignore_errors(self):
+        urls = self.add_pages(self.site, 1, delay=0.0) + [self.site.url('/missing.html')]
+        pages = aio.get_urls(urls, ignore_errors=True)
+        self.assertIn(b'Page 0', pages[0])
+        self.assertIsInstance(pages[1], Exception)
+
+
+if __name__ == '__main__':
+    unittest.main()
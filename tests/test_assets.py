@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Image localisation (W2D_LOCALIZE_IMAGES) and the content addressed asset store, images served by a local site
+"""
+
+import hashlib
+import os
+import unittest
+import zipfile
+
+try:
+    from io import BytesIO
+except ImportError:
+    # Py2
+    from StringIO import StringIO as BytesIO
+
+import w2d
+from w2d import assets
+from w2d import bench
+from w2d import sinks
+
+from tests import support
+
+
+PNG = bench.TINY_PNG
+
+
+class ImageExtensionTest(unittest.TestCase):
+    def test_get_image_extension(self):
+        self.assertEqual(assets.get_image_extension('http://example.com/logo', 'image/png; charset=binary'), '.png')
+        self.assertEqual(assets.get_image_extension('http://example.com/photo.JPEG?size=large', 'application/octet-stream'), '.jpeg')
+        self.assertEqual(assets.get_image_extension('http://example.com/image.php'), '.img')
+
+
+@unittest.skipIf(not assets.PIL_Image, 'needs Pillow')
+class ShrinkImageTest(unittest.TestCase):
+    def make_image(self, mode, size):
+        out_file = BytesIO()
+        image = assets.PIL_Image.new(mode, size, color=(200, 100, 50) if mode == 'RGB' else (200, 100, 50, 0))
+        image.save(out_file, 'PNG')
+        return out_file.getvalue()
+
+    def get_size(self, data):
+        return assets.PIL_Image.open(BytesIO(data)).size
+
+    def test_max_dimension(self):
+        data, extension = assets.shrink_image(self.make_image('RGB', (400, 200)), max_dimension=100)
+        self.assertEqual((self.get_size(data), extension), ((100, 50), '.jpg'))
+        data, extension = assets.shrink_image(self.make_image('RGBA', (400, 200)), max_dimension=100)
+        self.assertEqual((self.get_size(data), extension), ((100, 50), '.png'))  # transparency kept
+
+    def test_unchanged(self):
+        data = self.make_image('RGB', (50, 50))
+        self.assertEqual(assets.shrink_image(data, max_dimension=100), (data, None))
+        self.assertEqual(assets.shrink_image(data), (data, None))
+        self.assertEqual(assets.shrink_image(b'<svg></svg>', max_dimension=10), (b'<svg></svg>', None))
+
+
+class AssetStoreTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.store = assets.AssetStore(os.path.join(self.temp_dir, 'assets'), max_dimension=0, max_bytes=0)
+
+    def test_get(self):
+        url = self.site.add_page('/logo', PNG, content_type='image/png')
+        filename = self.store.get(url)
+        content_hash = hashlib.sha256(PNG).hexdigest()
+        self.assertEqual(filename, '%s/%s.png' % (content_hash[:2], content_hash))
+        self.assertEqual(support.read_file(os.path.join(self.store.directory, filename)), PNG)
+        self.assertEqual(self.store.get(url), filename)
+        self.assertEqual(assets.AssetStore(self.store.directory).get(url), filename)  # another store (process) sharing the directory
+        self.assertEqual(self.site.request_counts['/logo'], 1)
+
+    def test_identical_images_stored_once(self):
+        urls = [self.site.add_page('/%d.png' % counter, PNG, content_type='image/png') for counter in range(3)]
+        filenames = self.store.get_many(urls)
+        self.assertEqual(sorted(filenames), sorted(urls))
+        self.assertEqual(len(set(filenames.values())), 1)
+        hash_dir = os.path.dirname(os.path.join(self.store.directory, list(filenames.values())[0]))
+        self.assertEqual(len(os.listdir(hash_dir)), 1)
+
+    def test_concurrent_same_url(self):
+        url = self.site.add_page('/logo.png', PNG, content_type='image/png')
+        self.site.delay = 0.1
+        pool = assets.concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        try:
+            filenames = list(pool.map(self.store.get, [url] * 4))
+        finally:
+            pool.shutdown()
+        self.assertEqual(len(set(filenames)), 1)
+        self.assertEqual((self.site.request_counts['/logo.png'], self.store.fetch_count), (1, 1))
+        self.assertEqual(self.store.url_locks, {})
+
+    def test_failed_download(self):
+        url = self.site.url('/missing.png')
+        self.assertRaises(w2d.HTTPError, self.store.get, url)
+        self.assertEqual(self.store.get_many([url]), {})
+        self.assertEqual(self.store.url_locks, {})
+        self.site.add_page('/missing.png', PNG, content_type='image/png')
+        self.assertTrue(self.store.get(url))  # retried, failures are not remembered
+
+    def test_removed_asset_fetched_again(self):
+        url = self.site.add_page('/logo.png', PNG, content_type='image/png')
+        filename = self.store.get(url)
+        os.remove(os.path.join(self.store.directory, filename))
+        self.assertEqual(self.store.lookup(url), None)
+        self.assertEqual(self.store.get(url), filename)
+        self.assertEqual(self.site.request_counts['/logo.png'], 2)
+
+
+class LocalizeImagesTest(support.LocalSiteTestCase):
+    environ = {'W2D_LOCALIZE_IMAGES': 'true', 'W2D_EXTRACTOR': 'raw'}
+
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.asset_dir = os.path.join(self.temp_dir, 'assets')
+        self.set_env('W2D_ASSET_DIR', self.asset_dir)
+        w2d.load_config()
+        self.site.add_page('/images/logo.png', PNG, content_type='image/png')
+        html = '<html><head><title>Images</title></head><body><p>text</p><img src="/images/logo.png" srcset="/images/logo-2x.png 2x"><img src="missing.png"></body></html>'
+        self.url = self.site.add_html('/articles/page.html', html)
+
+    def test_localize_images(self):
+        content = w2d.rewrite_links(self.site.pages['/articles/page.html']['body'].decode('utf-8'), self.url)
+        content, asset_paths = w2d.localize_images(content)
+        self.assertEqual(len(asset_paths), 1)
+        self.assertTrue(asset_paths[0].startswith(self.asset_dir.replace(os.sep, '/')))
+        self.assertIn('src="%s"' % asset_paths[0], content)
+        self.assertNotIn('srcset', content)
+        self.assertIn('src="%s"' % self.site.url('/articles/missing.png'), content)  # failed download keeps the remote url
+
+    def test_directory_sink(self):
+        output_dir = os.path.join(self.temp_dir, 'out')
+        sink = sinks.DirectorySink(output_dir)
+        result_metadata = w2d.process_page(self.url, output_format=w2d.FORMAT_HTML, extractor_function=w2d.extractor_raw, output_sink=sink)
+        html = support.read_file(os.path.join(output_dir, result_metadata['filename'])).decode('utf-8')
+        asset_path = w2d.extract_page(self.url, extractor_function=w2d.extractor_raw)['assets'][0]
+        relative_path = os.path.relpath(asset_path, output_dir).replace(os.sep, '/')
+        self.assertIn('src="%s"' % relative_path, html)  # relative to the document
+        self.assertTrue(os.path.exists(os.path.join(output_dir, relative_path)))
+
+    def test_archive_sink(self):
+        zip_filename = os.path.join(self.temp_dir, 'out.zip')
+        sink = sinks.open_output_sink(zip_filename)
+        second_url = self.site.add_html('/articles/second.html', self.site.pages['/articles/page.html']['body'].decode('utf-8').replace('Images', 'Second'))
+        w2d.dump_urls([self.url, second_url], output_format=w2d.FORMAT_HTML, output_sink=sink)
+        sink.close()
+        archive = zipfile.ZipFile(zip_filename)
+        names = archive.namelist()
+        archive.close()
+        asset_names = [name for name in names if name.startswith(sinks.ASSETS_DIRNAME + '/')]
+        self.assertEqual(len(asset_names), 1)  # same image on both pages, added once
+        archive = zipfile.ZipFile(zip_filename)
+        html = archive.read('Images.html').decode('utf-8')
+        archive.close()
+        self.assertIn('src="%s"' % asset_names[0], html)
+        self.assertEqual(self.site.request_counts['/images/logo.png'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""dump_urls() batches; serial, fetch threads, and extraction/conversion worker processes
+"""
+
+import unittest
+
+import w2d
+from w2d import sinks
+
+from tests import support
+
+
+@unittest.skipIf(w2d.is_win, 'fake pandoc is a posix script')
+class DumpUrlsTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.set_env('W2D_PANDOC_EXE', support.write_fake_pandoc(self.temp_dir))
+        self.set_env('W2D_EPUB_TOOL', 'pandoc')
+        self.set_env('W2D_EXTRACTOR', 'readability')
+        w2d.load_config()
+        self.paths = ['/%d.html' % counter for counter in range(4)]
+        for path in self.paths:
+            self.site.add_html(path, support.make_article('Page %s' % path[1]))
+        self.urls = [self.site.url(path) for path in self.paths]
+        self.urls.insert(2, self.site.url('/missing.html'))  # 404
+
+    def check_batch(self, fetch_workers, cpu_workers):
+        sink = sinks.MemorySink()
+        results = w2d.dump_urls(self.urls, output_format=w2d.FORMAT_ALL, fetch_workers=fetch_workers, cpu_workers=cpu_workers, output_sink=sink)
+        self.assertEqual(len(results), len(self.urls))
+        self.assertIsInstance(results[2], w2d.HTTPError)
+        del results[2]
+        for path, result_metadata_list in zip(self.paths, results):
+            self.assertEqual([result_metadata['format'] for result_metadata in result_metadata_list], w2d.SUPPORTED_FORMATS)
+            self.assertEqual([result_metadata['title'] for result_metadata in result_metadata_list], ['Page %s' % path[1]] * len(w2d.SUPPORTED_FORMATS))
+        names = [name for name, data, metadata in sink.documents]
+        self.assertEqual(sorted(names), sorted(result_metadata['filename'] for result_metadata_list in results for result_metadata in result_metadata_list))
+        for path in self.paths:
+            self.assertEqual(self.site.request_counts[path], 1)  # fetched once, then from the scrape cache
+
+    def test_serial(self):
+        self.check_batch(1, 1)
+
+    def test_fetch_threads(self):
+        self.check_batch(4, 1)
+
+    def test_worker_processes(self):
+        self.check_batch(4, 2)
+
+    def test_raise(self):
+        for fetch_workers, cpu_workers in ((1, 1), (4, 1)):
+            self.assertRaises(w2d.HTTPError, w2d.dump_urls, self.urls, fetch_workers=fetch_workers, cpu_workers=cpu_workers, output_sink=sinks.MemorySink(), ignore_errors=False)
+
+    def test_dump_url(self):
+        sink = sinks.MemorySink()
+        result_metadata = w2d.dump_url(self.urls[0], output_format=w2d.FORMAT_ALL, output_sink=sink)
+        self.assertEqual(result_metadata['format'], w2d.SUPPORTED_FORMATS[-1])  # the last format rendered
+        self.assertEqual(len(sink.documents), len(w2d.SUPPORTED_FORMATS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Pipeline benchmark (w2d.bench) smoke test, a small synthetic corpus through the raw pipeline
+"""
+
+import os
+
+import w2d
+from w2d import bench
+
+from tests import support
+
+
+class CorpusTest(support.TempDirTestCase):
+    def test_write_corpus(self):
+        first = os.path.join(self.temp_dir, 'first')
+        second = os.path.join(self.temp_dir, 'second')
+        filenames = bench.write_corpus(first, pages=1)
+        self.assertEqual(filenames, ['%s_00.html' % page_type for page_type in bench.CORPUS_PAGE_TYPES])
+        self.assertEqual(bench.find_corpus_pages(first), sorted(filenames))
+        bench.write_corpus(second, pages=1)
+        for filename in filenames:
+            self.assertEqual(support.read_file(os.path.join(first, filename)), support.read_file(os.path.join(second, filename)), filename)  # deterministic
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(bench.percentile(values, 50), 3)
+        self.assertEqual(bench.percentile(values, 100), 5)
+        self.assertEqual(bench.percentile([], 50), None)
+
+
+class PipelinesTest(support.TempCacheTestCase):
+    def test_raw_pipeline(self):
+        results = bench.bench_pipelines(pipelines=['raw'], formats=['html', 'md'], repeat=1, warmup=0, pages=1)
+        self.assertTrue(results['ok'], results['pipelines'])
+        self.assertEqual(len(results['corpus']['pages']), len(bench.CORPUS_PAGE_TYPES))
+        self.assertEqual(sorted(results['pipelines']), ['raw/html', 'raw/md'])
+        for pipeline_results in results['pipelines'].values():
+            self.assertEqual((pipeline_results['page_count'], pipeline_results['repeat']), (len(bench.CORPUS_PAGE_TYPES), 1))
+            self.assertTrue(pipeline_results['ms_p50'] > 0)
+
+    def test_run_pipeline(self):
+        corpus_dir = os.path.join(self.temp_dir, 'corpus')
+        bench.write_corpus(corpus_dir, pages=1)
+        server = bench.CorpusServer(corpus_dir)
+        server.start()
+        try:
+            urls = [server.base_url + filename for filename in bench.find_corpus_pages(corpus_dir)]
+            output_dir = os.path.join(self.temp_dir, 'output')
+            os.makedirs(output_dir)
+            results = bench.run_pipeline('raw', w2d.FORMAT_HTML, urls, repeat=2, warmup=0, output_dir=output_dir)
+        finally:
+            server.stop()
+        self.assertEqual((results['pipeline'], results['format'], results['page_count']), ('raw', w2d.FORMAT_HTML, len(urls)))
+        self.assertEqual(len([name for name in os.listdir(output_dir) if name.endswith('.html')]), len(urls))
+
+    def test_unknown_pipeline(self):
+        self.assertRaises(ValueError, bench.bench_pipelines, pipelines=['missing'])
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
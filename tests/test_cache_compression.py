@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Scrape cache compression, the codec of each entry is recorded in the cache index and never guessed from the data
+"""
+
+import os
+import zlib
+
+import w2d
+from w2d import cache
+
+from tests import support
+
+
+PAGE = b'<html>' + b'hello world ' * 100 + b'</html>'
+
+
+class CompressionTest(support.TempDirTestCase):
+    def test_round_trip(self):
+        for codec in cache.SUPPORTED_CODECS:
+            self.assertEqual(cache.decompress(cache.compress(PAGE, codec), codec), PAGE, codec)
+            filename = os.path.join(self.temp_dir, codec)
+            cache.write_cache_file(filename, PAGE, codec=codec)
+            self.assertEqual(cache.read_cache_file(filename, codec), PAGE, codec)
+
+    def test_streaming_matches_compress(self):
+        for codec in cache.SUPPORTED_CODECS:
+            filename = os.path.join(self.temp_dir, codec)
+            writer = cache.CacheFileWriter(filename, codec)
+            for offset in range(0, len(PAGE), 100):
+                writer.write(PAGE[offset:offset + 100])
+            writer.close()
+            self.assertEqual(cache.read_cache_file(filename, codec), PAGE, codec)
+            self.assertEqual(writer.hexdigest(), cache.hash_content(PAGE))
+
+    def test_uncompressed_never_guessed(self):
+        gzip_body = cache.compress(PAGE, cache.CODEC_GZIP)
+        zlib_body = zlib.compress(PAGE)
+        for data in (b'\x1f\x8b not gzip', b'x^ not zlib', b'xx', b'', gzip_body, zlib_body):
+            self.assertEqual(cache.decompress(data, cache.CODEC_NONE), data)
+            self.assertEqual(cache.decompress(data), data)
+
+    def test_unknown_codec(self):
+        self.assertRaises(NotImplementedError, cache.decompress, PAGE, 'rot13')
+
+    def test_object_suffix(self):
+        content_hash = cache.hash_content(PAGE)
+        filenames = set()
+        for codec in cache.SUPPORTED_CODECS:
+            filename = cache.get_object_filename(self.temp_dir, content_hash, codec)
+            if codec == cache.CODEC_NONE:
+                self.assertTrue(filename.endswith(content_hash))
+            else:
+                self.assertTrue(filename.endswith(content_hash + '.' + codec))
+            filenames.add(filename)
+        self.assertEqual(len(filenames), len(cache.SUPPORTED_CODECS))
+
+
+class GetUrlCompressionTest(support.LocalSiteTestCase):
+    def get_codec(self, url):
+        return w2d.get_cache_index().lookup_url(url)['codec']
+
+    def test_compressed_entry(self):
+        url = self.site.add_page('/page.html', PAGE)
+        self.set_env('W2D_CACHE_COMPRESSION', cache.CODEC_ZLIB)
+        self.assertEqual(w2d.get_url(url), PAGE)
+        self.assertEqual(w2d.get_url(url), PAGE)  # cache hit
+        self.assertEqual(self.site.request_counts['/page.html'], 1)
+        self.assertEqual(self.get_codec(url), cache.CODEC_ZLIB)
+        self.assertLess(os.path.getsize(w2d.get_cache_filename(url)), len(PAGE))
+
+    def test_gzip_body_stored_uncompressed(self):
+        # a body that happens to be gzip data is returned as downloaded, not decompressed
+        body = cache.compress(PAGE, cache.CODEC_GZIP)
+        url = self.site.add_page('/page.html.gz', body, content_type='application/gzip')
+        self.set_env('W2D_CACHE_COMPRESSION', cache.CODEC_NONE)
+        self.assertEqual(w2d.get_url(url), body)
+        self.assertEqual(w2d.get_url(url), body)  # cache hit
+        self.assertEqual(self.site.request_counts['/page.html.gz'], 1)
+        self.assertEqual(self.get_codec(url), cache.CODEC_NONE)
+
+    def test_mixed_codecs(self):
+        # changing W2D_CACHE_COMPRESSION leaves existing entries readable
+        urls = {}
+        for codec in cache.SUPPORTED_CODECS:
+            urls[codec] = self.site.add_page('/%s.html' % codec, PAGE + codec.encode('ascii'))
+            self.set_env('W2D_CACHE_COMPRESSION', codec)
+            w2d.get_url(urls[codec])
+        self.set_env('W2D_CACHE_COMPRESSION', cache.CODEC_NONE)
+        for codec, url in urls.items():
+            self.assertEqual(w2d.get_url(url), PAGE + codec.encode('ascii'))
+            self.assertEqual(self.get_codec(url), codec)
+        self.assertEqual(sum(self.site.request_counts.values()), len(urls))
+
+    def test_same_body_per_codec(self):
+        # deduplicated objects are per codec, an entry never links to a body compressed with another codec
+        first_url = self.site.add_page('/first.html', PAGE)
+        second_url = self.site.add_page('/second.html', PAGE)
+        self.set_env('W2D_CACHE_COMPRESSION', cache.CODEC_NONE)
+        w2d.get_url(first_url)
+        self.set_env('W2D_CACHE_COMPRESSION', cache.CODEC_ZLIB)
+        w2d.get_url(second_url)
+        self.assertEqual(w2d.get_url(first_url), PAGE)
+        self.assertEqual(w2d.get_url(second_url), PAGE)
+        content_hash = cache.hash_content(PAGE)
+        for codec in (cache.CODEC_NONE, cache.CODEC_ZLIB):
+            self.assertTrue(os.path.exists(cache.get_object_filename(w2d.cache_dir, content_hash, codec)), codec)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Scrape cache de-duplication, identical bodies are stored once under objects/ and cache entries are (hard) links to them
+"""
+
+import os
+
+import w2d
+from w2d import cache
+
+from tests import support
+
+
+class DedupeTest(support.TempCacheTestCase):
+    def test_shared_object(self):
+        os.makedirs(w2d.cache_dir)
+        index = cache.CacheIndex(w2d.cache_dir)
+        for hash in ('a', 'b'):
+            size, content_hash = cache.write_cache_entry(w2d.cache_dir, os.path.join(w2d.cache_dir, hash), b'same body')
+            index.record(hash, 'http://example.com/' + hash, size, content_hash=content_hash, codec=cache.CODEC_NONE)
+        object_filename = cache.get_object_filename(w2d.cache_dir, content_hash)
+        self.assertTrue(os.path.exists(object_filename))
+        self.assertEqual(index.stats()['unique_count'], 1)
+        cache.compact(w2d.cache_dir, max_entries=1, index=index)
+        self.assertTrue(os.path.exists(object_filename))  # still linked from the remaining entry
+        cache.compact(w2d.cache_dir, max_entries=0, index=index)
+        self.assertFalse(os.path.exists(object_filename))
+        index.close()
+
+    def test_write_cache_file_replaces(self):
+        # an entry linked to a shared object is replaced, the object (and other entries linked to it) are unchanged
+        os.makedirs(w2d.cache_dir)
+        filenames = [os.path.join(w2d.cache_dir, hash) for hash in ('a', 'b')]
+        for filename in filenames:
+            size, content_hash = cache.write_cache_entry(w2d.cache_dir, filename, b'same body')
+        cache.write_cache_file(filenames[0], b'new body', codec=cache.CODEC_NONE)
+        self.assertEqual(support.read_file(filenames[0]), b'new body')
+        self.assertEqual(support.read_file(filenames[1]), b'same body')
+        self.assertEqual(support.read_file(cache.get_object_filename(w2d.cache_dir, content_hash)), b'same body')
+        self.assertEqual([name for name in os.listdir(w2d.cache_dir) if name.endswith('.tmp')], [])
+
+
+class GetUrlDedupeTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.page = support.make_article('Cached').encode('utf-8')
+        self.url = self.site.add_page('/page.html', self.page)
+        self.other_url = self.site.add_page('/other.html', self.page)
+
+    def test_cache_hit(self):
+        self.assertEqual(w2d.get_url(self.url), self.page)
+        self.assertEqual(w2d.get_url(self.url), self.page)
+        self.assertEqual(w2d.get_url(self.url + '?utm_source=test'), self.page)  # canonical url, same entry
+        self.assertEqual(self.site.request_counts['/page.html'], 1)
+
+    def test_identical_bodies_stored_once(self):
+        w2d.get_url(self.url)
+        w2d.get_url(self.other_url)
+        self.assertEqual(os.stat(w2d.get_cache_filename(self.url)).st_nlink, 3)  # both entries and the object
+        stats = w2d.get_cache_index().stats()
+        self.assertEqual((stats['count'], stats['unique_count']), (2, 1))
+
+    def test_dedupe_disabled_write_keeps_shared_object(self):
+        w2d.get_url(self.url)
+        w2d.get_url(self.other_url)
+        self.set_env('W2D_CACHE_DEDUPE', 'false')
+        w2d.cache_page(self.url, b'changed body', code=200, response_headers={})
+        self.assertEqual(w2d.get_url(self.url), b'changed body')
+        self.assertEqual(w2d.get_url(self.other_url), self.page)
+        object_filename = cache.get_object_filename(w2d.cache_dir, cache.hash_content(self.page))
+        self.assertEqual(support.read_file(object_filename), self.page)
+        self.assertEqual(w2d.get_cache_index().lookup_url(self.url)['content_hash'], None)  # no longer shares the object
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
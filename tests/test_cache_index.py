@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""sqlite3 scrape cache catalogue (w2d.cache.CacheIndex)
+"""
+
+import os
+import threading
+import unittest
+
+import w2d
+from w2d import cache
+
+from tests import support
+
+
+class CacheIndexTest(support.TempCacheTestCase):
+    def setUp(self):
+        support.TempCacheTestCase.setUp(self)
+        os.makedirs(w2d.cache_dir)
+        self.index = cache.CacheIndex(w2d.cache_dir)
+
+    def tearDown(self):
+        self.index.close()
+        support.TempCacheTestCase.tearDown(self)
+
+    def test_record_and_lookup(self):
+        self.index.record('a1', 'http://example.com/a', 100, fetch_time=1000.0, status=200, content_type='text/html')
+        self.index.record('b1', 'http://other.example.org/b', 50, fetch_time=2000.0)
+        entry = self.index.lookup_url('http://example.com/a')
+        self.assertEqual((entry['hash'], entry['domain'], entry['size'], entry['status'], entry['content_type']), ('a1', 'example.com', 100, 200, 'text/html'))
+        self.assertEqual(self.index.lookup_hash('b1')['url'], 'http://other.example.org/b')
+        self.assertIsNone(self.index.lookup_url('http://example.com/missing'))
+        self.assertEqual([entry['hash'] for entry in self.index.oldest(1)], ['a1'])
+        self.assertEqual(self.index.size_by_domain(), [('example.com', 1, 100), ('other.example.org', 1, 50)])
+        self.assertEqual(self.index.totals(), (2, 150))
+
+    def test_replace(self):
+        self.index.record('a1', 'http://example.com/a', 100)
+        self.index.record('a1', 'http://example.com/a', 200)
+        self.assertEqual(self.index.totals(), (1, 200))
+
+    def test_import_tsv(self):
+        for hash in ('a1', 'b1'):
+            cache.write_cache_file(os.path.join(w2d.cache_dir, hash), b'page', codec=cache.CODEC_NONE)
+        f = open(os.path.join(w2d.cache_dir, cache.LEGACY_INDEX_FILENAME), 'wb')
+        f.write(b'a1\thttp://example.com/a\nmissing\thttp://example.com/gone\n\nb1\thttp://example.com/b\n')
+        f.close()
+        self.assertEqual(self.index.totals(), (2, 8))  # imported when the database is created
+        self.assertEqual(self.index.lookup_url('http://example.com/b')['hash'], 'b1')
+
+    def test_threads(self):
+        def record(counter):
+            for offset in range(20):
+                self.index.record('t%d_%d' % (counter, offset), 'http://example.com/%d/%d' % (counter, offset), 1)
+        threads = [threading.Thread(target=record, args=(counter,)) for counter in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.index.totals(), (80, 80))
+
+    def test_get_url_recorded(self):
+        site = support.LocalSite()
+        self.addCleanup(site.stop)
+        url = site.add_html('/page.html', support.make_article('Indexed'))
+        w2d.get_url(url)
+        entry = w2d.get_cache_index().lookup_url(w2d.canonical_url(url))
+        self.assertEqual(entry['hash'], os.path.basename(w2d.get_cache_filename(url)))
+        self.assertEqual((entry['status'], entry['content_type']), (200, 'text/html; charset=utf-8'))
+
+    def test_command_line(self):
+        self.index.record('a1', 'http://example.com/a', 100)
+        self.assertEqual(cache.main(['w2d.cache', '--cache-dir', w2d.cache_dir, 'lookup', 'http://example.com/a']), 0)
+        self.assertEqual(cache.main(['w2d.cache', '--cache-dir', w2d.cache_dir, 'lookup', 'http://example.com/missing']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
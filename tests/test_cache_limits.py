@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Bounded scrape cache; size, entry count and age limits, least recently used eviction
+"""
+
+import os
+import time
+import unittest
+
+import w2d
+from w2d import cache
+
+from tests import support
+
+
+class EvictionTest(support.TempCacheTestCase):
+    def setUp(self):
+        support.TempCacheTestCase.setUp(self)
+        os.makedirs(w2d.cache_dir)
+        self.index = cache.CacheIndex(w2d.cache_dir)
+        now = time.time()
+        for counter in range(5):
+            hash = 'entry%d' % counter
+            cache.write_cache_file(os.path.join(w2d.cache_dir, hash), b'x' * 100, codec=cache.CODEC_NONE)
+            self.index.record(hash, 'http://example.com/%d' % counter, 100, fetch_time=now - 1000 + counter)
+        self.index.touch('entry0')  # most recently used
+
+    def tearDown(self):
+        self.index.close()
+        support.TempCacheTestCase.tearDown(self)
+
+    def test_within_limits(self):
+        self.assertEqual(self.index.eviction_candidates(max_bytes=500, max_entries=5), [])
+
+    def test_least_recently_used_evicted(self):
+        candidates = self.index.eviction_candidates(max_entries=3)
+        self.assertEqual([entry['hash'] for entry in candidates], ['entry1', 'entry2'])
+
+    def test_max_age(self):
+        candidates = self.index.eviction_candidates(max_age=998.5)
+        self.assertEqual(sorted(entry['hash'] for entry in candidates), ['entry0', 'entry1'])
+
+    def test_compact(self):
+        removed = cache.compact(w2d.cache_dir, max_bytes=250, index=self.index)
+        self.assertEqual(len(removed), 3)
+        self.assertEqual(self.index.totals(), (2, 200))
+        for entry in removed:
+            self.assertFalse(os.path.exists(os.path.join(w2d.cache_dir, entry['hash'])))
+        self.assertTrue(os.path.exists(os.path.join(w2d.cache_dir, 'entry0')))
+
+    def test_totals(self):
+        self.assertEqual(self.index.totals(), (5, 500))
+        stats = self.index.stats()
+        self.assertEqual((stats['count'], stats['size'], stats['unique_count']), (5, 500, 5))
+
+    def test_expired(self):
+        self.assertTrue(self.index.is_expired('entry0', max_age=500))
+        self.assertFalse(self.index.is_expired('entry4', max_age=1000))
+        self.assertFalse(self.index.is_expired('missing', max_age=0))
+
+
+class GetUrlLimitsTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.url = self.site.add_html('/page.html', support.make_article('Cached'))
+
+    def test_expired(self):
+        w2d.get_url(self.url)
+        self.set_env('W2D_CACHE_MAX_AGE', '0.01')
+        time.sleep(0.05)
+        w2d.get_url(self.url)
+        self.assertEqual(self.site.request_counts['/page.html'], 2)
+
+    def test_entry_limit(self):
+        self.set_env('W2D_CACHE_MAX_ENTRIES', '1')
+        other_url = self.site.add_html('/other.html', support.make_article('Other'))
+        w2d.get_url(self.url)
+        w2d.get_url(other_url)
+        self.assertEqual(w2d.get_cache_index().totals()[0], 1)
+        self.assertFalse(os.path.exists(w2d.get_cache_filename(self.url)))
+
+    def test_hit_keeps_entry(self):
+        self.set_env('W2D_CACHE_MAX_ENTRIES', '2')
+        w2d.get_url(self.url)
+        second_url = self.site.add_html('/second.html', support.make_article('Second'))
+        w2d.get_url(second_url)
+        time.sleep(0.01)
+        w2d.get_url(self.url)  # hit, now the most recently used
+        w2d.get_url(self.site.add_html('/third.html', support.make_article('Third')))
+        self.assertTrue(os.path.exists(w2d.get_cache_filename(self.url)))
+        self.assertFalse(os.path.exists(w2d.get_cache_filename(second_url)))
+
+    def test_byte_limit(self):
+        w2d.get_url(self.url)
+        size = w2d.get_cache_index().totals()[1]
+        self.set_env('W2D_CACHE_MAX_BYTES', str(size * 2))
+        for counter in range(3):
+            w2d.get_url(self.site.add_html('/%d.html' % counter, support.make_article('Cached')))
+        self.assertLessEqual(w2d.get_cache_index().totals()[1], size * 2)
+
+    def test_command_line_compact(self):
+        w2d.get_url(self.url)
+        self.assertEqual(cache.main(['w2d.cache', '--cache-dir', w2d.cache_dir, 'compact', '--max-entries', '0']), 0)
+        self.assertEqual(w2d.get_cache_index().totals(), (0, 0))
+        self.assertFalse(os.path.exists(w2d.get_cache_filename(self.url)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Keep-alive connection re-use (w2d.ConnectionPool) and redirects in easy_get_url()
+"""
+
+import unittest
+
+import w2d
+
+from tests import support
+
+
+class ConnectionPoolTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.urls = [self.site.add_html('/%d.html' % counter, support.make_article('Page %d' % counter)) for counter in range(3)]
+
+    def test_reuse(self):
+        for url in self.urls * 2:
+            self.assertIn(b'<title>Page', w2d.easy_get_url(url))
+        self.assertEqual(self.site.connection_count, 1)
+        self.assertEqual(sum(self.site.request_counts.values()), 6)
+
+    def test_pool_disabled(self):
+        self.set_env('W2D_CONNECTION_POOL', 'false')
+        w2d.load_config()
+        for url in self.urls:
+            w2d.easy_get_url(url)
+        self.assertEqual(self.site.connection_count, 3)
+
+    def test_stale_connection(self):
+        w2d.easy_get_url(self.urls[0])
+        for connections in w2d.connection_pool._idle.values():
+            for connection in connections:
+                connection.sock.close()  # as if closed by the server
+        self.assertIn(b'Page 1', w2d.easy_get_url(self.urls[1]))
+        self.assertEqual(self.site.connection_count, 2)
+
+    def test_idle_limit(self):
+        pool = w2d.ConnectionPool(max_idle_per_host=1)
+        key = ('http', '127.0.0.1', self.site.server_address[1])
+        first, reused = pool.get(key)
+        second, reused = pool.get(key)
+        self.assertFalse(reused)
+        pool.put(key, first)
+        pool.put(key, second)  # over the limit, closed
+        self.assertEqual(pool._idle[key], [first])
+        self.assertEqual(pool.get(key), (first, True))
+        pool.close()
+
+    def test_redirects(self):
+        self.site.add_redirect('/old.html', '/moved.html', status=301)
+        self.site.add_redirect('/moved.html', self.urls[2], status=302)
+        url, code, response_headers, page = w2d.easy_get_url_response(self.site.url('/old.html'))
+        self.assertEqual((url, code), (self.urls[2], 200))
+        self.assertIn(b'Page 2', page)
+        self.assertEqual(self.site.connection_count, 1)
+
+    def test_redirect_loop(self):
+        self.site.add_redirect('/loop.html', '/loop.html')
+        self.assertRaises(w2d.HTTPError, w2d.easy_get_url, self.site.url('/loop.html'))
+        self.assertEqual(self.site.request_counts['/loop.html'], w2d.MAX_REDIRECTS + 1)
+
+    def test_redirect_drops_credentials(self):
+        other_site = support.LocalSite()
+        self.addCleanup(other_site.stop)
+        target_url = other_site.add_html('/target.html', support.make_article('Target'))
+        self.site.add_redirect('/private.html', target_url)
+        private_url = self.site.url('/private.html').replace('http://', 'http://user:secret@')
+        self.assertIn(b'Target', w2d.easy_get_url(private_url))
+        self.assertIn('authorization', self.site.request_log[-1][1])
+        self.assertNotIn('authorization', other_site.request_log[-1][1])  # different host
+
+    def test_http_error(self):
+        try:
+            w2d.easy_get_url(self.site.url('/missing.html'))
+            self.fail('no HTTPError')
+        except w2d.HTTPError as info:
+            self.assertEqual(info.code, 404)
+        self.assertIsNone(w2d.easy_get_url(self.site.url('/missing.html'), ignore_errors=True))
+        self.assertIn(b'Page 0', w2d.easy_get_url(self.urls[0]))
+        self.assertEqual(self.site.connection_count, 1)  # error responses do not lose the connection
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Streamed downloads and the W2D_MAX_DOWNLOAD_BYTES limit, Content-Length and chunked responses
+"""
+
+import os
+
+import w2d
+try:
+    from w2d import aio
+except SyntaxError:
+    aio = None  # Py2
+
+from tests import support
+
+
+LIMIT = 10000
+
+
+class DownloadLimitTest(support.LocalSiteTestCase):
+    environ = {'W2D_MAX_DOWNLOAD_BYTES': str(LIMIT), 'W2D_CONNECTION_POOL': 'true'}
+
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.small_body = b'<html><body>' + b'x' * (LIMIT // 2) + b'</body></html>'
+        self.large_body = b'<html><body>' + b'x' * (LIMIT * 3) + b'</body></html>'
+
+    def get_cache_dir_files(self):
+        if not os.path.isdir(w2d.cache_dir):
+            return []
+        return [name for name in os.listdir(w2d.cache_dir) if not name.startswith('index.')]
+
+    def check_too_large(self, chunked):
+        url = self.site.add_page('/large.html', self.large_body, chunked=chunked)
+        self.assertRaises(w2d.DownloadTooLargeError, w2d.get_url, url)
+        self.assertFalse(os.path.exists(w2d.get_cache_filename(url)))
+        self.assertEqual([name for name in self.get_cache_dir_files() if name.endswith('.download')], [])  # temporary file removed
+
+    def test_content_length_too_large(self):
+        self.check_too_large(chunked=False)
+
+    def test_chunked_too_large(self):
+        self.check_too_large(chunked=True)
+
+    def test_without_connection_pool(self):
+        self.set_env('W2D_CONNECTION_POOL', 'false')
+        w2d.load_config()
+        for chunked in (False, True):
+            self.check_too_large(chunked=chunked)
+
+    def test_within_limit(self):
+        for chunked in (False, True):
+            url = self.site.add_page('/small%s.html' % chunked, self.small_body, chunked=chunked)
+            self.assertEqual(w2d.get_url(url), self.small_body)
+            self.assertEqual(w2d.get_url(url, cache=False), self.small_body)
+            self.assertTrue(os.path.exists(w2d.get_cache_filename(url)))
+
+    def test_not_cached_too_large(self):
+        url = self.site.add_page('/large.html', self.large_body, chunked=True)
+        self.assertRaises(w2d.DownloadTooLargeError, w2d.get_url, url, cache=False)
+
+    def test_no_limit(self):
+        self.set_env('W2D_MAX_DOWNLOAD_BYTES', '0')
+        w2d.load_config()
+        url = self.site.add_page('/large.html', self.large_body, chunked=True)
+        self.assertEqual(w2d.get_url(url), self.large_body)
+
+    def test_existing_entry_kept(self):
+        # a refresh that is too large leaves the previous cache entry as-is
+        url = self.site.add_page('/page.html', self.small_body)
+        w2d.get_url(url)
+        self.site.add_page('/page.html', self.large_body, chunked=True)
+        self.assertRaises(w2d.DownloadTooLargeError, w2d.get_url, url, force=True)
+        self.assertEqual(w2d.get_url(url), self.small_body)
+        self.assertEqual(self.site.request_counts['/page.html'], 2)
+
+    def test_explicit_max_bytes(self):
+        url = self.site.add_page('/small.html', self.small_body)
+        self.assertRaises(w2d.DownloadTooLargeError, w2d.easy_get_url_response, url, max_bytes=100)
+        self.assertEqual(w2d.easy_get_url_response(url, max_bytes=0)[3], self.small_body)
+
+    @support.unittest.skipIf(aio is None, 'w2d.aio is Python 3.5+')
+    def test_aio(self):
+        url = self.site.add_page('/large.html', self.large_body, chunked=True)
+        results = aio.get_urls([url, self.site.add_page('/small.html', self.small_body)], ignore_errors=True)
+        self.assertIsInstance(results[0], w2d.DownloadTooLargeError)
+        self.assertEqual(results[1], self.small_body)
+        self.assertFalse(os.path.exists(w2d.get_cache_filename(url)))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
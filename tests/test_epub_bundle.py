@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Multi article epub bundle (a chapter per url), with the fake pandoc
+"""
+
+import unittest
+
+import w2d
+from w2d import sinks
+
+from tests import support
+
+
+class ChapterHtmlTest(unittest.TestCase):
+    def test_demote_headings(self):
+        self.assertEqual(w2d.demote_headings('<h1 id="a">A</h1><H2>B</H2><h6>C</h6><hr>'), '<h2 id="a">A</h2><h3>B</h3><h6>C</h6><hr>')
+        self.assertEqual(w2d.demote_headings('<h1>A</h1>', levels=2), '<h3>A</h3>')
+
+    def test_chapter_html(self):
+        chapter = {'title': 'Fish & <Chips>', 'content': '<h1>Article</h1><p>text</p>', 'url': 'http://example.com/?a=1&b="2"', 'author': 'Someone', 'date': None}
+        html = w2d.get_chapter_html(chapter)
+        self.assertTrue(html.startswith('<h1>Fish &amp; &lt;Chips&gt;</h1>\n<p>Someone, <a href="http://example.com/?a=1&amp;b=&quot;2&quot;">'), html)
+        self.assertIn('<h2>Article</h2><p>text</p>', html)
+
+
+@unittest.skipIf(w2d.is_win, 'fake pandoc is a posix script')
+class EpubBundleTest(support.LocalSiteTestCase):
+    environ = {'W2D_EPUB_TOOL': 'pandoc', 'W2D_EXTRACTOR': 'raw', 'W2D_PANDOC_SERVER': ''}
+
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.set_env('W2D_PANDOC_EXE', support.write_fake_pandoc(self.temp_dir))
+        w2d.load_config()
+        self.urls = [self.site.add_html('/%d.html' % counter, support.make_article('Article %d' % counter)) for counter in range(3)]
+
+    def get_epub(self, sink, result_metadata):
+        documents = dict((name, data) for name, data, metadata in sink.documents)
+        return documents[result_metadata['filename']].decode('utf-8')
+
+    def check_bundle(self, fetch_workers):
+        sink = sinks.MemorySink()
+        result_metadata = w2d.dump_epub_bundle(self.urls, output_filename='digest.epub', title='Digest', fetch_workers=fetch_workers, cpu_workers=1, output_sink=sink)
+        self.assertEqual(result_metadata['filename'], 'digest.epub')
+        self.assertEqual(result_metadata['failed'], [])
+        self.assertEqual([chapter['url'] for chapter in result_metadata['chapters']], self.urls)
+        epub = self.get_epub(sink, result_metadata)
+        self.assertTrue(epub.startswith('fake pandoc epub Digest\n'), epub[:100])  # one pandoc conversion for the whole bundle
+        positions = [epub.index('<h1>Article %d</h1>' % counter) for counter in range(3)]  # chapter headings, in url order
+        self.assertEqual(positions, sorted(positions))
+        self.assertIn('<h2>Article 0</h2>', epub)  # article heading nested under the chapter heading
+
+    def test_bundle(self):
+        self.check_bundle(1)
+
+    def test_bundle_fetch_threads(self):
+        self.check_bundle(4)
+
+    def test_failed_url_left_out(self):
+        urls = self.urls[:1] + [self.site.url('/missing.html')] + self.urls[1:]
+        sink = sinks.MemorySink()
+        result_metadata = w2d.dump_epub_bundle(urls, title='Digest', output_sink=sink)
+        self.assertEqual(result_metadata['filename'], 'Digest.epub')
+        self.assertEqual([url for url, error in result_metadata['failed']], [self.site.url('/missing.html')])
+        self.assertEqual([chapter['url'] for chapter in result_metadata['chapters']], self.urls)
+        self.assertNotIn('missing', self.get_epub(sink, result_metadata))
+
+    def test_failed_url_raises(self):
+        urls = self.urls + [self.site.url('/missing.html')]
+        self.assertRaises(w2d.HTTPError, w2d.dump_epub_bundle, urls, ignore_errors=False, output_sink=sinks.MemorySink())
+
+    def test_render_epub_bundle(self):
+        page_info_list = w2d.extract_pages(self.urls, extractor_function=w2d.extractor_raw)
+        calls = []
+
+        def epub_bundle_output_function(output_filename, chapters, title=None, content_format=None):
+            calls.append((title, [chapter['title'] for chapter in chapters]))
+            f = open(output_filename, 'wb')
+            f.write(b'epub')
+            f.close()
+        sink = sinks.MemorySink()
+        result_metadata = w2d.render_epub_bundle(page_info_list, epub_bundle_output_function=epub_bundle_output_function, output_sink=sink)
+        self.assertTrue(result_metadata['title'].startswith('w2d digest '))
+        self.assertEqual(calls, [(result_metadata['title'], ['Article 0', 'Article 1', 'Article 2'])])
+        self.assertEqual(sink.documents[0][1], b'epub')
+
+    def test_render_errors(self):
+        self.assertRaises(ValueError, w2d.render_epub_bundle, [], output_sink=sinks.MemorySink())
+        page_info_list = w2d.extract_pages(self.urls[:1], content_format=w2d.FORMAT_MARKDOWN, extractor_function=w2d.extractor_raw)
+        self.assertRaises(NotImplementedError, w2d.render_epub_bundle, page_info_list, output_sink=sinks.MemorySink())
+
+
+if __name__ == '__main__':
+    unittest.main()
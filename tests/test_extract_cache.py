@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Extraction result cache (extract/ in the scrape cache)
+"""
+
+import os
+import time
+
+import w2d
+from w2d import cache
+
+from tests import support
+
+
+extractor_calls = []
+
+def extractor_fetches_itself(url, page_content=None, format=w2d.FORMAT_HTML, title=None):
+    """Stand in for the postlight extractors, never given content and does no network IO"""
+    extractor_calls.append((url, page_content, format))
+    return {
+        'content': '<p>extracted %s</p>' % url,
+        'author': None,
+        'date_published': None,
+        'excerpt': None,
+        'title': 'Fetches Itself',
+        'word_count': 2,
+    }
+
+
+class ExtractCacheTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.url = self.site.add_html('/page.html', support.make_article('Cached'))
+
+    def test_extraction_cache(self):
+        page_info = w2d.extract_page(self.url, extractor_function=w2d.extractor_raw, extract_cache=True)
+        self.assertEqual(page_info['timings'].cache['extract'], 'miss')
+        page_info = w2d.extract_page(self.url, extractor_function=w2d.extractor_raw, extract_cache=True)
+        self.assertEqual(page_info['timings'].cache['extract'], 'hit')
+        entries = w2d.get_cache_index()._query('SELECT %s FROM entries' % ', '.join(cache.ENTRY_COLUMNS))
+        extract_entries = [entry for entry in entries if entry['hash'].startswith(cache.EXTRACT_DIRNAME + '/')]
+        self.assertEqual(len(extract_entries), 1)
+        self.assertEqual(extract_entries[0]['url'], self.url)
+        self.assertNotEqual(w2d.get_cache_index().lookup_url(self.url)['hash'], extract_entries[0]['hash'])
+        # evicted with the scrape cache
+        cache.compact(w2d.cache_dir, max_entries=0, index=w2d.get_cache_index())
+        self.assertFalse(os.path.exists(os.path.join(w2d.cache_dir, extract_entries[0]['hash'])))
+
+    def test_extraction_cache_disabled(self):
+        page_info = w2d.extract_page(self.url, extractor_function=w2d.extractor_raw, extract_cache=False)
+        self.assertNotIn('extract', page_info['timings'].cache)
+        self.assertFalse(os.path.exists(os.path.join(w2d.cache_dir, w2d.EXTRACT_CACHE_DIRNAME)))
+
+
+class UrlKeyedExtractCacheTest(support.LocalSiteTestCase):
+    """Extractors that fetch the page themselves, the page is not fetched for the cache key"""
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.url = self.site.add_html('/page.html', support.make_article('Cached'))
+        del extractor_calls[:]
+
+    def extract(self, url, content_format=w2d.FORMAT_HTML):
+        return w2d.extract_page(url, content_format=content_format, extractor_function=extractor_fetches_itself, extract_cache=True)
+
+    def test_no_prefetch(self):
+        page_info = self.extract(self.url)
+        self.assertEqual(page_info['timings'].cache['extract'], 'miss')
+        self.assertEqual(extractor_calls, [(self.url, None, w2d.FORMAT_HTML)])
+        self.assertNotIn('fetch', page_info['timings'].cache)
+        self.assertEqual(self.site.request_counts, {})
+
+    def test_keyed_on_canonical_url_and_format(self):
+        self.extract(self.url)
+        page_info = self.extract(self.url + '?utm_source=test')
+        self.assertEqual(page_info['timings'].cache['extract'], 'hit')
+        self.assertEqual(page_info['title'], 'Fetches Itself')
+        self.assertEqual(len(extractor_calls), 1)
+        page_info = self.extract(self.url, content_format=w2d.FORMAT_MARKDOWN)
+        self.assertEqual(page_info['timings'].cache['extract'], 'miss')
+        self.assertEqual(len(extractor_calls), 2)
+        self.assertEqual(self.site.request_counts, {})
+
+    def test_expired(self):
+        self.extract(self.url)
+        self.set_env('W2D_CACHE_MAX_AGE', '60')
+        connection = w2d.get_cache_index()._get_connection()
+        with connection:
+            connection.execute('UPDATE entries SET fetch_time = ?', (time.time() - 120,))
+        page_info = self.extract(self.url)
+        self.assertEqual(page_info['timings'].cache['extract'], 'miss')
+        self.assertEqual(len(extractor_calls), 2)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Extract once, render many; process_page_formats() and W2D_OUTPUT_FORMAT=all
+"""
+
+import unittest
+
+import w2d
+from w2d import sinks
+
+from tests import support
+
+
+def fake_epub_output_function(output_filename, url=None, content=None, title='Title Unknown', content_format=w2d.FORMAT_HTML):
+    f = open(output_filename, 'wb')
+    f.write(b'epub ' + w2d.to_byte(content))
+    f.close()
+
+
+class ProcessPageFormatsTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.url = self.site.add_html('/page.html', support.make_article('All Formats'))
+        self.extract_count = 0
+        extract_page = w2d.extract_page
+
+        def counting_extract_page(*args, **kwargs):
+            self.extract_count += 1
+            return extract_page(*args, **kwargs)
+        w2d.extract_page = counting_extract_page
+        self.addCleanup(setattr, w2d, 'extract_page', extract_page)
+
+    def check_formats(self, extractor_function):
+        sink = sinks.MemorySink()
+        result_metadata_list = w2d.process_page_formats(self.url, output_formats=w2d.get_output_format_list(w2d.FORMAT_ALL), extractor_function=extractor_function, epub_output_function=fake_epub_output_function, output_sink=sink, extract_cache=False)
+        self.assertEqual(self.extract_count, 1)
+        self.assertEqual(self.site.request_counts['/page.html'], 1)
+        self.assertEqual([result_metadata['format'] for result_metadata in result_metadata_list], w2d.SUPPORTED_FORMATS)
+        documents = dict((name, data) for name, data, metadata in sink.documents)
+        self.assertEqual(sorted(documents), sorted(result_metadata['filename'] for result_metadata in result_metadata_list))
+        self.assertIn(b'<p>Words about All Formats', documents['All_Formats.html'])
+        markdown = documents['All_Formats.md']
+        self.assertTrue(markdown.startswith(b'# All Formats\n'))
+        self.assertNotIn(b'<p>', markdown)  # rendered from the html extraction
+        self.assertIn(b'Words about All Formats', markdown)
+        self.assertTrue(documents['All_Formats.epub'].startswith(b'epub '))
+
+    def test_readability(self):
+        self.check_formats(w2d.extractor_readability)
+
+    def test_raw(self):
+        self.check_formats(w2d.extractor_raw)
+
+    def test_single_format(self):
+        sink = sinks.MemorySink()
+        result_metadata = w2d.process_page(self.url, output_format=w2d.FORMAT_MARKDOWN, extractor_function=w2d.extractor_readability, output_sink=sink, extract_cache=False)
+        self.assertEqual(self.extract_count, 1)
+        self.assertEqual(result_metadata['filename'], 'All_Formats.md')
+        self.assertEqual([name for name, data, metadata in sink.documents], ['All_Formats.md'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""import w2d cost (python -X importtime, Python 3.7+) and side effects, in fresh interpreters in an empty directory.
+Budget is W2D_IMPORT_BUDGET_MS (default 100) milliseconds, fastest of several interpreters (other load on the machine only ever adds time).
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from tests import support
+
+
+LAZY_MODULES = ('bs4', 'lxml', 'markdownify', 'pypub', 'readability', 'trafilatura')  # optional, imported on first use
+
+
+def parse_importtime(stderr_text):
+    """Returns list of (module name, self microseconds, cumulative microseconds, depth) from python -X importtime output"""
+    result = []
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        result.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return result
+
+
+def get_slowest_imports(import_times, module_name, count=10):
+    """Direct imports of module_name, slowest first, as (name, milliseconds). Children are listed before their parent"""
+    top_level = []
+    children = []
+    for name, self_us, cumulative_us, depth in import_times:
+        if depth == 0:
+            if name == module_name:
+                top_level = children
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative_us / 1000.0))
+    top_level.sort(key=lambda x: x[1], reverse=True)
+    return top_level[:count]
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'python -X importtime is Python 3.7+')
+class ImportTimeTest(unittest.TestCase):
+    module_name = 'w2d'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.budget_ms = float(os.environ.get('W2D_IMPORT_BUDGET_MS', 100))
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join([support.PACKAGE_DIR] + [x for x in [env.get('PYTHONPATH')] if x])
+        cmd = [sys.executable, '-X', 'importtime', '-c', 'import sys, %s; print(" ".join(sorted(sys.modules)))' % cls.module_name]
+        work_dir = tempfile.mkdtemp(prefix='w2d_test_')
+        try:
+            cls.times_ms = []
+            for _ in range(5):
+                p = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stdout_value, stderr_value = p.communicate()
+                if p.returncode != 0:
+                    raise RuntimeError('import failed %r' % stderr_value)
+                cls.import_times = parse_importtime(stderr_value.decode('utf-8'))
+                cls.times_ms.append([cumulative_us for name, self_us, cumulative_us, depth in cls.import_times if name == cls.module_name][-1] / 1000.0)
+            cls.files_created = sorted(os.listdir(work_dir))
+        finally:
+            shutil.rmtree(work_dir)
+        cls.loaded_modules = stdout_value.decode('utf-8').split()
+
+    def test_within_budget(self):
+        self.assertLessEqual(min(self.times_ms), self.budget_ms, 'times %r, slowest imports %r' % (self.times_ms, get_slowest_imports(self.import_times, self.module_name)))
+
+    def test_optional_modules_not_imported(self):
+        self.assertEqual([name for name in LAZY_MODULES if name in self.loaded_modules], [])
+
+    def test_no_files_created(self):
+        self.assertEqual(self.files_created, [])
+
+    def test_parse_importtime(self):
+        stderr_text = 'import time: self [us] | cumulative | imported package\nimport time:       120 |        120 |   json.decoder\nimport time:       300 |        420 | json\n'
+        self.assertEqual(parse_importtime(stderr_text), [('json.decoder', 120, 120, 1), ('json', 300, 420, 0)])
+        self.assertEqual(get_slowest_imports(parse_importtime(stderr_text), 'json'), [('json.decoder', 0.12)])
+
+
+if __name__ == '__main__':
+    unittest.main()
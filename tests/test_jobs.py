@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Resumable batch jobs (w2d.jobs), job store states and resuming an interrupted batch
+"""
+
+import os
+import unittest
+
+import w2d
+from w2d import jobs
+from w2d import sinks
+
+from tests import support
+
+
+class InterruptingSink(sinks.MemorySink):
+    """MemorySink that raises KeyboardInterrupt (as if the batch was stopped) instead of writing document number limit + 1"""
+    def __init__(self, limit):
+        sinks.MemorySink.__init__(self)
+        self.limit = limit
+
+    def write(self, name, data, metadata=None):
+        if len(self.documents) >= self.limit:
+            raise KeyboardInterrupt()
+        return sinks.MemorySink.write(self, name, data, metadata=metadata)
+
+
+class JobStoreTest(support.TempDirTestCase):
+    def setUp(self):
+        support.TempDirTestCase.setUp(self)
+        self.store = jobs.JobStore(os.path.join(self.temp_dir, 'batch.sqlite3'))
+
+    def tearDown(self):
+        self.store.close()
+        support.TempDirTestCase.tearDown(self)
+
+    def test_states(self):
+        urls = ['http://example.com/%d' % counter for counter in range(3)]
+        self.assertEqual(self.store.add(urls), 3)
+        self.assertEqual(self.store.add(urls[:1] + ['http://example.com/new']), 1)  # existing urls keep their state
+        self.store.set_state(urls[0], jobs.STATE_FETCHED)
+        self.store.set_state(urls[1], jobs.STATE_RENDERED, result=[{'filename': 'one.md'}])
+        self.store.set_failed(urls[0], 'HTTPError: 404')
+        self.store.set_failed(urls[0], 'HTTPError: 404')  # already failed, not counted again
+        self.assertEqual([job['url'] for job in self.store.get_jobs()], urls + ['http://example.com/new'])
+        failed_job = self.store.get_jobs(states=[jobs.STATE_FAILED])[0]
+        self.assertEqual((failed_job['url'], failed_job['failed_state'], failed_job['attempts'], failed_job['error']), (urls[0], jobs.STATE_FETCHED, 1, 'HTTPError: 404'))
+        self.assertEqual(self.store.get_jobs(states=[jobs.STATE_RENDERED])[0]['result'], [{'filename': 'one.md'}])
+        self.assertEqual(self.store.counts(), {jobs.STATE_PENDING: 2, jobs.STATE_FETCHED: 0, jobs.STATE_EXTRACTED: 0, jobs.STATE_RENDERED: 1, jobs.STATE_FAILED: 1})
+        self.assertEqual(self.store.retry_failed(), 1)
+        self.assertEqual(self.store.counts()[jobs.STATE_PENDING], 3)
+
+    def test_reopen(self):
+        self.store.add(['http://example.com/'])
+        self.store.close()
+        self.assertEqual(jobs.JobStore(self.store.db_filename).counts()[jobs.STATE_PENDING], 1)
+
+
+class RunBatchTest(support.LocalSiteTestCase):
+    environ = {'W2D_EXTRACTOR': 'raw', 'W2D_OUTPUT_FORMAT': 'html'}
+
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.db_filename = os.path.join(self.temp_dir, 'batch.sqlite3')
+        self.paths = ['/%d.html' % counter for counter in range(4)]
+        for path in self.paths:
+            self.site.add_html(path, support.make_article('Page %s' % path[1]))
+        self.urls = [self.site.url(path) for path in self.paths]
+        self.urls.insert(2, self.site.url('/missing.html'))  # 404
+        w2d.close_output_sink()  # W2D_OUTPUT_SINK is read when the default sink is opened
+
+    def tearDown(self):
+        w2d.close_output_sink()
+        jobs.get_job_store(self.db_filename).close()
+        support.LocalSiteTestCase.tearDown(self)
+
+    def get_names(self, sink):
+        return sorted(name for name, data, metadata in sink.documents)
+
+    def check_batch(self, fetch_workers, cpu_workers):
+        sink = sinks.MemorySink()
+        counts = jobs.run_batch(self.db_filename, urls=self.urls, fetch_workers=fetch_workers, cpu_workers=cpu_workers, output_sink=sink)
+        self.assertEqual((counts[jobs.STATE_RENDERED], counts[jobs.STATE_FAILED]), (4, 1))
+        self.assertEqual(self.get_names(sink), ['Page_%d.html' % counter for counter in range(4)])
+        store = jobs.get_job_store(self.db_filename)
+        failed_job = store.get_jobs(states=[jobs.STATE_FAILED])[0]
+        self.assertEqual((failed_job['url'], failed_job['failed_state']), (self.site.url('/missing.html'), jobs.STATE_PENDING))
+        self.assertTrue(failed_job['error'].startswith('HTTPError'), failed_job['error'])
+        rendered_job = store.get_jobs(states=[jobs.STATE_RENDERED])[0]
+        self.assertEqual(rendered_job['result'][0]['filename'], 'Page_0.html')
+
+        # nothing left to do, failed urls are not retried unless asked to
+        sink = sinks.MemorySink()
+        jobs.run_batch(self.db_filename, fetch_workers=fetch_workers, cpu_workers=cpu_workers, output_sink=sink)
+        self.assertEqual(sink.documents, [])
+        self.site.add_html('/missing.html', support.make_article('Found'))
+        counts = jobs.run_batch(self.db_filename, retry_failed=True, fetch_workers=fetch_workers, cpu_workers=cpu_workers, output_sink=sink)
+        self.assertEqual(self.get_names(sink), ['Found.html'])
+        self.assertEqual((counts[jobs.STATE_RENDERED], counts[jobs.STATE_FAILED]), (5, 0))
+
+    def test_serial(self):
+        self.check_batch(1, 1)
+
+    def test_fetch_threads(self):
+        self.check_batch(4, 1)
+
+    def test_worker_processes(self):
+        self.check_batch(4, 2)
+
+    def check_resume(self, fetch_workers):
+        urls = [self.site.url(path) for path in self.paths]
+        sink = InterruptingSink(2)
+        self.assertRaises(KeyboardInterrupt, jobs.run_batch, self.db_filename, urls=urls, fetch_workers=fetch_workers, cpu_workers=1, output_sink=sink)
+        counts = jobs.get_job_store(self.db_filename).counts()
+        self.assertEqual(counts[jobs.STATE_RENDERED], 2)
+        self.assertEqual(counts[jobs.STATE_FAILED], 0)
+
+        sink = sinks.MemorySink()
+        counts = jobs.run_batch(self.db_filename, fetch_workers=fetch_workers, cpu_workers=1, output_sink=sink)
+        self.assertEqual(counts[jobs.STATE_RENDERED], 4)
+        self.assertEqual(len(sink.documents), 2)  # only the urls not rendered before the interruption
+        rendered_names = [job['result'][0]['filename'] for job in jobs.get_job_store(self.db_filename).get_jobs()]
+        self.assertEqual(sorted(rendered_names), ['Page_%d.html' % counter for counter in range(4)])
+        for path in self.paths:
+            self.assertEqual(self.site.request_counts[path], 1)  # fetched once, across both runs
+
+    def test_resume(self):
+        self.check_resume(1)
+
+    def test_resume_fetch_threads(self):
+        self.check_resume(4)
+
+    def test_resume_fetched(self):
+        # interrupted after the fetch, before rendering, continues without fetching again
+        store = jobs.get_job_store(self.db_filename)
+        store.add(self.urls[:1], output_format=w2d.FORMAT_MARKDOWN)
+        self.assertTrue(jobs.fetch_job(self.db_filename, self.urls[0], w2d.FORMAT_MARKDOWN))
+        self.assertEqual(store.get_jobs()[0]['state'], jobs.STATE_FETCHED)
+        sink = sinks.MemorySink()
+        jobs.run_batch(self.db_filename, output_sink=sink)
+        self.assertEqual(self.get_names(sink), ['Page_0.md'])  # format recorded when added
+        self.assertEqual(self.site.request_counts[self.paths[0]], 1)
+
+    def test_resume_existing_archive(self):
+        # archive sinks replace an existing file, resuming onto the previous run's archive is refused
+        zip_filename = os.path.join(self.temp_dir, 'out.zip')
+        self.set_env('W2D_OUTPUT_SINK', zip_filename)
+        w2d.load_config()
+        try:
+            jobs.run_batch(self.db_filename, urls=self.urls[:1])
+        finally:
+            w2d.close_output_sink()
+        archive_data = support.read_file(zip_filename)
+        self.assertRaises(ValueError, jobs.run_batch, self.db_filename, urls=self.urls[1:2])
+        self.assertEqual(jobs.main(['w2d.jobs', 'run', self.db_filename]), 1)
+        self.assertEqual(support.read_file(zip_filename), archive_data)
+        self.assertEqual(jobs.get_job_store(self.db_filename).counts()[jobs.STATE_PENDING], 0)  # nothing added
+        self.set_env('W2D_OUTPUT_SINK', os.path.join(self.temp_dir, 'out2.tar.gz'))
+        try:
+            counts = jobs.run_batch(self.db_filename, urls=self.urls[1:2])
+        finally:
+            w2d.close_output_sink()
+        self.assertEqual(counts[jobs.STATE_RENDERED], 2)
+        self.assertTrue(sinks.is_archive_filename('Out.TGZ'))
+        self.assertFalse(sinks.is_archive_filename('out'))
+
+    def test_main(self):
+        self.assertEqual(jobs.main(['w2d.jobs', 'status', self.db_filename]), 1)  # not found
+        self.set_env('W2D_OUTPUT_SINK', os.path.join(self.temp_dir, 'out'))
+        w2d.load_config()
+        try:
+            self.assertEqual(jobs.main(['w2d.jobs', 'run', self.db_filename] + self.urls), 1)  # a url failed
+        finally:
+            w2d.close_output_sink()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.temp_dir, 'out'))), ['Page_%d.html' % counter for counter in range(4)])
+        self.assertEqual(jobs.main(['w2d.jobs', 'failed', self.db_filename]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
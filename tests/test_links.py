@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Relative link resolution and re-writing, lxml and the streaming (no lxml) fallback
+"""
+
+import unittest
+
+try:
+    # Py3
+    from urllib.parse import urljoin
+except ImportError:
+    # Py2
+    from urlparse import urljoin
+
+import w2d
+
+
+BASE_URL = 'https://example.com/wiki/dir/page.html?q=1'
+
+PAGE = '''<html><head><title>Links</title></head><body>
+<a href="other.html">relative</a>
+<a href="../up.html">up</a>
+<a href="/root.html">root</a>
+<a href="//cdn.example.org/x.js">protocol relative</a>
+<a href="#section">anchor</a>
+<a href="mailto:someone@example.com">mail</a>
+<a href="https://elsewhere.example.net/">absolute</a>
+<img src="a.png" srcset="a.png 1x, /b.png 2x">
+</body></html>'''
+
+EXPECTED_LINKS = [
+    'https://example.com/wiki/dir/other.html',
+    'https://example.com/wiki/up.html',
+    'https://example.com/root.html',
+    'https://cdn.example.org/x.js',
+    '#section',
+    'mailto:someone@example.com',
+    'https://elsewhere.example.net/',
+    'https://example.com/wiki/dir/a.png',
+    'https://example.com/wiki/dir/a.png 1x, https://example.com/b.png 2x',
+]
+
+
+class ResolveUrlTest(unittest.TestCase):
+    def test_same_as_urljoin(self):
+        for link in ('other.html', '../up.html', './same.html', '/root.html', '/root.html?a=b', '//cdn.example.org/x.js',
+                     '?q=2', 'https://elsewhere.example.net/a', 'http://elsewhere.example.net', 'sub/dir/', '/a/../b'):
+            self.assertEqual(w2d.resolve_url(BASE_URL, link), urljoin(BASE_URL, link), link)
+
+    def test_fast_path_edge_cases(self):
+        # links that look like the fast paths (absolute, protocol relative, root relative) but need urljoin()
+        for link in ('//', '///x.html', 'https://example.org/a/../b', '/a/./b', '/a\\b', '/a\tb', '//cdn.example.org/../x'):
+            self.assertEqual(w2d.resolve_url(BASE_URL, link), urljoin(BASE_URL, link), repr(link))
+        for base_url in ('http://example.com:8080/a/b', 'https://user@example.com/'):
+            self.assertEqual(w2d.resolve_url(base_url, '/root.html'), urljoin(base_url, '/root.html'))
+            self.assertEqual(w2d.resolve_url(base_url, '//cdn.example.org/x.js'), urljoin(base_url, '//cdn.example.org/x.js'))
+
+    def test_get_base_url(self):
+        self.assertEqual(w2d.get_base_url(BASE_URL, "<head><base target=_blank href='/b/?x=1&amp;y=2'></head>"), 'https://example.com/b/?x=1&y=2')
+        self.assertEqual(w2d.get_base_url(BASE_URL, '<head><base href=""></head>'), BASE_URL)
+        self.assertEqual(w2d.get_base_url(BASE_URL, '<head></head>'), BASE_URL)
+
+    def test_unresolved(self):
+        for link in ('#top', 'data:image/png;base64,AAAA', 'mailto:a@example.com', 'javascript:void(0)', 'tel:123', ''):
+            self.assertEqual(w2d.resolve_url(BASE_URL, link), link)
+
+    def test_srcset(self):
+        self.assertEqual(w2d.rewrite_srcset(BASE_URL, 'a.png 1x,  //cdn.example.org/b.png 2x'), 'https://example.com/wiki/dir/a.png 1x, https://cdn.example.org/b.png 2x')
+
+
+def get_link_values(html):
+    parser = LinkCollector()
+    parser.feed(html)
+    parser.close()
+    return parser.values
+
+
+class LinkCollector(w2d.html_parser.HTMLParser):
+    def __init__(self):
+        w2d.html_parser.HTMLParser.__init__(self)
+        self.values = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        for name in ('href', 'src', 'srcset'):
+            if name in attrs and tag != 'base':
+                self.values.append(attrs[name])
+
+
+class RewriteLinksTest(unittest.TestCase):
+    def rewrite(self, content, url, base_url=None):
+        return w2d.rewrite_links(content, url, base_url=base_url)
+
+    def test_rewrite(self):
+        self.assertEqual(get_link_values(self.rewrite(PAGE, BASE_URL)), EXPECTED_LINKS)
+
+    def test_base_href(self):
+        page = PAGE.replace('<title>', '<base href="https://base.example.org/b/"><title>')
+        values = get_link_values(self.rewrite(page, BASE_URL))
+        self.assertEqual(values[0], 'https://base.example.org/b/other.html')
+        self.assertEqual(values[2], 'https://base.example.org/root.html')
+
+    def test_text_unchanged(self):
+        result = self.rewrite('<p>Fish &amp; chips <b>bold</b> <a href="x.html">x</a></p>', BASE_URL)
+        self.assertIn('Fish &amp; chips <b>bold</b>', result)
+
+    def test_other_elements(self):
+        page = ('<html><head><link rel="stylesheet" href="style.css"></head><body>'
+                '<video src="v.mp4" poster="poster.jpg"><source src="v.webm" type="video/webm"><track src="subs.vtt"></video>'
+                '<picture><source srcset="wide.png 800w, /narrow.png 400w"></picture><iframe src="/embed"></iframe>'
+                '<div data-src="lazy.png"><form action="submit.cgi"></form></div></body></html>')
+        self.assertEqual(get_link_values(self.rewrite(page, BASE_URL)), [
+            'https://example.com/wiki/dir/style.css',
+            'https://example.com/wiki/dir/v.mp4',
+            'https://example.com/wiki/dir/v.webm',
+            'https://example.com/wiki/dir/subs.vtt',
+            'https://example.com/wiki/dir/wide.png 800w, https://example.com/narrow.png 400w',
+            'https://example.com/embed',
+        ])
+        result = self.rewrite(page, BASE_URL)
+        self.assertIn('https://example.com/wiki/dir/poster.jpg', result)
+        self.assertIn('data-src="lazy.png"', result)  # not a link attribute
+        self.assertIn('action="submit.cgi"', result)
+
+    def test_many_links(self):
+        # Wikipedia like page, thousands of relative, root relative, in page and protocol relative links
+        paragraphs = []
+        for counter in range(1000):
+            paragraphs.append('<p><a href="/wiki/Page_%d">root</a> <a href="#cite_note-%d">[%d]</a> <a href="Other_%d">relative</a>'
+                              ' <img src="//upload.example.org/%d.png" srcset="//upload.example.org/%d-2x.png 2x"></p>\n' % ((counter,) * 6))
+        page = '<html><head><title>links</title></head><body>%s</body></html>' % ''.join(paragraphs)
+        values = get_link_values(self.rewrite(page, BASE_URL))
+        self.assertEqual(len(values), 5000)
+        self.assertEqual(values[-5:], [
+            'https://example.com/wiki/Page_999',
+            '#cite_note-999',
+            'https://example.com/wiki/dir/Other_999',
+            'https://upload.example.org/999.png',
+            'https://upload.example.org/999-2x.png 2x',
+        ])
+        self.assertEqual(values, get_link_values(w2d.LinkRewriter(BASE_URL).rewrite(page)))  # same as the streaming fallback
+
+
+class LinkRewriterTest(RewriteLinksTest):
+    """Streaming fallback, used without lxml"""
+    def rewrite(self, content, url, base_url=None):
+        return w2d.LinkRewriter(base_url or url).rewrite(content)
+
+    def test_markup_preserved(self):
+        page = '<!DOCTYPE html><p class=x>a<br/>b <!-- comment --> &copy; &#169;</p>'
+        self.assertEqual(self.rewrite(page, BASE_URL), page)
+
+    def test_only_first_base(self):
+        page = '<base href="/first/"><base href="/second/"><a href="x.html">x</a>'
+        self.assertEqual(get_link_values(self.rewrite(page, BASE_URL)), ['https://example.com/first/x.html'])
+
+
+@unittest.skipIf(not w2d.lxml, 'needs lxml')
+class ParsedDocumentTest(unittest.TestCase):
+    def test_modified_in_place(self):
+        document = w2d.ParsedDocument(PAGE)
+        result = w2d.rewrite_links(document, BASE_URL)
+        self.assertEqual(get_link_values(result), EXPECTED_LINKS)
+        self.assertEqual(get_link_values(document.tostring()), EXPECTED_LINKS)  # the parsed tree is re-used, e.g. by localize_images()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Per stage page timings, cache results, metrics_callback, W2D_TRACE_FILE and W2D_PROFILE
+"""
+
+import json
+import os
+import sys
+
+import w2d
+from w2d import sinks
+
+from tests import support
+
+
+class PageTimingsTest(support.TempDirTestCase):
+    def test_nested_stages(self):
+        timings = w2d.PageTimings()
+        with w2d.active_page_timings(timings):
+            with w2d.timed_stage('extract'):
+                with w2d.timed_stage('extract.readability'):
+                    pass
+            with w2d.timed_stage('extract'):
+                pass
+            w2d.record_cache_result('fetch', 'hit')
+        self.assertEqual(sorted(timings.stages), ['extract', 'extract.readability'])
+        self.assertTrue(timings.stages['extract'] >= timings.stages['extract.readability'])  # accumulated, includes the nested stage
+        self.assertEqual(timings.cache, {'fetch': 'hit'})
+        self.assertEqual(w2d.get_page_timings(), None)
+
+    def test_outside_page(self):
+        with w2d.timed_stage('extract'):
+            pass  # no-op
+        w2d.record_cache_result('fetch', 'hit')
+        self.assertEqual(w2d.get_page_timings(), None)
+
+    def test_get_package_name(self):
+        self.assertEqual(w2d.get_package_name(w2d.__file__), 'w2d')
+        self.assertEqual(w2d.get_package_name(os.__file__), 'stdlib')
+        self.assertEqual(w2d.get_package_name('<string>'), 'builtins')
+        self.assertEqual(w2d.sum_by_package([(w2d.__file__, 1), (w2d.__file__, 2), (os.__file__, 4)]), {'w2d': 3, 'stdlib': 4})
+
+
+class PageMetricsTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.url = self.site.add_html('/page.html', support.make_article('Metrics'))
+        self.records = []
+        self.saved_metrics_callback = w2d.metrics_callback
+        w2d.metrics_callback = self.records.append
+
+    def tearDown(self):
+        w2d.metrics_callback = self.saved_metrics_callback
+        support.LocalSiteTestCase.tearDown(self)
+
+    def process(self, output_formats=(w2d.FORMAT_HTML,)):
+        return w2d.process_page_formats(self.url, output_formats=list(output_formats), extractor_function=w2d.extractor_raw, output_sink=sinks.MemorySink())
+
+    def test_timings(self):
+        result_metadata = self.process()[0]
+        for stage_name in ('fetch', 'extract', 'link_rewrite', 'write', 'total'):
+            self.assertIn(stage_name, result_metadata['timings'])
+        self.assertEqual(result_metadata['cache'], {'fetch': 'miss', 'extract': 'miss'})
+        self.assertEqual(self.process()[0]['cache'], {'fetch': 'hit', 'extract': 'hit'})
+
+    def test_metrics_callback(self):
+        result_metadata_list = self.process([w2d.FORMAT_HTML, w2d.FORMAT_MARKDOWN])
+        self.assertEqual([(record['url'], record['format']) for record in self.records], [(self.url, w2d.FORMAT_HTML), (self.url, w2d.FORMAT_MARKDOWN)])
+        self.assertEqual(self.records[1]['timings'], result_metadata_list[1]['timings'])
+        self.assertIn('convert', self.records[1]['timings'])  # markdown only
+        w2d.process_page(self.url, output_format=w2d.FORMAT_HTML, extractor_function=w2d.extractor_raw, output_sink=sinks.MemorySink())
+        self.assertEqual(len(self.records), 3)
+
+    def test_failing_callback(self):
+        def metrics_callback(record):
+            raise RuntimeError('metrics backend down')
+        w2d.metrics_callback = metrics_callback
+        self.assertEqual(len(self.process()), 1)  # logged, page still processed
+
+    def test_trace_file(self):
+        trace_filename = os.path.join(self.temp_dir, 'trace.jsonl')
+        self.set_env('W2D_TRACE_FILE', trace_filename)
+        w2d.load_config()
+        w2d.metrics_callback = None
+        self.process([w2d.FORMAT_HTML, w2d.FORMAT_MARKDOWN])
+        self.process()
+        f = open(trace_filename)
+        records = [json.loads(line) for line in f]
+        f.close()
+        self.assertEqual([record['format'] for record in records], [w2d.FORMAT_HTML, w2d.FORMAT_MARKDOWN, w2d.FORMAT_HTML])
+        self.assertEqual([record['cache']['fetch'] for record in records], ['miss', 'miss', 'hit'])
+        self.assertTrue(records[0]['timings']['total'] > 0)
+
+    def check_profile(self, mode):
+        profile_dir = os.path.join(self.temp_dir, 'profile')
+        self.set_env('W2D_PROFILE', mode)
+        self.set_env('W2D_PROFILE_DIR', profile_dir)
+        w2d.load_config()
+        profile = self.process()[0]['profile']
+        self.assertEqual(profile['mode'], mode)
+        self.assertTrue(os.path.exists(profile['filename']))
+        self.assertEqual(os.path.dirname(profile['filename']), profile_dir)
+        self.assertEqual(self.records[0]['profile'], profile)
+        return profile
+
+    def test_cprofile(self):
+        profile = self.check_profile('cprofile')
+        self.assertIn('w2d', profile['seconds_by_package'])
+
+    @support.unittest.skipIf(sys.version_info < (3, 4), 'tracemalloc is Python 3.4+')
+    def test_tracemalloc(self):
+        profile = self.check_profile('tracemalloc')
+        self.assertTrue(profile['peak_bytes'] > 0)
+
+    def test_unknown_profile_mode(self):
+        self.set_env('W2D_PROFILE', 'perf')
+        w2d.load_config()
+        self.assertRaises(NotImplementedError, self.process)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""pandoc server batches (W2D_PANDOC_SERVER), against a stub pandoc server with the fake pandoc as the per document fallback
+"""
+
+import base64
+import json
+import threading
+import unittest
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import w2d
+from w2d import sinks
+
+from tests import support
+
+
+class StubPandocHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        documents = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        self.server.batches.append(documents)
+        results = []
+        for document in documents:
+            if 'FAIL' in document['text']:
+                results.append('stub pandoc server could not convert')  # pandoc server reports errors as a string
+            elif document['to'] in w2d.PANDOC_BINARY_FORMATS:
+                output = ('stub pandoc server %s\n' % document['to']).encode('utf-8') + document['text'].encode('utf-8')
+                results.append({'output': base64.b64encode(output).decode('ascii'), 'base64': True})
+            else:
+                results.append({'output': 'stub pandoc server %s\n%s' % (document['to'], document['text']), 'base64': False})
+        body = json.dumps(results).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubPandocServer(ThreadingMixIn, HTTPServer):
+    """/batch endpoint of pandoc server, batches is a list of the documents in each request"""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubPandocHandler)
+        self.batches = []
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@unittest.skipIf(w2d.is_win, 'fake pandoc is a posix script')
+class PandocBatchTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.pandoc_server = StubPandocServer()
+        self.set_env('W2D_PANDOC_EXE', support.write_fake_pandoc(self.temp_dir))
+        self.set_env('W2D_PANDOC_SERVER', self.pandoc_server.url())
+        self.set_env('W2D_EPUB_TOOL', 'pandoc')
+        self.set_env('W2D_EXTRACTOR', 'readability')
+        w2d.load_config()
+
+    def tearDown(self):
+        self.pandoc_server.stop()
+        support.LocalSiteTestCase.tearDown(self)
+
+    def jobs(self, *contents):
+        return [{'content': content, 'from': 'html', 'to': 'markdown', 'title': 'Doc %d' % counter} for counter, content in enumerate(contents)]
+
+    def test_convert_batch(self):
+        results = w2d.pandoc_convert_batch(self.jobs('<p>one</p>', '<p>FAIL</p>', '<p>three</p>'))
+        self.assertEqual(len(self.pandoc_server.batches), 1)
+        self.assertEqual(len(self.pandoc_server.batches[0]), 3)
+        self.assertTrue(results[0].startswith('stub pandoc server markdown'))
+        self.assertTrue(results[1].startswith('fake pandoc markdown Doc 1'))  # server failed this document only
+        self.assertTrue(results[2].startswith('stub pandoc server markdown'))
+
+    def test_server_unavailable(self):
+        self.pandoc_server.stop()
+        results = w2d.pandoc_convert_batch(self.jobs('<p>one</p>', '<p>two</p>'))
+        self.assertEqual([result.split('\n')[0] for result in results], ['fake pandoc markdown Doc 0', 'fake pandoc markdown Doc 1'])
+        self.pandoc_server = StubPandocServer()  # for tearDown
+
+    def test_pandoc_batch_context(self):
+        jobs = self.jobs('<p>one</p>', '<p>FAIL</p>')
+        with w2d.pandoc_batch(jobs):
+            self.assertEqual(len(self.pandoc_server.batches), 1)
+            for job in jobs:
+                result = w2d.pandoc_convert(job['content'], job['from'], job['to'], title=job['title'])
+                self.assertTrue(result.startswith('stub pandoc server' if 'FAIL' not in job['content'] else 'fake pandoc'), result)
+        self.assertEqual(len(self.pandoc_server.batches), 1)  # converted ahead of time, or by a pandoc process
+        w2d.pandoc_convert(jobs[0]['content'], 'html', 'markdown', title=jobs[0]['title'])
+        self.assertEqual(len(self.pandoc_server.batches), 2)  # outside the batch
+
+    def test_process_page_formats(self):
+        url = self.site.add_html('/page.html', support.make_article('Formats'))
+        page_info = w2d.extract_page(url, content_format=w2d.FORMAT_HTML)
+        jobs = w2d.get_render_pandoc_jobs(page_info, w2d.SUPPORTED_FORMATS)
+        self.assertTrue(jobs)
+        sink = sinks.MemorySink()
+        w2d.process_page_formats(url, output_formats=w2d.SUPPORTED_FORMATS, page_info=page_info, output_sink=sink)
+        self.assertEqual([len(batch) for batch in self.pandoc_server.batches], [len(jobs)])
+        documents = dict((name, data) for name, data, metadata in sink.documents)
+        self.assertTrue(documents['Formats.epub'].startswith(b'stub pandoc server epub'))
+
+    def check_dump_urls(self, fetch_workers):
+        paths = ['/%d.html' % counter for counter in range(3)] + ['/FAIL.html']
+        for path in paths:
+            self.site.add_html(path, support.make_article(path[1:-len('.html')]))
+        urls = [self.site.url(path) for path in paths] + [self.site.url('/missing.html')]  # 404
+        sink = sinks.MemorySink()
+        results = w2d.dump_urls(urls, output_format=w2d.FORMAT_ALL, fetch_workers=fetch_workers, output_sink=sink)
+        self.assertIsInstance(results[-1], w2d.HTTPError)
+        for result_metadata_list in results[:-1]:
+            self.assertEqual([result_metadata['format'] for result_metadata in result_metadata_list], w2d.SUPPORTED_FORMATS)
+        self.assertEqual([len(batch) for batch in self.pandoc_server.batches], [len(paths)])  # one epub per page, one request
+        documents = dict((name, data) for name, data, metadata in sink.documents)
+        self.assertTrue(documents['0.epub'].startswith(b'stub pandoc server epub'))
+        self.assertTrue(documents['FAIL.epub'].startswith(b'fake pandoc epub FAIL'))
+
+    def test_dump_urls(self):
+        self.check_dump_urls(1)
+
+    def test_dump_urls_fetch_threads(self):
+        self.check_dump_urls(4)
+
+    def test_batch_size(self):
+        self.set_env('W2D_PANDOC_BATCH_SIZE', '2')
+        w2d.load_config()
+        urls = [self.site.add_html('/%d.html' % counter, support.make_article('Page %d' % counter)) for counter in range(3)]
+        w2d.dump_urls(urls, output_format=w2d.FORMAT_EPUB, output_sink=sinks.MemorySink())
+        self.assertEqual([len(batch) for batch in self.pandoc_server.batches], [2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
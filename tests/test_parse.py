@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Single parse of each page (w2d.ParsedDocument) shared by the extractors and link re-writing
+"""
+
+import unittest
+
+import w2d
+
+from tests import support
+
+
+PAGE_URL = 'http://example.com/dir/page.html'
+
+
+@unittest.skipUnless(w2d.lxml, 'needs lxml')
+class ParsedDocumentTest(unittest.TestCase):
+    def setUp(self):
+        self.page = support.make_article('Parse Once').replace('<nav>', '<nav><a href="sibling.html">sibling</a>')
+        self.page_bytes = w2d.to_byte(self.page)
+        self.parse_count = 0
+        lxml_html = w2d.lxml.html
+        document_fromstring = lxml_html.document_fromstring
+
+        def counting_document_fromstring(html, *args, **kwargs):
+            if html == self.page_bytes:
+                self.parse_count += 1  # the page itself, not extractor output or library internal fragments
+            return document_fromstring(html, *args, **kwargs)
+        lxml_html.document_fromstring = counting_document_fromstring
+        self.addCleanup(setattr, lxml_html, 'document_fromstring', document_fromstring)
+
+    def extract(self, extractor_function):
+        return w2d.extract_page(PAGE_URL, content=self.page, extractor_function=extractor_function, extract_cache=False)
+
+    def test_readability(self):
+        page_info = self.extract(w2d.extractor_readability)
+        self.assertEqual(self.parse_count, 1)
+        self.assertEqual(page_info['title'], 'Parse Once')
+        self.assertIn('Words about Parse Once', page_info['content'])
+
+    def test_raw(self):
+        page_info = self.extract(w2d.extractor_raw)
+        self.assertEqual(self.parse_count, 1)  # title lookup and link re-writing share the tree
+        self.assertEqual(page_info['title'], 'Parse Once')
+        self.assertIn('href="http://example.com/dir/sibling.html"', page_info['content'])
+
+    def test_clone_is_independent(self):
+        document = w2d.ParsedDocument(self.page)
+        clone = document.clone()
+        clone.find('.//title').text = 'changed'
+        self.assertEqual(document.title(), 'Parse Once')
+        self.assertEqual(self.parse_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
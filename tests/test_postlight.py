@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Postlight client (retries, caching, batches), against the stub server in w2d.postlight_stub
+"""
+
+import os
+import threading
+import time
+import unittest
+
+import w2d
+from w2d import postlight_stub
+from w2d import sinks
+try:
+    from w2d import aio
+except SyntaxError:
+    aio = None  # Py2
+
+from tests import support
+
+
+class PostlightStubTestCase(support.LocalSiteTestCase):
+    """LocalSiteTestCase with self.stub, a stub postlight server (self.server_url) failing the first request for each url"""
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.set_env('W2D_POSTLIGHT_BACKOFF', '0')
+        w2d.load_config()
+        self.page_url = self.site.add_html('/one.html', support.make_article('Stub One'))
+        self.stub = postlight_stub.StubPostlightServer(('127.0.0.1', 0), fail_count=1)
+        thread = threading.Thread(target=self.stub.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        self.server_url = 'http://127.0.0.1:%d/parser' % self.stub.server_address[1]
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+        support.LocalSiteTestCase.tearDown(self)
+
+
+class PostlightParseTest(PostlightStubTestCase):
+    """Retries and caching, w2d.postlight_parse() (AioPostlightParseTest for w2d.aio)"""
+    def parse(self, url=None, retries=2):
+        return w2d.postlight_parse(url or self.page_url, postlight_server_url=self.server_url, retries=retries, backoff=0)
+
+    def test_retry_then_cached(self):
+        result = self.parse()
+        self.assertFalse(result.get('error', False))
+        self.assertEqual(result['title'], 'Stub One')
+        self.assertEqual(self.stub.request_count, 2)  # first attempt fails
+        result = self.parse(self.page_url + '?utm_campaign=test')
+        self.assertEqual(result['title'], 'Stub One')
+        self.assertEqual(self.stub.request_count, 2)  # same cache entry
+
+    def test_retry_server_error(self):
+        for fail_mode in (postlight_stub.FAIL_STATUS, postlight_stub.FAIL_JSON):
+            self.stub.fail_mode = fail_mode
+            url = self.site.add_html('/%s.html' % fail_mode, support.make_article('Stub %s' % fail_mode))
+            self.assertEqual(self.parse(url)['title'], 'Stub %s' % fail_mode)
+            self.assertEqual(self.stub.attempts[url], 2, fail_mode)
+
+    def test_error_not_cached(self):
+        for fail_mode in postlight_stub.FAIL_MODES:
+            self.stub.fail_mode = fail_mode
+            self.stub.fail_count = 10
+            url = self.site.add_html('/%s.html' % fail_mode, support.make_article('Stub %s' % fail_mode))
+            result = self.parse(url, retries=1)
+            self.assertTrue(result['error'], fail_mode)
+            self.assertEqual(self.stub.attempts[url], 2, fail_mode)
+            self.assertFalse(os.path.exists(w2d.get_cache_filename(w2d.get_postlight_cache_key(url, 'html'))), fail_mode)
+
+    def test_cache_expired(self):
+        self.parse()
+        self.set_env('W2D_CACHE_MAX_AGE', '60')
+        connection = w2d.get_cache_index()._get_connection()
+        with connection:
+            connection.execute('UPDATE entries SET fetch_time = ?', (time.time() - 120,))
+        self.assertEqual(self.parse()['title'], 'Stub One')
+        self.assertEqual(self.stub.request_count, 3)  # expired, requested again
+
+    def test_cache_hit_touched(self):
+        self.parse()
+        entry_name = os.path.basename(w2d.get_cache_filename(w2d.get_postlight_cache_key(self.page_url, 'html')))
+        connection = w2d.get_cache_index()._get_connection()
+        with connection:
+            connection.execute('UPDATE entries SET access_time = 0')
+        self.parse()
+        self.assertEqual(self.stub.request_count, 2)
+        self.assertGreater(w2d.get_cache_index().lookup_hash(entry_name)['access_time'], 0)
+
+
+@unittest.skipIf(aio is None, 'w2d.aio is Python 3.5+')
+class AioPostlightParseTest(PostlightParseTest):
+    def parse(self, url=None, retries=2):
+        async def fetch_postlight():
+            fetcher = aio.AsyncFetcher(postlight_server_url=self.server_url)
+            try:
+                return await fetcher.fetch_postlight(url or self.page_url, retries=retries, backoff=0)
+            finally:
+                await fetcher.close()
+        return aio.run(fetch_postlight())
+
+
+class PostlightClientTest(PostlightStubTestCase):
+    def get_parser_request_count(self):
+        """Requests to the (missing, 404) postlight server on LocalSite"""
+        return sum(count for path, count in self.site.request_counts.items() if path.startswith('/parser?'))
+
+    def test_cache_key_ignores_tracking_params(self):
+        self.assertEqual(
+            w2d.get_postlight_cache_key('http://example.com/a?utm_source=x&id=1', 'html'),
+            w2d.get_postlight_cache_key('http://example.com/a?id=1', 'html'),
+        )
+        self.assertNotEqual(w2d.get_postlight_cache_key('http://example.com/a', 'html'), w2d.get_postlight_cache_key('http://example.com/a', 'markdown'))
+
+    def test_client_error_not_retried(self):
+        self.assertRaises(w2d.HTTPError, w2d.postlight_parse, self.page_url, postlight_server_url=self.site.url('/parser'), retries=2, backoff=0)
+        self.assertEqual(self.get_parser_request_count(), 1)
+
+    def test_batch(self):
+        self.stub.fail_count = 0
+        urls = [self.site.add_html('/%d.html' % counter, support.make_article('Batch %d' % counter)) for counter in range(3)]
+        results = w2d.postlight_batch(urls + ['http://127.0.0.1:1/refused.html'], postlight_server_url=self.server_url, max_in_flight=2)
+        self.assertEqual([result.get('title') for result in results[:-1]], ['Batch 0', 'Batch 1', 'Batch 2'])
+        self.assertTrue(results[-1]['error'])  # the postlight server could not fetch it
+        self.assertRaises(w2d.HTTPError, w2d.postlight_batch, [urls[0] + '?uncached'], postlight_server_url=self.site.url('/parser'))
+        results = w2d.postlight_batch(urls[:1] + [urls[0] + '?uncached'], postlight_server_url=self.site.url('/parser'), ignore_errors=True)
+        self.assertEqual(results[0]['title'], 'Batch 0')  # cached
+        self.assertIsInstance(results[1], w2d.HTTPError)
+
+    def test_dump_urls_prefetch(self):
+        # fetch workers warm the postlight cache with postlight_batch(), each url is sent to the server once
+        self.stub.fail_count = 0
+        self.set_env('MP_URL', self.server_url)
+        self.set_env('W2D_EXTRACTOR', 'postlight')
+        w2d.load_config()
+        paths = ['/%d.html' % counter for counter in range(3)]
+        urls = [self.site.add_html(path, support.make_article('Dump %s' % path[1])) for path in paths]
+        results = w2d.dump_urls(urls, output_format=w2d.FORMAT_HTML, fetch_workers=2, output_sink=sinks.MemorySink())
+        self.assertEqual([result_metadata_list[0]['title'] for result_metadata_list in results], ['Dump 0', 'Dump 1', 'Dump 2'])
+        self.assertEqual(self.stub.request_count, len(urls))
+        for path in paths:
+            self.assertEqual(self.site.request_counts[path], 1)  # only by the postlight server
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Postlight worker pool (w2d.postlight_worker), against the stub worker in w2d.postlight_stub
+"""
+
+import os
+import sys
+import unittest
+
+from w2d import postlight_worker
+
+from tests import support
+
+
+class PostlightWorkerPoolTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.page_url = self.site.add_html('/one.html', support.make_article('Worker One'))
+        pythonpath = os.environ.get('PYTHONPATH')
+        self.set_env('PYTHONPATH', os.pathsep.join([support.PACKAGE_DIR] + [x for x in [pythonpath] if x]))
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool:
+            self.pool.close()
+        support.LocalSiteTestCase.tearDown(self)
+
+    def get_pool(self, *worker_args):
+        command = [sys.executable, '-m', 'w2d.postlight_stub', '--worker'] + list(worker_args)
+        self.pool = postlight_worker.PostlightWorkerPool(command=command, size=1, timeout=30, retries=1)
+        return self.pool
+
+    def test_parse(self):
+        pool = self.get_pool()
+        for _ in range(2):
+            result = pool.parse(self.page_url)
+            self.assertEqual(result['title'], 'Worker One')
+            self.assertIn('Words about Worker One', result['content'])
+
+    def test_error_result(self):
+        result = self.get_pool().parse(self.site.url('/missing.html'))
+        self.assertTrue(result['error'])
+
+    def test_crashed_worker_restarted(self):
+        pool = self.get_pool('--crash-after', '1')
+        self.assertEqual(pool.parse(self.page_url)['title'], 'Worker One')
+        self.assertEqual(pool.parse(self.page_url)['title'], 'Worker One')  # worker exits, restarted and retried
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Scrape cache revalidation, conditional requests from the ETag/Last-Modified sidecar metadata
+"""
+
+import os
+import unittest
+
+import w2d
+
+from tests import support
+
+
+class RevalidateTest(support.LocalSiteTestCase):
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.url = self.site.add_html('/page.html', support.make_article('Version 1'))
+
+    def get_url(self, revalidate=True):
+        timings = w2d.PageTimings()
+        with w2d.active_page_timings(timings):
+            page = w2d.get_url(self.url, revalidate=revalidate)
+        return page, timings.cache.get('fetch')
+
+    def test_sidecar_metadata(self):
+        self.get_url()
+        metadata = w2d.read_cache_metadata(w2d.get_cache_filename(self.url))
+        self.assertEqual((metadata['url'], metadata['status']), (self.url, 200))
+        self.assertTrue(metadata['headers']['etag'])
+
+    def test_not_modified(self):
+        page, result = self.get_url()
+        self.assertEqual(result, 'miss')
+        filename = w2d.get_cache_filename(self.url)
+        fetch_time = w2d.read_cache_metadata(filename)['fetch_time']
+        self.assertEqual(self.get_url(), (page, 'not_modified'))
+        self.assertEqual(self.site.request_counts['/page.html'], 2)
+        path, headers = self.site.request_log[-1]
+        self.assertEqual(headers['if-none-match'], w2d.read_cache_metadata(filename)['headers']['etag'])
+        metadata = w2d.read_cache_metadata(filename)
+        self.assertEqual(metadata['status'], 304)
+        self.assertGreaterEqual(metadata['fetch_time'], fetch_time)
+        self.assertEqual(w2d.get_cache_index().lookup_url(w2d.canonical_url(self.url))['status'], 304)
+
+    def test_modified(self):
+        self.get_url()
+        self.site.add_html('/page.html', support.make_article('Version 2'))
+        page, result = self.get_url()
+        self.assertEqual(result, 'miss')
+        self.assertIn(b'Version 2', page)
+        self.assertIn(b'Version 2', self.get_url(revalidate=False)[0])  # cache updated
+
+    def test_not_revalidating(self):
+        self.get_url()
+        self.assertEqual(self.get_url(revalidate=False)[1], 'hit')
+        self.assertEqual(self.site.request_counts['/page.html'], 1)
+
+    def test_env(self):
+        self.get_url()
+        self.set_env('W2D_CACHE_REVALIDATE', 'true')
+        w2d.load_config()
+        self.assertEqual(self.get_url(revalidate=None)[1], 'not_modified')
+
+    def test_no_validators(self):
+        self.get_url()
+        os.remove(w2d.get_cache_metadata_filename(w2d.get_cache_filename(self.url)))  # e.g. entry cached before revalidation support
+        self.assertEqual(self.get_url()[1], 'miss')
+        self.assertNotIn('if-none-match', self.site.request_log[-1][1])
+
+    def test_without_connection_pool(self):
+        self.set_env('W2D_CONNECTION_POOL', 'false')  # urllib, 304 is raised as HTTPError
+        w2d.load_config()
+        page = self.get_url()[0]
+        self.assertEqual(self.get_url(), (page, 'not_modified'))
+
+    def test_revalidation_headers(self):
+        self.assertEqual(w2d.get_revalidation_headers({}), {})
+        headers = w2d.get_revalidation_headers({'headers': {'etag': '"abc"', 'last-modified': 'Sun, 01 Jan 2023 00:00:00 GMT'}})
+        self.assertEqual(headers, {'If-None-Match': '"abc"', 'If-Modified-Since': 'Sun, 01 Jan 2023 00:00:00 GMT'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""w2d serve, the bounded job queue (back-pressure) and the json over HTTP interface
+"""
+
+import json
+import os
+import threading
+import time
+
+try:
+    # Python 3
+    import http.client as httplib
+except ImportError:
+    # Python 2
+    import httplib
+
+from w2d import server
+
+from tests import support
+
+
+class BlockingJobQueue(server.JobQueue):
+    """Jobs do not start converting until release is set, so the queue can be filled"""
+    def __init__(self, *args, **kwargs):
+        self.release = threading.Event()
+        server.JobQueue.__init__(self, *args, **kwargs)
+
+    def run_job(self, job):
+        self.release.wait(10)
+        return server.JobQueue.run_job(self, job)
+
+    def wait_running(self, running):
+        for _ in range(200):
+            if self.stats()['running'] == running:
+                return
+            time.sleep(0.01)
+        raise AssertionError('%d jobs not running' % running)
+
+
+class JobQueueTestCase(support.LocalSiteTestCase):
+    environ = {'W2D_EXTRACTOR': 'raw', 'W2D_OUTPUT_FORMAT': 'html'}
+
+    def setUp(self):
+        support.LocalSiteTestCase.setUp(self)
+        self.output_dir = os.path.join(self.temp_dir, 'out')
+        self.job_queue = BlockingJobQueue(workers=1, max_queued=2, output_dir=self.output_dir, keep_jobs=3)
+        self.urls = [self.site.add_html('/%d.html' % counter, support.make_article('Page %d' % counter)) for counter in range(5)]
+
+    def tearDown(self):
+        self.job_queue.release.set()
+        self.job_queue.close()
+        support.LocalSiteTestCase.tearDown(self)
+
+
+class JobQueueTest(JobQueueTestCase):
+    def test_queue_full(self):
+        running_job = self.job_queue.submit(self.urls[0])
+        self.job_queue.wait_running(1)
+        queued_jobs = [self.job_queue.submit(url) for url in self.urls[1:3]]
+        self.assertRaises(server.QueueFullError, self.job_queue.submit, self.urls[3])
+        stats = self.job_queue.stats()
+        self.assertEqual((stats['submitted'], stats['rejected'], stats['queued'], stats['running']), (3, 1, 2, 1))
+        self.job_queue.release.set()
+        for job in [running_job] + queued_jobs:
+            self.assertTrue(job.done.wait(10))
+            self.assertEqual(job.status, server.JOB_DONE, job.error)
+            self.assertTrue(os.path.exists(job.result[0]['filename']))
+            self.assertEqual(os.path.dirname(job.result[0]['filename']), self.output_dir)
+        self.assertEqual(self.job_queue.submit(self.urls[3]).done.wait(10), True)  # room again
+        self.assertEqual(self.job_queue.stats()[server.JOB_DONE], 4)
+
+    def test_failed_job(self):
+        self.job_queue.release.set()
+        job = self.job_queue.submit(self.site.url('/missing.html'))
+        job.done.wait(10)
+        self.assertEqual(job.status, server.JOB_FAILED)
+        self.assertTrue(job.error.startswith('HTTPError'), job.error)
+        self.assertEqual(self.job_queue.stats()[server.JOB_FAILED], 1)
+
+    def test_bad_parameters(self):
+        self.assertRaises(ValueError, self.job_queue.submit, 'ftp://example.com/')
+        self.assertRaises(ValueError, self.job_queue.submit, self.urls[0], output_format='pdf')
+        self.assertRaises(ValueError, self.job_queue.submit, self.urls[0], extractor_name='missing')
+        self.assertEqual(self.job_queue.stats()['submitted'], 0)
+
+    def test_forget_old_jobs(self):
+        self.job_queue.release.set()
+        jobs = []
+        for url in self.urls:
+            jobs.append(self.job_queue.submit(url))
+            jobs[-1].done.wait(10)
+        self.assertEqual([self.job_queue.get(job.id) is not None for job in jobs], [False, False, True, True, True])  # keep_jobs=3
+
+
+class JobServerTest(JobQueueTestCase):
+    def setUp(self):
+        JobQueueTestCase.setUp(self)
+        self.server = server.make_server(self.job_queue, port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        JobQueueTestCase.tearDown(self)
+
+    def request(self, method, path, body=None):
+        """Returns (status, headers dict, json response)"""
+        connection = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+        try:
+            if body is not None and not isinstance(body, bytes):
+                body = json.dumps(body).encode('utf-8')
+            connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, dict((name.lower(), value) for name, value in response.getheaders()), json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+    def test_wait(self):
+        self.job_queue.release.set()
+        status, headers, job = self.request('POST', '/jobs', {'url': self.urls[0], 'wait': True})
+        self.assertEqual((status, job['status']), (200, server.JOB_DONE))
+        self.assertTrue(os.path.exists(job['result'][0]['filename']))
+        self.assertEqual(self.request('GET', '/jobs/%s' % job['id'])[2]['status'], server.JOB_DONE)
+        self.assertEqual(self.request('GET', '/jobs/unknown')[0], 404)
+
+    def test_no_wait(self):
+        # job not finished (yet), 202 with the job id
+        for request in ({'url': self.urls[0]}, {'url': self.urls[1], 'wait': False}, {'url': self.urls[2], 'wait': 0.05}):
+            status, headers, job = self.request('POST', '/jobs', request)
+            self.assertEqual(status, 202, request)
+            self.assertIn(job['status'], (server.JOB_QUEUED, server.JOB_RUNNING))
+            self.assertTrue(self.job_queue.get(job['id']))
+
+    def test_bad_wait(self):
+        for wait in ('soon', '5', [1], {'seconds': 1}, -1):
+            status, headers, response = self.request('POST', '/jobs', {'url': self.urls[0], 'wait': wait})
+            self.assertEqual(status, 400, wait)
+            self.assertIn('wait', response['error'])
+        status, headers, response = self.request('POST', '/jobs', b'{"url": "%s", "wait": NaN}' % self.urls[0].encode('ascii'))
+        self.assertEqual(status, 400)
+        self.assertEqual(self.job_queue.stats()['submitted'], 0)  # rejected before being queued
+
+    def test_bad_requests(self):
+        for body in (b'not json', b'[1, 2]', {'url': 'file:///etc/passwd'}, {'url': self.urls[0], 'format': 'pdf'}):
+            self.assertEqual(self.request('POST', '/jobs', body)[0], 400, body)
+        self.assertEqual(self.request('POST', '/other', {'url': self.urls[0]})[0], 404)
+
+    def test_queue_full(self):
+        self.request('POST', '/jobs', {'url': self.urls[0]})
+        self.job_queue.wait_running(1)
+        for url in self.urls[1:3]:
+            self.assertEqual(self.request('POST', '/jobs', {'url': url})[0], 202)
+        status, headers, response = self.request('POST', '/jobs', {'url': self.urls[3]})
+        self.assertEqual((status, headers.get('retry-after')), (503, '1'))
+        self.assertIn('queue full', response['error'])
+        status, headers, stats = self.request('GET', '/status')
+        self.assertEqual((stats['queued'], stats['running'], stats['rejected'], stats['max_queued']), (2, 1, 1, 2))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
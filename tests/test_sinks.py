@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Output sinks; directory, zip, tar, in memory (worker processes) and assets
+"""
+
+import json
+import os
+import tarfile
+import unittest
+import zipfile
+
+from w2d import sinks
+
+from tests import support
+
+
+class SinkTest(support.TempDirTestCase):
+    def write_sample(self, sink):
+        for url in ('http://example.com/a', 'http://example.com/b'):
+            name = sink.reserve('Same Title.md', url)
+            sink.write(name, ('# %s\n' % url).encode('utf-8'), metadata={'url': url, 'format': 'md'})
+        asset_path = os.path.join(self.temp_dir, 'store', 'ab', 'ab12.png')
+        os.makedirs(os.path.dirname(asset_path))
+        f = open(asset_path, 'wb')
+        f.write(b'png')
+        f.close()
+        content = '<img src="%s">' % asset_path
+        for name in ('one.html', 'sub/two.html'):
+            sink.write(name, sinks.write_assets(sink, content, [asset_path], name).encode('utf-8'), metadata={'format': 'html'})
+        sink.close()
+
+    def test_reserve(self):
+        sink = sinks.MemorySink()
+        self.assertEqual(sink.reserve('t.md', 'http://a'), 't.md')
+        self.assertEqual(sink.reserve('t.md', 'http://b'), 't-2.md')
+        self.assertEqual(sink.reserve('t.md', 'http://c'), 't-3.md')
+        self.assertEqual(sink.reserve('t.md', 'http://b'), 't-2.md')  # same url, same name
+
+    def test_directory(self):
+        sink = sinks.open_output_sink(os.path.join(self.temp_dir, 'out'))
+        self.assertIsInstance(sink, sinks.DirectorySink)
+        sink.write(sink.reserve('a.md', 'http://a'), b'data')
+        sink.close()
+        f = open(os.path.join(self.temp_dir, 'out', 'a.md'), 'rb')
+        self.assertEqual(f.read(), b'data')
+        f.close()
+
+    def check_archive(self, names, read):
+        self.assertEqual(sorted(names), sorted(['Same Title.md', 'Same Title-2.md', 'assets/ab/ab12.png', 'one.html', 'sub/two.html', sinks.MANIFEST_NAME]))
+        self.assertEqual(read('Same Title.md'), b'# http://example.com/a\n')
+        self.assertEqual(read('one.html'), b'<img src="assets/ab/ab12.png">')
+        self.assertEqual(read('sub/two.html'), b'<img src="../assets/ab/ab12.png">')
+        manifest = json.loads(read(sinks.MANIFEST_NAME).decode('utf-8'))
+        self.assertEqual(len([entry for entry in manifest if entry.get('format') == sinks.ASSET_FORMAT]), 1)
+        entry = [entry for entry in manifest if entry['name'] == 'Same Title-2.md'][0]
+        self.assertEqual(entry['url'], 'http://example.com/b')
+        self.assertEqual(entry['bytes'], len(b'# http://example.com/b\n'))
+
+    def test_zip(self):
+        filename = os.path.join(self.temp_dir, 'out.zip')
+        self.write_sample(sinks.open_output_sink(filename))
+        archive = zipfile.ZipFile(filename)
+        self.check_archive(archive.namelist(), archive.read)
+        archive.close()
+
+    def test_tar_gz(self):
+        filename = os.path.join(self.temp_dir, 'out.tar.gz')
+        self.write_sample(sinks.open_output_sink(filename))
+        archive = tarfile.open(filename)
+        self.check_archive(archive.getnames(), lambda name: archive.extractfile(name).read())
+        archive.close()
+
+    def test_write_documents(self):
+        memory_sink = sinks.MemorySink()
+        memory_sink.write('t.md', b'one', metadata={'url': 'http://a'})
+        memory_sink.write('assets/ab/ab12.png', b'png', metadata={'format': sinks.ASSET_FORMAT})
+        sink = sinks.MemorySink()
+        sink.reserve('t.md', 'http://other')
+        sink.claim_asset('assets/ab/ab12.png')
+        result_metadata = {'filename': 't.md'}
+        sinks.write_documents(sink, memory_sink.documents, [result_metadata])
+        self.assertEqual(result_metadata['filename'], 't-2.md')
+        self.assertEqual([name for name, data, metadata in sink.documents], ['t-2.md'])  # asset already in sink
+
+
+if __name__ == '__main__':
+    unittest.main()
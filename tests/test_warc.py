@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""WARC reader (records, HTTP payload decoding) and conversion, no network access
+"""
+
+import gzip
+import os
+import unittest
+import zlib
+
+import w2d
+from w2d import bench
+from w2d import sinks
+from w2d import warc
+
+from tests import support
+
+
+def make_record(warc_type, url, block, content_type='application/http; msgtype=response'):
+    headers = 'WARC/1.0\r\nWARC-Type: %s\r\nWARC-Target-URI: %s\r\nWARC-Date: 2023-01-01T00:00:00Z\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n' % (warc_type, url, content_type, len(block))
+    return headers.encode('ascii') + block + b'\r\n\r\n'
+
+
+def make_response(body, content_type='text/html; charset=utf-8', status='200 OK', extra_headers=''):
+    return ('HTTP/1.1 %s\r\nContent-Type: %s\r\n%s\r\n' % (status, content_type, extra_headers)).encode('ascii') + body
+
+
+def chunk(data, size=7):
+    chunks = [data[offset:offset + size] for offset in range(0, len(data), size)]
+    return b''.join(b'%x\r\n' % len(part) + part + b'\r\n' for part in chunks) + b'0\r\n\r\n'
+
+
+PLAIN_HTML = support.make_article('Plain').encode('utf-8')
+LATIN1_HTML = u'<html><head><meta charset="iso-8859-1"><title>Caf\xe9</title></head><body><p>Caf\xe9</p></body></html>'.encode('latin-1')
+
+RECORDS = [
+    make_record('warcinfo', '', b'software: test\r\n', content_type='application/warc-fields'),
+    make_record('request', 'http://example.com/plain', b'GET /plain HTTP/1.1\r\n\r\n', content_type='application/http; msgtype=request'),
+    make_record('response', 'http://example.com/plain', make_response(PLAIN_HTML)),
+    make_record('response', 'http://example.com/chunked', make_response(chunk(PLAIN_HTML.replace(b'Plain', b'Chunked')), extra_headers='Transfer-Encoding: chunked\r\n')),
+    make_record('response', 'https://example.com/gzip', make_response(zlib.compress(PLAIN_HTML.replace(b'Plain', b'Gzip'), 9), extra_headers='Content-Encoding: deflate\r\n')),
+    make_record('response', 'http://example.com/latin1', make_response(LATIN1_HTML, content_type='text/html')),
+    make_record('response', 'http://example.com/image.png', make_response(bench.TINY_PNG, content_type='image/png')),
+    make_record('response', 'http://example.com/missing', make_response(b'gone', status='404 Not Found')),
+    make_record('revisit', 'http://example.com/plain', make_response(b'')),
+    make_record('response', 'dns:example.com', b'example.com. 300 IN A 127.0.0.1', content_type='text/dns'),
+]
+
+
+class WarcReaderTest(support.TempDirTestCase):
+    def write_warc(self, name, compress_records):
+        filename = os.path.join(self.temp_dir, name)
+        f = open(filename, 'wb')
+        for record in RECORDS:
+            if compress_records:
+                member = gzip.GzipFile(fileobj=f, mode='wb')  # gzip member per record
+                member.write(record)
+                member.close()
+            else:
+                f.write(record)
+        f.close()
+        return filename
+
+    def check_responses(self, filename):
+        stats = {}
+        responses = list(warc.iter_html_responses(filename, stats=stats))
+        self.assertEqual([response.url for response in responses], ['http://example.com/plain', 'http://example.com/chunked', 'https://example.com/gzip', 'http://example.com/latin1'])
+        self.assertEqual(stats, {'responses': 6, 'skipped': 2})
+        self.assertEqual(responses[0].body, PLAIN_HTML)
+        self.assertEqual(responses[1].body, PLAIN_HTML.replace(b'Plain', b'Chunked'))
+        self.assertEqual(responses[2].body, PLAIN_HTML.replace(b'Plain', b'Gzip'))
+        self.assertIn(u'<title>Caf\xe9</title>', responses[3].get_text())
+        self.assertEqual(responses[0].date, '2023-01-01T00:00:00Z')
+
+    def test_plain(self):
+        self.check_responses(self.write_warc('crawl.warc', compress_records=False))
+
+    def test_gzip_per_record(self):
+        self.check_responses(self.write_warc('crawl.warc.gz', compress_records=True))
+
+    def test_all_responses(self):
+        responses = list(warc.iter_responses(self.write_warc('crawl.warc', compress_records=False)))
+        self.assertEqual([(response.status, response.content_type) for response in responses][-2:], [(200, 'image/png'), (404, 'text/html')])
+
+    def test_truncated(self):
+        filename = self.write_warc('crawl.warc', compress_records=False)
+        f = open(filename, 'rb')
+        data = f.read()
+        f.close()
+        f = open(filename, 'wb')
+        f.write(data[:len(RECORDS[0]) + len(RECORDS[1]) + 50])
+        f.close()
+        self.assertRaises(warc.WarcFormatError, list, warc.iter_responses(filename))
+
+    def test_dechunk(self):
+        self.assertEqual(warc.dechunk(chunk(b'hello world')), b'hello world')
+        self.assertEqual(warc.dechunk(b'not chunked'), b'not chunked')
+
+    def test_decode_content(self):
+        self.assertEqual(warc.decode_content(zlib.compress(b'data'), 'deflate'), b'data')
+        self.assertEqual(warc.decode_content(b'data', None), b'data')
+        self.assertRaises(ValueError, warc.decode_content, b'data', 'gzip')
+        self.assertRaises(ValueError, warc.decode_content, b'data', 'compress')
+
+
+def write_crawl(filename, page_count):
+    """Write a gzip per record WARC of page_count article page responses, each followed by an image response"""
+    f = open(filename, 'wb')
+    records = [make_record('warcinfo', '', b'software: test\r\n', content_type='application/warc-fields')]
+    for counter in range(page_count):
+        url = 'https://example.com/articles/%d.html' % counter
+        records.append(make_record('request', url, b'GET /articles/%d.html HTTP/1.1\r\nHost: example.com\r\n\r\n' % counter, content_type='application/http; msgtype=request'))
+        records.append(make_record('response', url, make_response(support.make_article('Article %d' % counter).encode('utf-8'))))
+        records.append(make_record('response', 'https://example.com/images/%d.png' % counter, make_response(bench.TINY_PNG, content_type='image/png')))
+    for record in records:
+        member = gzip.GzipFile(fileobj=f, mode='wb')
+        member.write(record)
+        member.close()
+    f.close()
+
+
+class ConvertWarcTest(support.TempCacheTestCase):
+    def test_convert(self):
+        filename = os.path.join(self.temp_dir, 'crawl.warc.gz')
+        write_crawl(filename, 3)
+        sink = sinks.MemorySink()
+        stats = warc.convert_warc([filename], output_format='html', extractor_name='raw', cpu_workers=1, batch_size=2, output_sink=sink)
+        self.assertEqual((stats['pages'], stats['converted'], stats['failed'], stats['skipped']), (3, 3, 0, 3))
+        self.assertEqual(sorted(metadata['url'] for name, data, metadata in sink.documents), ['https://example.com/articles/%d.html' % counter for counter in range(3)])
+        self.assertFalse(os.path.exists(w2d.cache_dir))  # nothing fetched or cached
+
+    def test_extractor_must_use_content(self):
+        self.assertRaises(ValueError, warc.convert_warc, [], extractor_name='postlight', output_sink=sinks.MemorySink())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,11 +6,20 @@
 # Copyright (C) 2023 Chris Clark - clach04
 
 import base64
+import contextlib
+import copy
+import importlib
 import json
 import logging
 import os
 import sys
 
+try:
+    import concurrent.futures  # Py3
+except ImportError:
+    # Py2 (without futures backport), batches are processed serially
+    concurrent = None
+
 try:
     import hashlib
     #from hashlib import md5
@@ -21,19 +30,31 @@ except ImportError:
 
 import logging
 import os
+import re
+import shutil
+import socket
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 
 try:
     # Py3
+    import http.client as httplib
+    from io import BytesIO
     from urllib.error import HTTPError
-    from urllib.request import build_opener, urlopen, urlretrieve, HTTPBasicAuthHandler, HTTPDigestAuthHandler, HTTPPasswordMgrWithDefaultRealm, Request
-    from urllib.parse import parse_qs, quote_plus, urlencode, urljoin, urlparse
+    from urllib.request import build_opener, getproxies, urlopen, urlretrieve, HTTPBasicAuthHandler, HTTPDigestAuthHandler, HTTPPasswordMgrWithDefaultRealm, Request
+    from urllib.parse import parse_qs, parse_qsl, quote_plus, urlencode, urljoin, urlparse
+    import html.parser as html_parser
 except ImportError:
     # Py2
+    import httplib
+    from cStringIO import StringIO as BytesIO
     from cgi import parse_qs  # py2 (and <py3.8)
-    from urlparse import urljoin, urlparse
-    from urllib import quote_plus, urlencode, urlretrieve  #TODO is this in urllib2?
+    from urlparse import parse_qsl, urljoin, urlparse
+    import HTMLParser as html_parser
+    from urllib import getproxies, quote_plus, urlencode, urlretrieve  #TODO is this in urllib2?
     from urllib2 import build_opener, urlopen, HTTPBasicAuthHandler, HTTPDigestAuthHandler, HTTPPasswordMgrWithDefaultRealm, Request, HTTPError
 
 
@@ -50,41 +71,68 @@ def fake_module(name):
 
     return MissingModule()
 
+class LazyModule(object):
+    """Import module on first use (attribute access or truth test) rather than at import of w2d.
+    missing - used instead of the module if the import fails, e.g. None or fake_module(name)
+    submodules - also imported, e.g. lxml.html
+    """
+    def __init__(self, name, missing=None, submodules=()):
+        self._lazy_name = name
+        self._lazy_missing = missing
+        self._lazy_submodules = submodules
+        self._lazy_loaded = False
+        self._lazy_module = None
+
+    def _lazy_load(self):
+        if not self._lazy_loaded:
+            try:
+                module = importlib.import_module(self._lazy_name)
+                for submodule in self._lazy_submodules:
+                    importlib.import_module(submodule)
+            except ImportError:
+                module = self._lazy_missing
+            self._lazy_module = module
+            self._lazy_loaded = True
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        module = self._lazy_load()
+        if module is None:
+            raise ImportError('No module named %s' % self._lazy_name)
+        return getattr(module, attr)
+
+    def __bool__(self):
+        return bool(self._lazy_load())
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return '<LazyModule %r loaded=%r>' % (self._lazy_name, self._lazy_loaded)
+
 #import readability
-try:
-    import readability  # https://github.com/buriy/python-readability/   pip install readability-lxml
-except ImportError:
-    readability = fake_module('readability')
+readability = LazyModule('readability', missing=fake_module('readability'))  # https://github.com/buriy/python-readability/   pip install readability-lxml
 
-try:
-    # BeautifulSoup
-    # pip install requests beautifulsoup4
-    # pip install requests beautifulsoup4==4.9.3
-    import bs4
-except ImportError:
-    bs4 = fake_module('bs4')
+# https://lxml.de/ - already required by readability-lxml (and trafilatura)
+# optional, parsing falls back to BeautifulSoup (slower)
+lxml = LazyModule('lxml', submodules=('lxml.html', 'lxml.etree'))
 
+# BeautifulSoup
+# pip install requests beautifulsoup4
+# pip install requests beautifulsoup4==4.9.3
+bs4 = LazyModule('bs4', missing=fake_module('bs4'))
 
-try:
-    import trafilatura  # readability alternative, note additional module htmldate available for date processing - pip install  requests trafilatura
-    """
-    https://github.com/adbar/trafilatura
 
-    pip install  requests trafilatura
+trafilatura = LazyModule('trafilatura')  # readability alternative, note additional module htmldate available for date processing - pip install  requests trafilatura - Py2 not supported
+"""
+https://github.com/adbar/trafilatura
 
-    Successfully installed certifi-2023.5.7 charset-normalizer-3.2.0 courlan-0.9.3 dateparser-1.1.8 htmldate-1.4.3 idna-3.4 justext-3.0.0 langcodes-3.3.0 lxml-4.9.3 p
-    python-dateutil-2.8.2 pytz-2023.3 regex-2023.6.3 requests-2.31.0 six-1.16.0 tld-0.13 trafilatura-1.6.1 tzdata-2023.3 tzlocal-5.0.1 urllib3-2.0.3
-    """
-except ImportError:
-    # Py2 not supported
-    trafilatura = None
+pip install  requests trafilatura
 
+Successfully installed certifi-2023.5.7 charset-normalizer-3.2.0 courlan-0.9.3 dateparser-1.1.8 htmldate-1.4.3 idna-3.4 justext-3.0.0 langcodes-3.3.0 lxml-4.9.3 p
+python-dateutil-2.8.2 pytz-2023.3 regex-2023.6.3 requests-2.31.0 six-1.16.0 tld-0.13 trafilatura-1.6.1 tzdata-2023.3 tzlocal-5.0.1 urllib3-2.0.3
+"""
 
-try:
-    import markdownify  # https://github.com/matthewwithanm/python-markdownify  pip install markdownify
-except ImportError:
-    markdownify = fake_module('markdownify')
-# https://github.com/matthewwithanm/python-markdownify  pip install markdownify
+
+markdownify = LazyModule('markdownify', missing=fake_module('markdownify'))  # https://github.com/matthewwithanm/python-markdownify  pip install markdownify
 # Successfully installed beautifulsoup4-4.12.2 markdownify-0.11.6 soupsieve-2.4.1
 
 """Py2
@@ -101,63 +149,494 @@ Successfully installed beautifulsoup4-4.12.2 certifi-2023.5.7 chardet-5.0.0 char
 """
 
 
-try:
-    import pypub  # https://github.com/clach04/pypub
-except ImportError:
-    # optional
-    pypub = None
+pypub = LazyModule('pypub')  # optional https://github.com/clach04/pypub
 
 from ._version import __version__, __version_info__
 
 
-# TODO consider real dotenv library, implementation does NOT handle quotes
-dot_env_file = '.env'
-if os.path.exists(dot_env_file):
-    f = open(dot_env_file, 'rb')
-    env_str = f.read().decode('us-ascii')
-    f.close()
-    env_str = env_str.replace('\r', '')
-    for line in env_str.split('\n'):
-        line = line.strip()
-        if not line:
-            continue
-        #print('%r' % line)
-        env_key, env_value = line.split('=', 1)
-        if not os.environ.get(env_key):
-            os.environ[env_key] = env_value
+def load_dot_env(dot_env_file='.env'):
+    """Set operating system environment variables from dot_env_file, if it exists. Already set variables are not changed"""
+    # TODO consider real dotenv library, implementation does NOT handle quotes
+    if os.path.exists(dot_env_file):
+        f = open(dot_env_file, 'rb')
+        env_str = f.read().decode('us-ascii')
+        f.close()
+        env_str = env_str.replace('\r', '')
+        for line in env_str.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            #print('%r' % line)
+            env_key, env_value = line.split('=', 1)
+            if not os.environ.get(env_key):
+                os.environ[env_key] = env_value
 
 
 log = logging.getLogger("w2d")
-log.setLevel(logging.DEBUG)
-disable_logging = False
-#disable_logging = True
-if disable_logging:
-    log.setLevel(logging.NOTSET)  # only logs; WARNING, ERROR, CRITICAL
 
-ch = logging.StreamHandler()  # use stdio
 
-formatter = logging.Formatter("logging %(process)d %(thread)d %(asctime)s - %(filename)s:%(lineno)d %(name)s - %(levelname)s - %(message)s")
-ch.setFormatter(formatter)
-log.addHandler(ch)
+def setup_logging():
+    """Log to stdio, used by main(). Library users configure logging themselves"""
+    log.setLevel(logging.DEBUG)
+    disable_logging = False
+    #disable_logging = True
+    if disable_logging:
+        log.setLevel(logging.NOTSET)  # only logs; WARNING, ERROR, CRITICAL
+
+    ch = logging.StreamHandler()  # use stdio
 
-log.info('%s version %s', __name__, __version__)
-log.info('Python %r on %r', sys.version, sys.platform)
+    formatter = logging.Formatter("logging %(process)d %(thread)d %(asctime)s - %(filename)s:%(lineno)d %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    log.info('%s version %s', __name__, __version__)
+    log.info('Python %r on %r', sys.version, sys.platform)
 
 
 is_win = sys.platform.startswith('win')
 
+class ConnectionPool(object):
+    """Keep-alive http/https connections, keyed on (scheme, host, port)
+    Connections are checked out for the duration of a request, so are never shared between threads.
+    """
+    def __init__(self, max_idle_per_host=4, timeout=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (connection, reused)"""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self.new_connection(key), False
+
+    def new_connection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        if self.timeout is None:
+            return connection_class(host, port)
+        return connection_class(host, port, timeout=self.timeout)
+
+    def put(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            for key in self._idle:
+                for connection in self._idle[key]:
+                    connection.close()
+            self._idle = {}
+
+
+def get_http_timeout():
+    timeout = os.environ.get('W2D_HTTP_TIMEOUT')  # seconds
+    if timeout:
+        return float(timeout)
+    return None
+
+MAX_REDIRECTS = 10
+CHUNK_SIZE = 64 * 1024  # bytes, for streamed response bodies
+
+
+class DownloadTooLargeError(Exception):
+    '''Response body larger than the maximum allowed, see W2D_MAX_DOWNLOAD_BYTES'''
+
+
+def read_response_body(response, response_headers, output_file=None, max_bytes=None):
+    """Read (http.client or urllib) response body in chunks.
+    If output_file is set, the body is written to it and None is returned, otherwise the body (bytes) is returned.
+    Raises DownloadTooLargeError if the body is larger than max_bytes (None or 0 means no limit)
+    """
+    content_length = response_headers.get('content-length')
+    if max_bytes and content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise DownloadTooLargeError('%d bytes (content-length), maximum %d' % (int(content_length), max_bytes))
+    chunks = []
+    size = 0
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise DownloadTooLargeError('over %d bytes, maximum %d' % (size, max_bytes))
+        if output_file is None:
+            chunks.append(chunk)
+        else:
+            output_file.write(chunk)
+    if content_length and content_length.isdigit() and size < int(content_length) and response_headers.get('transfer-encoding', '').lower() != 'chunked':
+        # read(amt) does not raise on a truncated body (unlike read())
+        raise httplib.IncompleteRead(b'', int(content_length) - size)
+    if output_file is None:
+        return b''.join(chunks)
+    return None
+
 AUTH_BASIC = 'basic'
 AUTH_DIGEST = 'digest'
-AUTO_AUTH = os.environ.get('AUTO_AUTH', AUTH_BASIC)
-def easy_get_url(url, headers=None, auto_auth=AUTO_AUTH, ignore_errors=False):
-    """if auto_auth is not-true do not guess auth information from URL
+
+
+def load_config():
+    """(Re-)read configuration from operating system environment variables"""
+    global AUTO_AUTH, EXTRACT_CACHE, MAX_DOWNLOAD_BYTES, MP_URL, PANDOC_BATCH_SIZE, PANDOC_EXE, PANDOC_SERVER, PANDOC_TIMEOUT, POSTLIGHT_BACKOFF, POSTLIGHT_CONCURRENCY, POSTLIGHT_RETRIES, REVALIDATE, USE_CONNECTION_POOL
+    global LOCALIZE_IMAGES, PROFILE, PROFILE_DIR, TRACE_FILE
+    global cache_dir, connection_pool, pandoc_server_pool
+    connection_pool = ConnectionPool(timeout=get_http_timeout())
+    USE_CONNECTION_POOL = os.environ.get('W2D_CONNECTION_POOL', 'true').lower() not in ('false', '0', 'no', 'off')
+    AUTO_AUTH = os.environ.get('AUTO_AUTH', AUTH_BASIC)
+    MAX_DOWNLOAD_BYTES = int(os.environ.get('W2D_MAX_DOWNLOAD_BYTES', 50 * 1024 * 1024))  # 0 means no limit
+
+    cache_dir = os.environ.get('W2D_CACHE_DIR', 'scrape_cache')  # created on first write
+    REVALIDATE = os.environ.get('W2D_CACHE_REVALIDATE', 'false').lower() in ('true', '1', 'yes', 'on')
+    EXTRACT_CACHE = os.environ.get('W2D_EXTRACT_CACHE', 'true').lower() not in ('false', '0', 'no', 'off')
+    LOCALIZE_IMAGES = os.environ.get('W2D_LOCALIZE_IMAGES', 'false').lower() in ('true', '1', 'yes', 'on')  # see w2d.assets
+
+    PANDOC_EXE = os.environ.get('W2D_PANDOC_EXE', 'pandoc')
+    PANDOC_TIMEOUT = float(os.environ.get('W2D_PANDOC_TIMEOUT', 120))  # seconds, per document (subprocess) or per request (server)
+    PANDOC_SERVER = os.environ.get('W2D_PANDOC_SERVER')  # url of pandoc-server, e.g. http://localhost:3030/ or 'auto' to start a local one
+    PANDOC_BATCH_SIZE = int(os.environ.get('W2D_PANDOC_BATCH_SIZE', 20))  # documents per pandoc server request in dump_urls()
+    pandoc_server_pool = ConnectionPool(timeout=PANDOC_TIMEOUT)
+
+    MP_URL = os.environ.get('MP_URL', 'http://localhost:3000/parser')  # maybe remove the parser piece... rename OS var?
+    POSTLIGHT_CONCURRENCY = int(os.environ.get('W2D_POSTLIGHT_CONCURRENCY', 4))  # maximum requests in flight to postlight server
+    POSTLIGHT_RETRIES = int(os.environ.get('W2D_POSTLIGHT_RETRIES', 2))  # retries for {"error": true}, 5xx, and invalid json responses
+    POSTLIGHT_BACKOFF = float(os.environ.get('W2D_POSTLIGHT_BACKOFF', 1.0))  # seconds, doubles for each retry
+
+    TRACE_FILE = os.environ.get('W2D_TRACE_FILE')  # append one json line per page/format processed, see report_page_metrics()
+    PROFILE = os.environ.get('W2D_PROFILE')  # cprofile or tracemalloc, see PageProfiler
+    PROFILE_DIR = os.environ.get('W2D_PROFILE_DIR', 'w2d_profile')
+
+load_config()  # environment only, no side effects. .env is read by configure()
+
+configured = False
+
+
+def configure():
+    """One time setup, on first use rather than at import; reads .env then re-reads the configuration.
+    Called by the entry points (get_url(), extract_page(), dump_url(), etc.), safe to call many times
+    """
+    global configured
+    if configured:
+        return
+    configured = True
+    load_dot_env()
+    load_config()
+
+
+timer = getattr(time, 'perf_counter', time.time)  # Py3.3+
+
+
+class PageTimings(object):
+    """Stage timings (seconds) for one page, see result_metadata['timings'].
+    Stages that run more than once accumulate. Nested stages (e.g. extract.trafilatura) are also
+    included in the enclosing stage (e.g. extract).
+    """
+    def __init__(self):
+        self.stages = {}
+        self.cache = {}  # fetch/extract -> hit, miss, or not_modified
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def copy(self):
+        result = PageTimings()
+        result.stages = dict(self.stages)
+        result.cache = dict(self.cache)
+        return result
+
+
+page_timings = threading.local()  # .current is the PageTimings of the page being processed by this thread
+
+
+def get_page_timings():
+    return getattr(page_timings, 'current', None)
+
+
+@contextlib.contextmanager
+def active_page_timings(timings):
+    """Make timings the target of timed_stage()/record_cache_result() calls in this thread"""
+    previous = get_page_timings()
+    page_timings.current = timings
+    try:
+        yield timings
+    finally:
+        page_timings.current = previous
+
+
+@contextlib.contextmanager
+def timed_stage(name, timings=None):
+    """Time a stage, into timings or the page currently being processed (no-op outside of extract_page()/render_page())"""
+    timings = timings or get_page_timings()
+    start = timer()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.add(name, timer() - start)
+
+
+def record_cache_result(name, result):
+    timings = get_page_timings()
+    if timings is not None:
+        timings.cache[name] = result
+
+
+metrics_callback = None  # optional function(record), called for each page/format processed, see report_page_metrics()
+trace_file_lock = threading.Lock()
+
+
+def report_page_metrics(url, result_metadata_list):
+    """Send a record per result_metadata (timings, cache results, profile) to metrics_callback and/or W2D_TRACE_FILE (json lines)"""
+    if metrics_callback is None and not TRACE_FILE:
+        return
+    for result_metadata in result_metadata_list:
+        record = {
+            'time': time.time(),
+            'url': url,
+            'format': result_metadata.get('format'),
+            'filename': result_metadata.get('filename'),
+            'timings': result_metadata.get('timings'),
+            'cache': result_metadata.get('cache'),
+        }
+        if result_metadata.get('profile'):
+            record['profile'] = result_metadata['profile']
+        if metrics_callback is not None:
+            try:
+                metrics_callback(record)
+            except Exception as info:
+                log.warning('metrics_callback failed %r', info)  # metrics should not stop processing
+        if TRACE_FILE:
+            line = json.dumps(record, sort_keys=True) + '\n'
+            with trace_file_lock:
+                f = open(TRACE_FILE, 'a')
+                f.write(line)
+                f.close()
+
+
+def get_package_name(filename):
+    """Top level package name for a source filename (used to group profile results), e.g. trafilatura, readability, bs4"""
+    if filename.startswith(('~', '<')):
+        return 'builtins'  # C functions and frozen modules
+    parts = os.path.abspath(filename).split(os.sep)
+    for marker in ('site-packages', 'dist-packages'):
+        if marker in parts:
+            index = len(parts) - 1 - parts[::-1].index(marker)
+            if index + 1 < len(parts):
+                return os.path.splitext(parts[index + 1])[0]
+    if os.path.dirname(os.path.abspath(filename)) == os.path.dirname(os.path.abspath(__file__)):
+        return 'w2d'
+    if filename.startswith(os.path.dirname(os.__file__)):
+        return 'stdlib'
+    return 'other'
+
+
+def sum_by_package(items):
+    """items is an iterable of (filename, value), returns dict of package name to total value"""
+    result = {}
+    for filename, value in items:
+        package_name = get_package_name(filename)
+        result[package_name] = result.get(package_name, 0) + value
+    return result
+
+
+profile_lock = threading.Lock()  # cProfile and tracemalloc are process wide, profile one page at a time
+
+
+class PageProfiler(object):
+    """Opt-in per page profiling, context manager.
+    mode - cprofile (time) or tracemalloc (memory allocations), defaults to env W2D_PROFILE (no profiling if not set)
+
+    Writes PROFILE_DIR/<url hash>.prof (see pstats) or .tracemalloc (see tracemalloc.Snapshot.load()).
+    result is a summary dict (with totals by package, e.g. trafilatura vs. readability vs. bs4) or None if not profiled.
+    Concurrent pages (threads) are not profiled while another page is being profiled.
+    """
+    def __init__(self, url, mode=None):
+        self.url = url
+        self.mode = PROFILE if mode is None else mode
+        self.result = None
+        self.profiler = None
+        self.was_tracing = False
+        self.locked = False
+
+    def __enter__(self):
+        if not self.mode:
+            return self
+        if self.mode not in ('cprofile', 'tracemalloc'):
+            raise NotImplementedError('W2D_PROFILE %r not supported, expected cprofile or tracemalloc' % self.mode)
+        if not profile_lock.acquire(False):
+            log.info('profiler in use, not profiling %r', self.url)
+            return self
+        self.locked = True
+        if self.mode == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            import tracemalloc  # Py3.4+
+            self.was_tracing = tracemalloc.is_tracing()
+            if self.was_tracing:
+                if hasattr(tracemalloc, 'reset_peak'):  # Py3.9+
+                    tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.locked:
+            return False
+        try:
+            # stop first, so that writing the results is not included
+            if self.mode == 'cprofile':
+                self.profiler.disable()
+            else:
+                import tracemalloc
+                current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                if not self.was_tracing:
+                    tracemalloc.stop()
+            safe_mkdir(PROFILE_DIR)
+            filename_prefix = os.path.join(PROFILE_DIR, hash_url(self.url))
+            if self.mode == 'cprofile':
+                import pstats
+                filename = filename_prefix + '.prof'
+                self.profiler.dump_stats(filename)
+                stats = pstats.Stats(self.profiler).stats
+                self.result = {
+                    'mode': self.mode,
+                    'filename': filename,
+                    'total_seconds': sum(function_stats[2] for function_stats in stats.values()),
+                    'seconds_by_package': sum_by_package((function_key[0], function_stats[2]) for function_key, function_stats in stats.items()),  # internal time
+                }
+            else:
+                filename = filename_prefix + '.tracemalloc'
+                snapshot.dump(filename)
+                self.result = {
+                    'mode': self.mode,
+                    'filename': filename,
+                    'peak_bytes': peak_bytes,
+                    'bytes_by_package': sum_by_package((statistic.traceback[0].filename, statistic.size) for statistic in snapshot.statistics('filename')),  # still allocated at end of page
+                }
+            log.info('profile for %r written to %r', self.url, filename)
+        finally:
+            self.locked = False
+            profile_lock.release()
+        return False
+
+
+# (scheme, host, port, username) -> opener.open, auth handlers are created once per host
+auth_openers = {}
+auth_openers_lock = threading.Lock()
+
+
+def get_digest_auth_opener(url_components, username, password):
+    key = (url_components.scheme, url_components.hostname, url_components.port, username)
+    with auth_openers_lock:
+        urlopen_func = auth_openers.get(key)
+        if urlopen_func is None:
+            host_url = '%s://%s' % (url_components.scheme, url_components.netloc[url_components.netloc.find('@') + 1:])
+            passman = HTTPPasswordMgrWithDefaultRealm()
+            passman.add_password(None, host_url, username, password)
+            authhandler = HTTPDigestAuthHandler(passman)
+            opener = build_opener(authhandler)
+            urlopen_func = auth_openers[key] = opener.open
+    return urlopen_func
+
+
+def pooled_http_get(url, headers=None, pool=None, output_file=None, max_bytes=None):
+    """GET url using keep-alive connections from pool (defaults to connection_pool), follows redirects.
+    Raises HTTPError for 4xx/5xx responses.
+    Returns (url, code, response_headers_dict, body_bytes)
+    If output_file is set, a 2xx body is streamed to it (body_bytes is None), see read_response_body()
+    """
+    return pooled_http_request('GET', url, headers=headers, pool=pool, output_file=output_file, max_bytes=max_bytes)
+
+
+def pooled_http_request(method, url, body=None, headers=None, pool=None, output_file=None, max_bytes=None):
+    """See pooled_http_get(), redirects are only followed for GET requests"""
+    pool = pool or connection_pool
+    headers = headers or {}
+    for _redirect in range(MAX_REDIRECTS + 1):
+        url_components = urlparse(url)
+        key = (url_components.scheme, url_components.hostname, url_components.port)
+        path = url_components.path or '/'
+        if url_components.query:
+            path = path + '?' + url_components.query
+
+        connection, reused = pool.get(key)
+        try:
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                # stale keep-alive connection (closed by server), retry once with a new connection
+                log.debug('stale connection for %r, reconnecting', key)
+                connection = pool.new_connection(key)
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            code = response.status
+            response_headers = dict((header_name.lower(), header_value) for header_name, header_value in response.getheaders())
+            if 200 <= code < 300:
+                response_body = read_response_body(response, response_headers, output_file=output_file, max_bytes=max_bytes)
+            else:
+                response_body = read_response_body(response, response_headers, max_bytes=max_bytes)  # redirects and errors are never streamed
+            if response.will_close:
+                connection.close()
+            else:
+                pool.put(key, connection)
+                connection = None
+        except:
+            if connection is not None:
+                connection.close()
+            raise
+
+        if method == 'GET' and code in (301, 302, 303, 307, 308) and response_headers.get('location'):
+            new_url = urljoin(url, response_headers['location'])
+            log.debug('get_url redirect %r -> %r', url, new_url)
+            if urlparse(new_url).netloc != url_components.netloc and 'Authorization' in headers:
+                headers = headers.copy()
+                del headers['Authorization']  # do not leak credentials to a different host
+            url = new_url
+            continue
+        if code >= 400:
+            raise HTTPError(url, code, response.reason, response_headers, BytesIO(response_body))
+        return url, code, response_headers, response_body
+    raise HTTPError(url, code, 'too many redirects', response_headers, BytesIO(response_body))
+
+
+def easy_get_url_response(url, headers=None, auto_auth=None, output_file=None, max_bytes=None):
+    """if auto_auth is None use env AUTO_AUTH (default basic)
+    if auto_auth is otherwise not-true do not guess auth information from URL
     if auto_auth is truthy, use that as auth scheme
+    output_file - if set, a 2xx body is written to it in chunks (rather than held in memory) and body_bytes is None
+    max_bytes - maximum body size, defaults to env W2D_MAX_DOWNLOAD_BYTES (50Mb, 0 means no limit). Raises DownloadTooLargeError
+
+    Uses keep-alive connections from connection_pool, unless a proxy is configured,
+    digest auth is in use, or env W2D_CONNECTION_POOL=false
+
+    Returns (url, code, response_headers_dict, body_bytes), url may differ from the one requested due to redirects.
+    Response header names are lower case. 304 (Not Modified) is returned, not raised.
     """
+    configure()
+    if auto_auth is None:
+        auto_auth = AUTO_AUTH
+    if max_bytes is None:
+        max_bytes = MAX_DOWNLOAD_BYTES
     headers_to_send = headers or {}
-    urlopen_func = urlopen
+    urlopen_func = None  # None means use connection_pool
     auth = None
     url_components = urlparse(url)
-    print(url_components)
     if 'Authorization' not in headers_to_send:  # FIXME wrong for hex digest?
         if url_components.username:
             # some sort of auth
@@ -166,50 +645,69 @@ def easy_get_url(url, headers=None, auto_auth=AUTO_AUTH, ignore_errors=False):
             # AUTH_BASIC
             auth = (url_components.username, url_components.password or '')
             # could use urlunparse() to reconstruct url BUT order may be different, shouldn't matter but attempt to preserve
-            print(url_components.scheme)
-            print(url[url.find('@') + 1:])
             url = url_components.scheme + '://' + url[url.find('@') + 1:]
+            log.debug('auth url %r (credentials removed)', url)  # NOTE url_components has the password, not logged
         if auth:  # option to inject some otherway, e.g. params, environment variables, etc.
             if auto_auth == AUTH_BASIC:
                 auth_info = {'username': auth[0], 'secret': auth[1]}
                 encoded_auth = base64.b64encode("{username}:{secret}".format(**auth_info).encode()).decode()
                 headers_to_send = headers_to_send.copy()
                 headers_to_send['Authorization'] = "Basic {encoded_auth}".format(encoded_auth=encoded_auth)
-                urlopen_func = urlopen
             elif auto_auth == AUTH_DIGEST:
-                passman = HTTPPasswordMgrWithDefaultRealm()
-                passman.add_password(None, url, auth[0], auth[1])
-                authhandler = HTTPDigestAuthHandler(passman)
-                opener = build_opener(authhandler)
-                urlopen_func = opener.open
+                urlopen_func = get_digest_auth_opener(url_components, auth[0], auth[1])
             else:
                 raise NotImplementedError('auto_auth=%r' % auto_auth)
+    if urlopen_func is None and (not USE_CONNECTION_POOL or url_components.scheme not in ('http', 'https') or url_components.scheme in getproxies()):
+        urlopen_func = urlopen
 
     #return 'WIP'
     log.debug('get_url=%r', url)
     #log.debug('headers=%r', headers_to_send)
+    if urlopen_func is None:
+        url, code, response_headers, result = pooled_http_get(url, headers=headers_to_send, output_file=output_file, max_bytes=max_bytes)
+        log.debug('get_url response code=%r', code)
+        return url, code, response_headers, result
+
     response = None
     try:
         if headers_to_send:
             request = Request(url, headers=headers_to_send)
         else:
             request = Request(url)  # may not be needed
-        response = urlopen_func(request)
+        try:
+            response = urlopen_func(request)
+        except HTTPError as info:
+            if info.code != 304:
+                raise
+            log.debug('get_url response code=%r', info.code)
+            return url, info.code, dict((header_name.lower(), header_value) for header_name, header_value in info.info().items()), b''
         url = response.geturl()  # may have changed in case of redirect
         code = response.getcode()
         #log("getURL [{}] response code:{}".format(url, code))
         log.debug('get_url response code=%r', code)
-        result = response.read()
+        response_headers = dict((header_name.lower(), header_value) for header_name, header_value in response.info().items())
+        result = read_response_body(response, response_headers, output_file=output_file, max_bytes=max_bytes)
+        return url, code, response_headers, result
+    finally:
+        if response != None:
+            response.close()
+
+
+def easy_get_url(url, headers=None, auto_auth=None, ignore_errors=False):
+    """if auto_auth is None use env AUTO_AUTH (default basic)
+    if auto_auth is otherwise not-true do not guess auth information from URL
+    if auto_auth is truthy, use that as auth scheme
+    Returns body bytes, see easy_get_url_response()
+    """
+    try:
+        url, code, response_headers, result = easy_get_url_response(url, headers=headers, auto_auth=auto_auth)
         return result
-    except:  # HTTPError, ConnectionRefusedError
-        # probably got HTTPError, may be ConnectionRefusedError
+    except Exception:  # HTTPError, ConnectionRefusedError
+        # probably got HTTPError, may be ConnectionRefusedError. Not KeyboardInterrupt
         if ignore_errors:
            return None
         else:
            raise
-    finally:
-        if response != None:
-            response.close()
 
 urllib_get_url = easy_get_url
 
@@ -223,14 +721,65 @@ def safe_mkdir(newdir):
         else:
             raise
 
-cache_dir = os.environ.get('W2D_CACHE_DIR', 'scrape_cache')
-safe_mkdir(cache_dir)
 
 def hash_url(url):
     m = md5()
     m.update(url.encode('utf-8'))
     return m.hexdigest()
 
+
+DEFAULT_TRACKING_PARAMS = 'utm_*,fbclid,gclid,dclid,gbraid,wbraid,msclkid,yclid,mc_cid,mc_eid,igshid,_ga,_gl,ref_src'
+
+def get_tracking_params():
+    """Returns (exact_names, prefixes) of query parameters to strip, from env W2D_TRACKING_PARAMS (comma separated, trailing '*' is a prefix match)"""
+    exact_names = set()
+    prefixes = []
+    for name in os.environ.get('W2D_TRACKING_PARAMS', DEFAULT_TRACKING_PARAMS).split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name.endswith('*'):
+            prefixes.append(name[:-1])
+        else:
+            exact_names.add(name)
+    return exact_names, tuple(prefixes)
+
+
+def canonical_url(url, tracking_params=None):
+    """Canonical form of url, for use as a cache key. NOTE not intended for fetching.
+        * scheme and host lower cased, default port removed
+        * fragment removed
+        * tracking query parameters removed (see get_tracking_params())
+        * remaining query parameters sorted
+    tracking_params - (exact_names, prefixes) defaults to get_tracking_params()
+    """
+    exact_names, prefixes = tracking_params or get_tracking_params()
+    url_components = urlparse(url)
+    scheme = url_components.scheme.lower()
+    if not url_components.netloc:
+        return url  # not a network url, e.g. local file
+    netloc = url_components.hostname or ''
+    if ':' in netloc:
+        netloc = '[%s]' % netloc  # IPv6
+    port = url_components.port
+    if port and not (scheme, port) in (('http', 80), ('https', 443)):
+        netloc = '%s:%d' % (netloc, port)
+    if url_components.username is not None:
+        userinfo = url_components.netloc.rsplit('@', 1)[0]
+        netloc = '%s@%s' % (userinfo, netloc)
+    query_params = []
+    for name, value in parse_qsl(url_components.query, keep_blank_values=True):
+        if name in exact_names or (prefixes and name.startswith(prefixes)):
+            continue
+        query_params.append((name, value))
+    query_params.sort()
+    result = '%s://%s%s' % (scheme, netloc, url_components.path or '/')
+    if url_components.params:
+        result += ';' + url_components.params
+    if query_params:
+        result += '?' + urlencode(query_params)
+    return result
+
 # headers to emulate Firefox - actual headers from real browser
 MOZILLA_FIREFOX_HEADERS = {
     #'HTTP_HOST': 'localhost:8000',
@@ -249,49 +798,288 @@ MOZILLA_FIREFOX_HEADERS = {
 }
 
 
+def get_cache_filename(url):
+    """Cache filename for url, based on the canonical url (see canonical_url())
+    falls back to pre-canonical (exact url) cache entries if present"""
+    configure()
+    filename = os.path.join(cache_dir, hash_url(canonical_url(url)))
+    if not os.path.exists(filename):
+        legacy_filename = os.path.join(cache_dir, hash_url(url))
+        if legacy_filename != filename and os.path.exists(legacy_filename):
+            return legacy_filename
+    return filename
+
+
+def get_cache_metadata_filename(filename):
+    """sidecar file, next to the cache entry, with response header information"""
+    return filename + '.json'
+
+
+def read_cache_metadata(filename):
+    """Returns metadata dict for cache entry filename (empty dict if there is no metadata)"""
+    metadata_filename = get_cache_metadata_filename(filename)
+    if not os.path.exists(metadata_filename):
+        return {}
+    f = open(metadata_filename, 'rb')
+    metadata = json.loads(f.read().decode('utf-8'))
+    f.close()
+    return metadata
+
+
+def write_cache_metadata(filename, metadata):
+    f = open(get_cache_metadata_filename(filename), 'wb')
+    f.write(json.dumps(metadata, indent=4, sort_keys=True).encode('utf-8'))
+    f.close()
+
+
+def cache_page(url, page, filename=None, code=None, response_headers=None):
+    """Write page (bytes) to the scrape cache for url
+    if response_headers (dict) is provided, they are saved in a (json) sidecar file for later revalidation
+    """
+    filename = filename or get_cache_filename(url)
+    content_hash = None
+    codec = get_cache_codec()
+    directory = os.path.dirname(os.path.abspath(filename))
+    safe_mkdir(directory)
+    if is_cache_dedupe_enabled() and directory == os.path.abspath(cache_dir):
+        # identical bodies (e.g. tracking parameter variants) are stored once
+        size, content_hash = write_cache_entry(directory, filename, page, codec)
+    else:
+        size = write_cache_file(filename, page, codec)
+    record_cache_entry(url, filename, size, code=code, response_headers=response_headers, content_hash=content_hash, codec=codec)
+    return filename
+
+
+def record_cache_entry(url, filename, size, code=None, response_headers=None, content_hash=None, codec=None):
+    """Metadata sidecar, index, and cache limits for a newly written cache entry"""
+    if response_headers is not None:
+        metadata = {
+            'url': url,
+            'status': code,
+            'fetch_time': time.time(),
+            'headers': response_headers,
+        }
+        write_cache_metadata(filename, metadata)
+    index_cache_entry(url, filename, size, code=code, response_headers=response_headers, content_hash=content_hash, codec=codec)
+    enforce_cache_limits(os.path.dirname(filename))
+
+
+def download_to_cache(url, filename=None, headers=None, max_bytes=None):
+    """Stream url into the scrape cache, the body is never held in memory.
+    The body is written in chunks to a temporary file (compressed and hashed as it is written)
+    which is moved into place once complete. Failed, interrupted, or too large (max_bytes, see easy_get_url_response())
+    downloads leave any existing cache entry as-is. On 304 (Not Modified) the cache entry is not changed.
+    Returns (filename, code, response_headers)
+    """
+    from .cache import CacheFileWriter, install_cache_entry
+    configure()
+    filename = filename or get_cache_filename(url)
+    directory = os.path.dirname(os.path.abspath(filename))
+    safe_mkdir(directory)
+    tmp_filename = '%s.%d.%d.download' % (filename, os.getpid(), threading.current_thread().ident)
+    codec = get_cache_codec()
+    try:
+        writer = CacheFileWriter(tmp_filename, codec)
+        try:
+            response_url, code, response_headers, page = easy_get_url_response(url, headers=headers, output_file=writer, max_bytes=max_bytes)
+        finally:
+            writer.close()
+        if code != 304:
+            content_hash = None
+            if is_cache_dedupe_enabled() and directory == os.path.abspath(cache_dir):
+                content_hash = writer.hexdigest()
+            size = install_cache_entry(directory, filename, tmp_filename, content_hash=content_hash, codec=codec)
+            log.debug('downloaded %d bytes (%d on disk) to %r', writer.size, size, filename)
+            record_cache_entry(url, filename, size, code=code, response_headers=response_headers, content_hash=content_hash, codec=codec)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return filename, code, response_headers
+
+
+cache_indexes = {}
+cache_indexes_lock = threading.Lock()
+
+def get_cache_index(directory=None):
+    """Returns CacheIndex for directory (defaults to cache_dir)"""
+    from .cache import CacheIndex  # NOTE not at module level, avoids runpy warning for python -m w2d.cache
+    configure()
+    directory = os.path.abspath(directory or cache_dir)
+    with cache_indexes_lock:
+        index = cache_indexes.get(directory)
+        if index is None:
+            safe_mkdir(directory)
+            index = cache_indexes[directory] = CacheIndex(directory)
+    return index
+
+
+def get_cache_entry_key(filename):
+    """Returns (CacheIndex, entry name) for cache file filename, extraction results (extract/...) are in the cache_dir index"""
+    extract_dir = os.path.join(os.path.abspath(cache_dir), EXTRACT_CACHE_DIRNAME) + os.sep
+    if os.path.abspath(filename).startswith(extract_dir):
+        return get_cache_index(), get_extract_cache_entry_name(filename)
+    return get_cache_index(os.path.dirname(filename)), os.path.basename(filename)
+
+
+def read_cache_file(filename):
+    """Read scrape cache entry, decompressed with the codec recorded in the cache index"""
+    from .cache import read_cache_file
+    index, entry_name = get_cache_entry_key(filename)
+    return read_cache_file(filename, index.get_codec(entry_name))
+
+
+def get_cache_codec():
+    """Codec for new cache entries, W2D_CACHE_COMPRESSION"""
+    from .cache import get_cache_codec
+    return get_cache_codec()
+
+
+def write_cache_file(filename, data, codec=None):
+    """Write scrape cache entry, compressed with codec (defaults to W2D_CACHE_COMPRESSION), the caller records the codec in the index.
+    filename is replaced, never written to in place (it may be linked to a de-duplicated body). Returns on disk size"""
+    from .cache import write_cache_file
+    return write_cache_file(filename, data, codec=codec)
+
+
+def is_cache_dedupe_enabled():
+    from .cache import is_dedupe_enabled
+    return is_dedupe_enabled()
+
+
+def write_cache_entry(directory, filename, data, codec=None):
+    """Write scrape cache entry, body stored once by content hash. Returns (on disk size, content_hash)"""
+    from .cache import write_cache_entry
+    return write_cache_entry(directory, filename, data, codec=codec)
+
+
+def get_cache_limits():
+    from .cache import get_cache_limits
+    return get_cache_limits()
+
+
+def is_cache_entry_expired(filename):
+    max_age = get_cache_limits()['max_age']
+    if max_age is None:
+        return False
+    index, entry_name = get_cache_entry_key(filename)
+    return index.is_expired(entry_name, max_age)
+
+
+def enforce_cache_limits(directory=None):
+    """Evict cache entries (see w2d.cache.compact()) if any limits are configured"""
+    from .cache import compact
+    directory = directory or cache_dir
+    limits = get_cache_limits()
+    if limits['max_bytes'] is None and limits['max_entries'] is None and limits['max_age'] is None:
+        return []
+    return compact(directory, index=get_cache_index(directory), **limits)
+
+
+def index_cache_entry(url, filename, size, code=None, response_headers=None, content_hash=None, codec=None):
+    # if filename passed in to get_url(), hash is not used, the index lives in the same directory as the file
+    response_headers = response_headers or {}
+    index = get_cache_index(os.path.dirname(filename))
+    index.record(os.path.basename(filename), url, size, status=code, content_type=response_headers.get('content-type'), content_hash=content_hash, codec=codec)
+
+
+def get_revalidation_headers(metadata):
+    """Conditional request headers, based on cache metadata from a previous response"""
+    cached_headers = metadata.get('headers') or {}
+    headers = {}
+    if cached_headers.get('etag'):
+        headers['If-None-Match'] = cached_headers['etag']
+    if cached_headers.get('last-modified'):
+        headers['If-Modified-Since'] = cached_headers['last-modified']
+    return headers
+
+
+
 # TODO handle failures, remove cache?
 # env var for force
-def get_url(url, filename=None, force=False, cache=True):
+def get_url(url, filename=None, force=False, cache=True, revalidate=None):
     """Get a url, optionally with caching
-    TODO get headers, use last modified date (save to disk file as meta data), return it (and other metadata) along with page content
+    Response headers are saved next to the cache entry (filename + '.json').
+    revalidate - if set and a cached copy exists, issue a conditional request (If-None-Match/If-Modified-Since)
+        and only download the page if it changed (i.e. not a 304). Cache entries without an ETag or Last-Modified
+        are downloaded again. Defaults to env W2D_CACHE_REVALIDATE (false).
+    TODO return metadata along with page content
     """
+    configure()
+    if revalidate is None:
+        revalidate = REVALIDATE
     #filename = filename or 'tmp_file.html'
-    filename = filename or os.path.join(cache_dir, hash_url(url))
+    filename = filename or get_cache_filename(url)
     ## cache it
-    if force or not os.path.exists(filename):
+    cache_exists = is_cache_entry_fresh(filename, force=force)
+    if force or not cache_exists or revalidate:
+        headers = MOZILLA_FIREFOX_HEADERS
+        metadata = None
+        if cache_exists and revalidate and not force:
+            metadata = read_cache_metadata(filename)
+            revalidation_headers = get_revalidation_headers(metadata)
+            if revalidation_headers:
+                log.debug('revalidating cached file %r with %r', filename, revalidation_headers)
+                headers = headers.copy()
+                headers.update(revalidation_headers)
         log.debug('getting web page %r', url)
-        # TODO grab header information
         # TODO error reporting?
 
+        page = None  # None means streamed straight into the cache
         use_requests = False
         if use_requests:
             response = requests.get(url)
             page = response.text.encode('utf8')  # FIXME revisit this - cache encoding
+            code, response_headers = response.status_code, dict((header_name.lower(), header_value) for header_name, header_value in response.headers.items())
+        elif cache:
+            filename, code, response_headers = download_to_cache(url, filename=filename, headers=headers)
         else:
-            headers = MOZILLA_FIREFOX_HEADERS
-
-            page = urllib_get_url(url, headers=headers)
+            response_url, code, response_headers, page = easy_get_url_response(url, headers=headers)
 
-        if cache:
-            f = open(filename, 'wb')
-            f.write(page)
-            f.close()
-            # initial index - needs reworking - if filename passed in, hash is not used
-            index_filename = os.path.join(os.path.dirname(filename), 'index.tsv')
-            f = open(index_filename, 'ab')
-            entry = '%s\t%s\n' % (os.path.basename(filename), url)
-            f.write(entry.encode('utf-8'))
-            f.close()
-            # TODO log hash and original url to an index of some kind (sqlite3 db probably best)
+        if code == 304:
+            page = read_not_modified(url, filename, metadata)
+        else:
+            record_cache_result('fetch', 'miss')
+            if page is None:
+                page = read_cache_file(filename)
+            elif cache:
+                cache_page(url, page, filename=filename, code=code, response_headers=response_headers)
     else:
-        log.debug('getting cached file %r', filename)
-        f = open(filename, 'rb')
-        page = f.read()
-        f.close()
+        page = read_cache_hit(filename)
     log.debug('page %d bytes', len(page))  # TODO human bytes
     return page
 
 
+def is_cache_entry_fresh(filename, force=False):
+    """True if cache entry filename exists and can be used without a request (unless revalidating), see get_url()"""
+    if force or not os.path.exists(filename):
+        return False
+    if is_cache_entry_expired(filename):
+        log.debug('cache entry expired %r', filename)
+        return False
+    return True
+
+
+def read_cache_hit(filename):
+    """Returns cached page (bytes), access recorded for least recently used eviction"""
+    log.debug('getting cached file %r', filename)
+    record_cache_result('fetch', 'hit')
+    page = read_cache_file(filename)
+    get_cache_index(os.path.dirname(filename)).touch(os.path.basename(filename))
+    return page
+
+
+def read_not_modified(url, filename, metadata):
+    """Returns cached page (bytes) after a 304 (Not Modified) revalidation, the cache entry is recorded as freshly fetched"""
+    log.debug('not modified, getting cached file %r', filename)
+    record_cache_result('fetch', 'not_modified')
+    page = read_cache_file(filename)
+    metadata['fetch_time'] = time.time()
+    metadata['status'] = 304
+    write_cache_metadata(filename, metadata)
+    index_cache_entry(url, filename, os.path.getsize(filename), code=304, response_headers=metadata.get('headers'))
+    return page
+
+
 FORMAT_MARKDOWN = 'md'  # Markdown
 FORMAT_HTML = 'html'  # (potentiall) raw html/xhtml only - no external images, fonts, css, etc.
 FORMAT_EPUB = 'epub'  # epub2
@@ -354,46 +1142,304 @@ def to_byte(data, encoding='utf-8'):
     else:
         return data  # byte already
 
-def pandoc_markdown_output_filter_function(url=None, content=None, title='Title Unknown', content_format=FORMAT_HTML):
-    """url ignored, content expected
-    TODO sanity checks
+class ParsedDocument(object):
+    """Html page parsed once (with lxml), shared between trafilatura, readability and link re-writing.
+    Consumers that modify the tree (e.g. readability and trafilatura clean the tree in place) should use clone().
     """
-    log.debug('content type %r', type(content))
-    # pandoc 1.19.2.4 - does not understand gfm parameter
-    #echo hello world | pandoc -f gfm -o test.epub --metadata "title=test"
-    pandoc_input_format = content_format
-    if content_format != FORMAT_HTML:
-        raise NotImplementedError('content_format=%r' % content_format)
+    def __init__(self, content):
+        self.text = content  # (Unicode) string, or bytes
+        self._tree = None
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            # parse bytes, lxml refuses Unicode strings with an xml encoding declaration
+            parser = lxml.html.HTMLParser(encoding='utf-8')
+            self._tree = lxml.html.document_fromstring(to_byte(self.text), parser=parser)
+        return self._tree
+
+    def clone(self):
+        return copy.deepcopy(self.tree)
+
+    def title(self):
+        title_tag = self.tree.find('.//title')
+        if title_tag is not None and title_tag.text:
+            return title_tag.text
+        return None
+
+    def tostring(self):
+        doctype = None
+        if get_page_text(self).lstrip()[:9].lower() in ('<!doctype', b'<!doctype'):
+            # only keep doctype if original had one, libxml2 makes one up otherwise
+            doctype = self.tree.getroottree().docinfo.doctype
+        return lxml.html.tostring(self.tree, encoding='unicode', method='html', doctype=doctype)
+
+
+def get_page_text(page_content):
+    """page_content maybe a ParsedDocument or a string"""
+    if isinstance(page_content, ParsedDocument):
+        return page_content.text
+    return page_content
+
+
+
+PANDOC_BINARY_FORMATS = ('epub', 'epub2', 'epub3', 'docx', 'odt', 'pptx')
+
+pandoc_server_process = None
+pandoc_server_lock = threading.Lock()
+
+
+class PandocError(Exception):
+    pass
+
+
+def get_pandoc_input(content, pandoc_input_format, title=None):
+    """Embed title in the document, rather than command line --metadata (which pandoc server does not support)"""
+    if not title:
+        return content
+    if pandoc_input_format == 'html':
+        # NOTE escaping minimal, title is text
+        escaped_title = title.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        return '<html><head><title>%s</title></head><body>%s</body></html>' % (escaped_title, content)
+    return content
+
+
+def start_pandoc_server():
+    """Start a local pandoc server (pandoc 3.x), returns its url. Stopped on exit"""
+    global pandoc_server_process
+    import atexit
+
+    # find a free port
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    cmd = [PANDOC_EXE, 'server', '--port', str(port), '--timeout', str(int(PANDOC_TIMEOUT))]
+    log.info('starting pandoc server %r', cmd)
+    pandoc_server_process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    atexit.register(stop_pandoc_server)
+    deadline = time.time() + 10
+    while True:
+        if pandoc_server_process.poll() is not None:
+            raise PandocError('pandoc server failed to start %r' % (pandoc_server_process.stderr.read(),))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except socket.error:
+            if time.time() > deadline:
+                stop_pandoc_server()
+                raise PandocError('pandoc server did not start listening on port %d' % port)
+            time.sleep(0.05)
+    return 'http://127.0.0.1:%d/' % port
+
+
+def stop_pandoc_server():
+    global pandoc_server_process
+    if pandoc_server_process is not None:
+        pandoc_server_process.kill()
+        pandoc_server_process.wait()
+        pandoc_server_process = None
+
+
+def get_pandoc_server_url():
+    """Returns pandoc server url, or None if no server configured (W2D_PANDOC_SERVER)"""
+    global PANDOC_SERVER
+    if PANDOC_SERVER == 'auto':
+        with pandoc_server_lock:
+            if PANDOC_SERVER == 'auto':
+                PANDOC_SERVER = start_pandoc_server()
+    return PANDOC_SERVER
+
+
+def pandoc_server_convert(jobs, server_url):
+    """Convert a list of jobs (see pandoc_convert_batch()) with a single pandoc server /batch request
+    Returns list of outputs, bytes for binary formats (e.g. epub) else (Unicode) strings,
+    or a PandocError instance for a document the server failed to convert
+    """
+    requests_list = []
+    for job in jobs:
+        request = {
+            'text': get_pandoc_input(job['content'], job['from'], job.get('title')),
+            'from': job['from'],
+            'to': job['to'],
+            'standalone': job['to'] in PANDOC_BINARY_FORMATS,
+        }
+        if job.get('toc'):
+            request['table-of-contents'] = True
+            request['toc-depth'] = 1
+        requests_list.append(request)
+    body = json.dumps(requests_list).encode('utf-8')
+    headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+    url, code, response_headers, response_body = pooled_http_request('POST', urljoin(server_url, 'batch'), body=body, headers=headers, pool=pandoc_server_pool)
+    results = []
+    for result in json.loads(response_body.decode('utf-8')):
+        if isinstance(result, dict):
+            if result.get('base64'):
+                output = base64.b64decode(result['output'])
+            else:
+                output = result['output']
+        else:
+            # error message string, only this document failed
+            output = PandocError('pandoc server error %r' % (result,))
+        results.append(output)
+    return results
 
-    pandoc_output_format = 'markdown'  # gfm
+
+def run_pandoc(content, pandoc_input_format, pandoc_output_format, title=None, output_filename=None, timeout=None, toc=False):
+    """Convert content with a new pandoc process
+    Returns stdout bytes (empty if output_filename is used)
+    timeout - seconds, defaults to W2D_PANDOC_TIMEOUT
+    toc - include a table of contents (of level 1 headings)
+    """
+    configure()
+    if timeout is None:
+        timeout = PANDOC_TIMEOUT
     if is_win:
         expand_shell = True  # avoid pop-up black CMD window
     else:
         expand_shell = False
-    pandoc_exe = 'pandoc'  # TODO pick up from environ
-    cmd = [pandoc_exe, '-f', pandoc_input_format, '-t', pandoc_output_format, '--metadata', 'title=%s' % title]
+    cmd = [PANDOC_EXE, '-f', pandoc_input_format, '-t', pandoc_output_format]
+    if output_filename:
+        cmd += ['-o', output_filename]
+    if title:
+        cmd += ['--metadata', 'title=%s' % title]
+    if toc:
+        cmd += ['--toc', '--toc-depth=1']
     p = subprocess.Popen(cmd, shell=expand_shell, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    # time out is py3 (3.3+?)
-    """
     try:
-        timeout = 15
-        timeout = 3
-        stdout_value, stderr_value = p.communicate(timeout=timeout)
+        stdout_value, stderr_value = p.communicate(input=to_byte(content), timeout=timeout)
+    except TypeError:
+        # Py2, no timeout support
+        stdout_value, stderr_value = p.communicate(input=to_byte(content))
     except subprocess.TimeoutExpired:
         p.kill()
-        #stdout_value, stderr_value = p.communicate()  # just hangs again
-        stdout_value, stderr_value = '', ''
-    """
-    stdout_value, stderr_value = p.communicate(input=to_byte(content))
+        p.communicate()
+        raise PandocError('pandoc timed out after %r seconds, %r' % (timeout, cmd))
 
-    #import pdb ; pdb.set_trace()
-    if p.returncode == 0 and stdout_value and stderr_value == b'':
+    if p.returncode == 0 and stderr_value == b'':
         # success!
-        log.debug('type %r', type(stdout_value))
-        #log.debug('%r', stdout_value)
-        return stdout_value.decode('utf-8')
+        return stdout_value
     else:
-        raise NotImplementedError('Error handling, %r, %r, %r' % (p.returncode, stderr_value, stdout_value))
+        raise PandocError('Error handling, %r, %r, %r' % (p.returncode, stderr_value, stdout_value))
+
+
+pandoc_batch_results = threading.local()  # .results is dict of get_pandoc_job_key() to output, see pandoc_batch()
+
+
+def get_pandoc_job_key(job):
+    return (job['content'], job['from'], job['to'], job.get('title'), job.get('toc', False))
+
+
+def write_pandoc_output(output_filename, output):
+    f = open(output_filename, 'wb')
+    f.write(to_byte(output))
+    f.close()
+
+
+def pandoc_convert(content, pandoc_input_format, pandoc_output_format, title=None, output_filename=None, toc=False):
+    """Convert content, with pandoc server if configured (W2D_PANDOC_SERVER) otherwise a pandoc process.
+    If output_filename is set result is written to it, else result is returned;
+    bytes for binary formats (e.g. epub) else (Unicode) string
+    Uses the result converted ahead of time by pandoc_batch(), if any.
+    """
+    job = {'content': content, 'from': pandoc_input_format, 'to': pandoc_output_format, 'title': title, 'output_filename': output_filename, 'toc': toc}
+    results = getattr(pandoc_batch_results, 'results', None)
+    if results:
+        output = results.pop(get_pandoc_job_key(job), None)
+        if isinstance(output, PandocError):
+            log.warning('%r, falling back to pandoc process for %r', output, title)
+            return run_pandoc_job(job)
+        elif output is not None:
+            if output_filename:
+                write_pandoc_output(output_filename, output)
+            return output
+    return pandoc_convert_batch([job])[0]
+
+
+def run_pandoc_job(job):
+    """run_pandoc() for a job (see pandoc_convert_batch()), returns result as pandoc_convert()"""
+    output = run_pandoc(job['content'], job['from'], job['to'], title=job.get('title'), output_filename=job.get('output_filename'), toc=job.get('toc', False))
+    if job['to'] not in PANDOC_BINARY_FORMATS:
+        output = output.decode('utf-8')
+    return output
+
+
+def pandoc_convert_batch(jobs):
+    """Convert many documents, amortizing pandoc startup.
+    jobs - list of dicts with keys; content, from, to, title (optional), output_filename (optional), toc (optional)
+    With a pandoc server (W2D_PANDOC_SERVER) all jobs are sent in one request,
+    if the server is not available falls back to one pandoc process per document,
+    as does a document the server fails to convert.
+    Returns list of results, see pandoc_convert()
+    """
+    configure()
+    results = None
+    server_url = get_pandoc_server_url()
+    if server_url:
+        try:
+            results = pandoc_server_convert(jobs, server_url)
+        except (socket.error, httplib.HTTPException, HTTPError) as info:
+            log.warning('pandoc server %r failed %r, falling back to pandoc process per document', server_url, info)
+    if results is None:
+        results = [None] * len(jobs)
+    for index, job in enumerate(jobs):
+        output = results[index]
+        if isinstance(output, PandocError):
+            log.warning('%r, falling back to pandoc process for %r', output, job.get('title'))
+            output = None
+        if output is None:
+            output = run_pandoc_job(job)
+        elif job.get('output_filename'):
+            write_pandoc_output(job['output_filename'], output)
+        results[index] = output
+    return results
+
+
+@contextlib.contextmanager
+def pandoc_batch(jobs):
+    """Convert jobs (see pandoc_convert_batch()) ahead of time in one pandoc server request, pandoc_convert() calls
+    (in this thread) for the same documents then use the results. No-op without a pandoc server (W2D_PANDOC_SERVER),
+    one pandoc process per document gains nothing from batching.
+    A document the server fails to convert is converted by a pandoc process when rendered, if the server
+    is not available each document is converted (with fallback) when rendered.
+    """
+    configure()
+    previous = getattr(pandoc_batch_results, 'results', None)
+    results = dict(previous or {})
+    jobs = [job for job in jobs if get_pandoc_job_key(job) not in results]  # e.g. already converted in a dump_urls() batch
+    server_url = jobs and get_pandoc_server_url()
+    if server_url:
+        try:
+            outputs = pandoc_server_convert(jobs, server_url)
+        except (socket.error, httplib.HTTPException, HTTPError) as info:
+            log.warning('pandoc server %r failed %r, batch of %d documents not converted ahead of time', server_url, info, len(jobs))
+            outputs = []
+        for job, output in zip(jobs, outputs):
+            results[get_pandoc_job_key(job)] = output
+    pandoc_batch_results.results = results
+    try:
+        yield
+    finally:
+        pandoc_batch_results.results = previous
+
+
+def pandoc_markdown_output_filter_function(url=None, content=None, title='Title Unknown', content_format=FORMAT_HTML):
+    """url ignored, content expected
+    TODO sanity checks
+    """
+    log.debug('content type %r', type(content))
+    # pandoc 1.19.2.4 - does not understand gfm parameter
+    #echo hello world | pandoc -f gfm -o test.epub --metadata "title=test"
+    pandoc_input_format = content_format
+    if content_format != FORMAT_HTML:
+        raise NotImplementedError('content_format=%r' % content_format)
+
+    pandoc_output_format = 'markdown'  # gfm
+    result = pandoc_convert(content, pandoc_input_format, pandoc_output_format, title=title)
+    if not result:
+        raise PandocError('Error handling, no output')
+    return result
 
 
 def pandoc_epub_output_function(output_filename, url=None, content=None, title='Title Unknown', content_format=FORMAT_HTML):
@@ -406,31 +1452,7 @@ def pandoc_epub_output_function(output_filename, url=None, content=None, title='
         # Assume markdown, GitHub Flavored
         pandoc_input_format = 'gfm'
 
-    if is_win:
-        expand_shell = True  # avoid pop-up black CMD window
-    else:
-        expand_shell = False
-    pandoc_exe = 'pandoc'  # TODO pick up from environ
-    cmd = [pandoc_exe, '-f', pandoc_input_format, '-o', output_filename, '--metadata', 'title=%s' % title]
-    p = subprocess.Popen(cmd, shell=expand_shell, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    # time out is py3 (3.3+?)
-    """
-    try:
-        timeout = 15
-        timeout = 3
-        stdout_value, stderr_value = p.communicate(timeout=timeout)
-    except subprocess.TimeoutExpired:
-        p.kill()
-        #stdout_value, stderr_value = p.communicate()  # just hangs again
-        stdout_value, stderr_value = '', ''
-    """
-    stdout_value, stderr_value = p.communicate(input=content.encode('utf-8'))
-
-    if p.returncode == 0 and stdout_value == b'' and stderr_value == b'':
-        # success!
-        pass
-    else:
-        raise NotImplementedError('Error handling, %r, %r, %r' % (p.returncode, stderr_value, stdout_value))
+    pandoc_convert(content, pandoc_input_format, 'epub', title=title, output_filename=output_filename)
 
 def pypub_epub_output_function(output_filename, url=None, content=None, title='Title Unknown', content_format=FORMAT_HTML):
     """
@@ -447,7 +1469,45 @@ def pypub_epub_output_function(output_filename, url=None, content=None, title='T
     my_epub.create_epub('.', epub_name=output_filename[:-(len(FORMAT_EPUB)+1)])  # pypub does NOT want extension specified, strip '.epub' - NOTE requires fix for https://github.com/wcember/pypub/issues/29
 
 
-MP_URL = os.environ.get('MP_URL', 'http://localhost:3000/parser')  # maybe remove the parser piece... rename OS var?
+heading_tag_re = re.compile(r'<(/?)h([1-6])\b', re.IGNORECASE)
+
+
+def demote_headings(content, levels=1):
+    """Shift html headings down, e.g. h1 becomes h2 (h6 stays h6), so that article headings nest under a chapter heading"""
+    return heading_tag_re.sub(lambda match: '<%sh%d' % (match.group(1), min(int(match.group(2)) + levels, 6)), content)
+
+
+def escape_html_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def get_chapter_html(chapter):
+    """Single html fragment for a bundle chapter, level 1 heading (chapter title) followed by the (demoted) article"""
+    byline = [escape_html_text(x) for x in (chapter.get('author'), chapter.get('date')) if x]
+    byline.append('<a href="%s">%s</a>' % (escape_html_text(chapter['url']).replace('"', '&quot;'), escape_html_text(chapter['url'])))
+    return '<h1>%s</h1>\n<p>%s</p>\n%s\n' % (escape_html_text(chapter['title']), ', '.join(byline), demote_headings(chapter['content']))
+
+
+def pandoc_epub_bundle_output_function(output_filename, chapters, title='Title Unknown', content_format=FORMAT_HTML):
+    """One epub with a chapter per entry in chapters and a table of contents, one pandoc conversion
+    chapters - list of dicts with keys; title, content, url, author (optional), date (optional)
+    """
+    if content_format != FORMAT_HTML:
+        raise NotImplementedError('content_format=%r' % content_format)
+    content = '\n'.join(get_chapter_html(chapter) for chapter in chapters)
+    pandoc_convert(content, 'html', 'epub', title=title, output_filename=output_filename, toc=True)  # pandoc splits chapters on level 1 headings
+
+
+def pypub_epub_bundle_output_function(output_filename, chapters, title='Title Unknown', content_format=FORMAT_HTML):
+    """See pandoc_epub_bundle_output_function(), pypub generates the table of contents from the chapters"""
+    assert content_format == FORMAT_HTML  # TODO replace with actual check and/or transformation code, i.e. convert markdown code to html
+    my_epub = pypub.Epub(title)
+    for chapter in chapters:
+        my_chapter = pypub.create_chapter_from_string(chapter['content'], url=chapter['url'], title=chapter['title'])
+        my_epub.add_chapter(my_chapter)
+    my_epub.create_epub('.', epub_name=output_filename[:-(len(FORMAT_EPUB)+1)])  # see pypub_epub_output_function()
+
+
 
 """https://github.com/HenryQW/mercury-parser-api
 
@@ -460,11 +1520,14 @@ same for the other server implementation
     docker exec -it mercury_postlight_parser /app/node_modules/.bin/postlight-parser
 """
 
-def gen_postlight_url(url, format=None, headers=None, postlight_server_url=MP_URL):
+def gen_postlight_url(url, format=None, headers=None, postlight_server_url=None):
     """format - valid values are 'html', 'markdown', and 'text'
     where markdown returns GitHub-flavored Markdown
     headers - a dict
+    postlight_server_url - defaults to MP_URL
     """
+    configure()
+    postlight_server_url = postlight_server_url or MP_URL
     # TODO clone and replace 'HTTP_USER_AGENT' with 'USER_AGENT' due to postlight behavior?
     # NOTE this still doesn't do anything useful with agent due to postlight behavior...
     if headers and 'USER-AGENT' not in headers and 'HTTP_USER_AGENT' in headers:
@@ -505,11 +1568,16 @@ def extractor_raw(url, page_content=None, format=FORMAT_HTML, title=None):
             page_content_bytes = f.read()
             f.close()
 
-        content = page_content_bytes.decode('utf-8')  # FIXME revisit this - cache encoding
+        page_content = page_content_bytes.decode('utf-8')  # FIXME revisit this - cache encoding
         content_format = FORMAT_HTML  # guess, this is probably a good guess?
+    content = get_page_text(page_content)
 
     if not doc_metadata['title']:
-        if bs4:  # FIXME end up parsing twice if bs4 is available
+        if lxml:
+            if not isinstance(page_content, ParsedDocument):
+                page_content = ParsedDocument(page_content)
+            doc_metadata['title'] = page_content.title()
+        elif bs4:  # FIXME end up parsing twice if bs4 is available
             soup = bs4.BeautifulSoup(content, "html.parser")  # TODO consider using SoupStrainer for performance?
             title_tag = soup.find_all('title')
             for i, link in enumerate(title_tag):
@@ -559,6 +1627,14 @@ def extractor_readability(url, page_content=None, format=FORMAT_HTML, title=None
 
         page_content = page_content_bytes.decode('utf-8')  # FIXME revisit this - cache encoding
 
+    if lxml and not isinstance(page_content, ParsedDocument):
+        page_content = ParsedDocument(page_content)
+    if isinstance(page_content, ParsedDocument):
+        # parse once, both trafilatura and readability modify the tree so each get their own copy
+        trafilatura_input = readability_input = page_content.clone
+    else:
+        trafilatura_input = readability_input = lambda: page_content
+
     doc_metadata = None
     # * python-readability does a great job at
     #   extracting main content as html
@@ -568,12 +1644,13 @@ def extractor_readability(url, page_content=None, format=FORMAT_HTML, title=None
     #
     # Use both for now
     if trafilatura:
-        doc_metadata = trafilatura.bare_extraction(page_content, include_links=True, include_formatting=True, include_images=True, include_tables=True, with_metadata=True, url=url)
+        with timed_stage('extract.trafilatura'):
+            doc_metadata = trafilatura.bare_extraction(trafilatura_input(), include_links=True, include_formatting=True, include_images=True, include_tables=True, with_metadata=True, url=url)
         # TODO cleanup and return null for unknown entries
 
-    doc = readability.Document(page_content)
-
-    content = doc.summary()  # Unicode string
+    with timed_stage('extract.readability'):
+        doc = readability.Document(readability_input())
+        content = doc.summary()  # Unicode string
     # NOTE at this point any head that was in original is now missing, including title information
     if not doc_metadata:
         """We have:
@@ -590,7 +1667,8 @@ def extractor_readability(url, page_content=None, format=FORMAT_HTML, title=None
         }
 
     if output_format == FORMAT_MARKDOWN:
-        content = markdownify.markdownify(content.encode('utf-8'))
+        with timed_stage('extract.convert'):
+            content = markdownify.markdownify(content.encode('utf-8'))
 
     postlight_metadata = {
         "title": doc_metadata['title'],
@@ -642,6 +1720,22 @@ def extractor_postlight_exe(url, page_content=None, format=FORMAT_HTML, title=No
     return postlight_metadata
 
 
+def extractor_postlight_worker(url, page_content=None, format=FORMAT_HTML, title=None):
+    """Same as extractor_postlight_exe() but using a pool of long running
+    postlight-parser processes (see w2d.postlight_worker), no per page Node.js startup.
+    content is ignored, postlight fetches url itself
+    """
+    from .postlight_worker import get_worker_pool
+
+    headers = MOZILLA_FIREFOX_HEADERS
+    if headers and 'USER-AGENT' not in headers and 'HTTP_USER_AGENT' in headers:
+        headers = headers.copy()
+        headers['USER-AGENT'] = headers['HTTP_USER_AGENT']  # see https://github.com/postlight/parser/issues/748
+    postlight_metadata = get_worker_pool().parse(url, format=get_postlight_format(format), headers=headers)
+    if postlight_metadata.get('error', False):
+        log.error('postlight worker failed %r', postlight_metadata)
+    return postlight_metadata
+
 
 def extractor_postlight(url, page_content=None, format=FORMAT_HTML, title=None, no_cache=False):
     """Extract main article/content from url/content using Postlight (nee Mecury) Parser
@@ -649,11 +1743,6 @@ def extractor_postlight(url, page_content=None, format=FORMAT_HTML, title=None,
     return postlight dict?
     """
     # TODO use title (is this a hint or an override, I think the later)
-    postlight_format = 'html'
-    if format == FORMAT_MARKDOWN:
-        # request was for markdown, rely on postlight to convert to markdown for us
-        postlight_format = 'markdown'  # test - this removes the need for other stuff...
-    tmp_url = gen_postlight_url(url, format=postlight_format, headers=MOZILLA_FIREFOX_HEADERS)
     """TODO / FIXME set headers param
     Test case = https://www.richardkmorgan.com/2023/07/gone-but-not-forgotten/
 
@@ -678,115 +1767,638 @@ def extractor_postlight(url, page_content=None, format=FORMAT_HTML, title=None,
             'HTTP_CACHE_CONTROL': 'no-cache'
         }
     """
-    if no_cache:
-        postlight_json = get_url(tmp_url, force=True, cache=False)
-    else:
-        postlight_json = get_url(tmp_url)
+    return postlight_parse(url, format=format, no_cache=no_cache)
 
-    postlight_metadata = json.loads(postlight_json)
-    if postlight_metadata.get('error', False):
+
+
+
+def get_postlight_format(format):
+    postlight_format = 'html'
+    if format == FORMAT_MARKDOWN:
+        # request was for markdown, rely on postlight to convert to markdown for us
+        postlight_format = 'markdown'  # test - this removes the need for other stuff...
+    return postlight_format
+
+
+def get_postlight_cache_key(url, postlight_format):
+    """Cache key for postlight results, target url and format only.
+    NOTE independent of postlight server and headers sent, changing those does not invalidate the cache
+    """
+    return 'postlight:%s:%s' % (postlight_format, canonical_url(url))
+
+
+def is_postlight_retryable(info):
+    """True for a postlight server failure worth retrying, 5xx responses and invalid (e.g. truncated) json"""
+    if isinstance(info, ValueError):
+        return True
+    status = getattr(info, 'code', None) or getattr(info, 'status', None)  # HTTPError or aiohttp.ClientResponseError
+    return isinstance(status, int) and status >= 500
+
+
+def read_postlight_cache_hit(filename, force=False):
+    """Returns cached postlight result (dict) for cache entry filename, or None if not cached.
+    Same rules as get_url(); expired entries (W2D_CACHE_MAX_AGE) are a miss, access recorded for least recently used eviction
+    """
+    if not is_cache_entry_fresh(filename, force=force):
+        return None
+    log.debug('getting cached postlight result %r', filename)
+    return json.loads(read_cache_hit(filename))
+
+
+def postlight_parse(url, format=FORMAT_HTML, postlight_server_url=None, no_cache=False, force=False, retries=None, backoff=None):
+    """Postlight server result (dict) for url, with caching (see get_postlight_cache_key()).
+    Retries, with exponential backoff, on {"error": true} responses and failures is_postlight_retryable() (5xx, invalid json).
+    Error results are not cached.
+    """
+    configure()
+    postlight_server_url = postlight_server_url or MP_URL
+    if retries is None:
+        retries = POSTLIGHT_RETRIES
+    if backoff is None:
+        backoff = POSTLIGHT_BACKOFF
+    postlight_format = get_postlight_format(format)
+    tmp_url = gen_postlight_url(url, format=postlight_format, headers=MOZILLA_FIREFOX_HEADERS, postlight_server_url=postlight_server_url)
+    cache_key = get_postlight_cache_key(url, postlight_format)
+    filename = get_cache_filename(cache_key)
+    if not no_cache:
+        legacy_filename = os.path.join(cache_dir, hash_url(tmp_url))  # cached by request url
+        for cached_filename in (filename, legacy_filename):
+            postlight_metadata = read_postlight_cache_hit(cached_filename, force=force)
+            if postlight_metadata is not None:
+                return postlight_metadata
+
+    for attempt in range(retries + 1):
+        try:
+            response_url, code, response_headers, postlight_json = easy_get_url_response(tmp_url, headers=MOZILLA_FIREFOX_HEADERS)
+            postlight_metadata = json.loads(postlight_json)
+        except Exception as info:
+            if not is_postlight_retryable(info):
+                raise
+            postlight_metadata = {'error': True, 'message': 'postlight server failed %r' % (info,)}
+        if not postlight_metadata.get('error', False):
+            break
+        if attempt < retries:
+            delay = backoff * (2 ** attempt)
+            log.warning('postlight failed %r, retrying in %r seconds', postlight_metadata, delay)
+            time.sleep(delay)
+    else:
         log.error('postlight failed %r', postlight_metadata)
+        return postlight_metadata
+
+    if not no_cache:
+        cache_page(cache_key, postlight_json, filename=filename, code=code, response_headers=response_headers)
     return postlight_metadata
-    #print(json.dumps(postlight_metadata, indent=4))
 
 
-if pypub:
-    default_epub_output_function = pypub_epub_output_function
-else:
-    log.info('pypub (epub) not installed, defaulting to pandoc, check pandoc is in the path')
-    default_epub_output_function = pandoc_epub_output_function
+def postlight_batch(urls, format=FORMAT_HTML, max_in_flight=None, postlight_server_url=None, no_cache=False, force=False, ignore_errors=False):
+    """postlight_parse() many urls, with up to max_in_flight (default W2D_POSTLIGHT_CONCURRENCY)
+    concurrent requests to the postlight server. Connections are re-used (keep-alive).
+    If ignore_errors, a url that raises is returned as the exception instance rather than raised.
+    Returns list of postlight dicts, in the same order as urls
+    """
+    configure()
+    max_in_flight = max_in_flight or POSTLIGHT_CONCURRENCY
+    def parse(url):
+        try:
+            return postlight_parse(url, format=format, postlight_server_url=postlight_server_url, no_cache=no_cache, force=force)
+        except Exception as info:
+            if not ignore_errors:
+                raise
+            log.error('postlight failed for %r %r', url, info)
+            return info
+    if concurrent is None or max_in_flight <= 1:
+        return [parse(url) for url in urls]
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        return list(pool.map(parse, urls))
+    finally:
+        pool.shutdown()
 
-# FIXME / TODO need an output directory option, W2D_ARCHIVE_DIR and / or command line option? Alternative is caller chdir
-def process_page(url, content=None, output_format=FORMAT_MARKDOWN, extractor_function=extractor_readability, output_filename=None, title=None, filename_prefix=None, epub_output_function=default_epub_output_function):
-    """Process html content, writes to disk
-    TODO add option to pass in file, rather than filename
-    extractor - function to extract useful info from content
-    NOTE content **maybe** used, it may be ignored depending on the extractor used (i.e. may scrape URL even if content provided).
+
+def html_to_markdown(content, title='Title Unknown', content_format=FORMAT_HTML):
+    """Convert html content to markdown, using markdownify if available
+    otherwise fall back to pandoc
     """
+    if markdownify:
+        log.debug('converting to markdown (markdownify.markdownify)')
+        # assume html - TODO add check?
+        return markdownify.markdownify(content.encode('utf-8'))
+    else:
+        # fall back to pandoc
+        log.debug('converting to markdown (pandoc)')
+        return pandoc_markdown_output_filter_function(content=content, title=title, content_format=content_format)
 
-    if output_format not in SUPPORTED_FORMATS:
-        raise NotImplementedError('output_format %r not supported (or missing dependency)' % output_format)
+
+def get_content_format(output_format, extractor_function=None):
+    """Return the format the extractor should be asked for, in order to produce output_format
+    """
     if output_format == FORMAT_EPUB:
         content_format = os.environ.get('W2D_INTERMEDIATE_FORMAT', FORMAT_HTML)
     elif extractor_function == extractor_raw:
         content_format = FORMAT_HTML  # Assume html, high chance of probability
     else:
         content_format = output_format
+    return content_format
+
+
+# extractors that work from the page content (rather than fetching the url themselves)
+EXTRACTORS_USING_CONTENT = (extractor_raw, extractor_readability)
+
+EXTRACT_CACHE_DIRNAME = 'extract'
+
+library_versions = None
+
+def get_library_versions():
+    """Returns dict of versions of w2d and the (optional) libraries that impact extraction results"""
+    global library_versions
+    if library_versions is None:
+        versions = {'w2d': __version__}
+        for name, module in (('readability-lxml', readability), ('trafilatura', trafilatura), ('lxml', lxml), ('beautifulsoup4', bs4), ('markdownify', markdownify)):
+            version = None
+            try:
+                from importlib import metadata as importlib_metadata  # Py3.8+
+                version = importlib_metadata.version(name)
+            except Exception:
+                # Py2, older Py3, or not installed
+                if module:
+                    version = getattr(module, '__version__', 'unknown')
+            versions[name] = version
+        library_versions = versions
+    return library_versions
+
+
+def get_extract_cache_filename(extractor_function, content, format, title=None, url=None):
+    """Extraction result cache filename, key is the page content hash, extractor name, requested format, title, and library versions.
+    For extractors that fetch the url themselves (postlight, content is None) the key is the canonical url instead of the content,
+    such entries are as fresh as the cache limits (W2D_CACHE_MAX_AGE) allow
+    """
+    if content is None:
+        source = 'url:' + canonical_url(url)
+    else:
+        source = 'sha256:' + hashlib.sha256(to_byte(get_page_text(content))).hexdigest()
+    key_info = {
+        'source': source,
+        'extractor': getattr(extractor_function, '__name__', repr(extractor_function)),
+        'format': format,
+        'title': title,
+        'versions': get_library_versions(),
+    }
+    key = hashlib.sha256(json.dumps(key_info, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, EXTRACT_CACHE_DIRNAME, key[:2], key + '.json')
 
-    assert url.startswith('http')  # FIXME DEBUG
 
-    doc_metadata = None  # should be empty dict? None causes immediate failure which is handy for debugging
+def get_extract_cache_entry_name(filename):
+    """Name of extraction cache file in the cache index, path relative to cache_dir (e.g. extract/ab/ab12...json)"""
+    return os.path.relpath(filename, cache_dir).replace(os.sep, '/')
 
-    log.debug('calling extractor function %r with content_format=%r', extractor_function, content_format)
-    postlight_metadata = extractor_function(url, page_content=content, format=content_format, title=title)
-    #print(json.dumps(postlight_metadata, indent=4))
 
-    # TODO old dict format, replace
-    content = postlight_metadata['content']  # TODO or content? FIXME handle case where postlight fails to get data
-    doc_metadata = {
-        'author': postlight_metadata['author'],
-        'date': postlight_metadata['date_published'],  # maybe None/Null -- 'UnknownDate',  # TODO use now? Ideally if had http headers could use last-updated
-        'description': postlight_metadata['excerpt'],  # maybe None/Null
-        'title': postlight_metadata['title'],
-        'word_count': postlight_metadata['word_count'],
-        'image': None, ## FIXME!!!
+def read_extract_cache(filename):
+    """Returns cached extractor result (postlight style dict) or None, expired entries (see W2D_CACHE_MAX_AGE) are a miss"""
+    if not is_cache_entry_fresh(filename):
+        return None
+    log.debug('getting cached extraction %r', filename)
+    postlight_metadata = json.loads(read_cache_file(filename).decode('utf-8'))
+    get_cache_index().touch(get_extract_cache_entry_name(filename))
+    return postlight_metadata
+
+
+def write_extract_cache(filename, postlight_metadata, url):
+    """Write extractor result, indexed (see w2d.cache) so it is subject to the same limits, and compact, as the scrape cache"""
+    safe_mkdir(os.path.dirname(filename))
+    codec = get_cache_codec()
+    size = write_cache_file(filename, json.dumps(postlight_metadata).encode('utf-8'), codec)
+    get_cache_index().record(get_extract_cache_entry_name(filename), url, size, content_type='application/json', codec=codec)
+    enforce_cache_limits()
+
+
+# attributes holding urls, that are re-written to absolute urls
+LINK_ATTRIBUTES = {
+    'a': ('href',),
+    'area': ('href',),
+    'audio': ('src',),
+    'embed': ('src',),
+    'iframe': ('src',),
+    'img': ('src', 'srcset'),
+    'link': ('href',),
+    'source': ('src', 'srcset'),
+    'track': ('src',),
+    'video': ('src', 'poster'),
+}
+UNRESOLVED_LINK_PREFIXES = ('#', 'data:', 'mailto:', 'javascript:', 'tel:')
+urljoin_needed_re = re.compile(r'/\.|[\t\r\n\\]')  # dot segments, characters urljoin() removes or changes
+base_href_re = re.compile(r'''<base\s[^>]*?href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+
+
+def resolve_url(base_url, link):
+    """Absolute url for link (relative to base_url), urljoin() semantics, e.g. ../a, //host/a, /a
+    In page anchors (#name), data:, mailto:, javascript:, tel: links are returned unchanged.
+    """
+    link = link.strip()
+    if not link or link.lower().startswith(UNRESOLVED_LINK_PREFIXES):
+        return link
+    if not urljoin_needed_re.search(link):
+        # fast paths, same result as urljoin() (which is slow enough to matter for pages with thousands of links)
+        if link.startswith(('http://', 'https://')):
+            return link
+        if link.startswith('//'):
+            if link[2:3] not in ('', '/'):
+                scheme, origin = get_url_origin(base_url)
+                return scheme + ':' + link if scheme else link
+        elif link.startswith('/'):
+            scheme, origin = get_url_origin(base_url)
+            return origin + link
+    return urljoin(base_url, link)
+
+
+url_origins = {}  # base url -> (scheme, scheme://host:port), see resolve_url()
+
+
+def get_url_origin(url):
+    result = url_origins.get(url)
+    if result is None:
+        if len(url_origins) > 1000:
+            url_origins.clear()
+        url_components = urlparse(url)
+        result = url_origins[url] = (url_components.scheme, '%s://%s' % (url_components.scheme, url_components.netloc) if url_components.scheme else url_components.netloc)
+    return result
+
+
+def rewrite_srcset(base_url, srcset):
+    """Resolve each url in a srcset attribute value, e.g. "a.png 1x, b.png 2x", descriptors are kept"""
+    candidates = []
+    for candidate in srcset.split(','):
+        candidate = candidate.strip()
+        if not candidate:
+            continue
+        parts = candidate.split(None, 1)
+        parts[0] = resolve_url(base_url, parts[0])
+        candidates.append(' '.join(parts))
+    return ', '.join(candidates)
+
+
+def get_base_url(url, content):
+    """Url that relative links in content (html string or ParsedDocument) are relative to, i.e. <base href> (if present) resolved against url"""
+    content = get_page_text(content)
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', 'replace')
+    match = base_href_re.search(content)
+    if match:
+        href = match.group(1) or match.group(2) or match.group(3) or ''
+        if href.strip():
+            return resolve_url(url, href.replace('&amp;', '&'))
+    return url
+
+
+def rewrite_link_attribute(base_url, tag, attribute_name, value):
+    """Returns new attribute value, or None if unchanged"""
+    if not value or attribute_name not in LINK_ATTRIBUTES.get(tag, ()):
+        return None
+    if attribute_name == 'srcset':
+        new_value = rewrite_srcset(base_url, value)
+    else:
+        new_value = resolve_url(base_url, value)
+    if new_value == value:
+        return None
+    return new_value
+
+
+def escape_html_attribute(value):
+    return value.replace('&', '&amp;').replace('"', '&quot;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+class LinkRewriter(html_parser.HTMLParser):
+    """Streaming (no tree) html link re-writer, used when lxml is not available.
+    Markup is copied through unchanged apart from start tags with re-written url attributes.
+    """
+    def __init__(self, base_url):
+        if str is bytes:
+            html_parser.HTMLParser.__init__(self)  # Py2, no convert_charrefs
+        else:
+            html_parser.HTMLParser.__init__(self, convert_charrefs=False)
+        self.base_url = base_url
+        self.base_seen = False
+        self.output = []
+        self.link_count = 0
+
+    def rewrite_starttag(self, tag, attrs, end):
+        if tag == 'base' and not self.base_seen:
+            # only the first <base> counts
+            self.base_seen = True
+            href = dict(attrs).get('href')
+            if href and href.strip():
+                self.base_url = resolve_url(self.base_url, href)
+        if tag in LINK_ATTRIBUTES:
+            new_attrs = []
+            changed = False
+            for attribute_name, value in attrs:
+                new_value = rewrite_link_attribute(self.base_url, tag, attribute_name, value)
+                if new_value is not None:
+                    value = new_value
+                    changed = True
+                    self.link_count += 1
+                new_attrs.append((attribute_name, value))
+            if changed:
+                attributes = ''.join(
+                    ' %s' % attribute_name if value is None else ' %s="%s"' % (attribute_name, escape_html_attribute(value))
+                    for attribute_name, value in new_attrs
+                )
+                self.output.append('<%s%s%s>' % (tag, attributes, end))
+                return
+        self.output.append(self.get_starttag_text())
+
+    def handle_starttag(self, tag, attrs):
+        self.rewrite_starttag(tag, attrs, '')
+
+    def handle_startendtag(self, tag, attrs):
+        self.rewrite_starttag(tag, attrs, ' /')
+
+    def handle_endtag(self, tag):
+        self.output.append('</%s>' % tag)
+
+    def handle_data(self, data):
+        self.output.append(data)
+
+    def handle_entityref(self, name):
+        self.output.append('&%s;' % name)
+
+    def handle_charref(self, name):
+        self.output.append('&#%s;' % name)
+
+    def handle_comment(self, data):
+        self.output.append('<!--%s-->' % data)
+
+    def handle_decl(self, decl):
+        self.output.append('<!%s>' % decl)
+
+    def handle_pi(self, data):
+        self.output.append('<?%s>' % data)
+
+    def unknown_decl(self, data):
+        self.output.append('<![%s]>' % data)
+
+    def rewrite(self, content):
+        self.feed(content)
+        self.close()
+        return ''.join(self.output)
+
+
+def rewrite_links(content, url, base_url=None):
+    """Re-write relative links (<a href>, <img src> and srcset, etc. see LINK_ATTRIBUTES) in html content to absolute urls.
+    base_url - url links are relative to, defaults to <base href> in content (if any) resolved against url
+    content maybe a string or a ParsedDocument (modified in place)
+    Returns html string
+    """
+    if lxml:
+        if not isinstance(content, ParsedDocument):
+            content = ParsedDocument(content)
+        tree = content.tree
+        if base_url is None:
+            base_url = url
+            base_element = tree.find('.//base[@href]')
+            if base_element is not None and base_element.get('href').strip():
+                base_url = resolve_url(url, base_element.get('href'))
+        link_count = 0
+        for element in tree.iter(*LINK_ATTRIBUTES):  # single pass
+            tag = element.tag
+            for attribute_name in LINK_ATTRIBUTES[tag]:
+                new_value = rewrite_link_attribute(base_url, tag, attribute_name, element.get(attribute_name))
+                if new_value is not None:
+                    element.set(attribute_name, new_value)
+                    link_count += 1
+        log.debug('url re-writting with lxml, %d links re-written, base %r', link_count, base_url)
+        return content.tostring()
+
+    rewriter = LinkRewriter(base_url or url)
+    content = rewriter.rewrite(get_page_text(content))
+    log.debug('url re-writting with HTMLParser, %d links re-written, base %r', rewriter.link_count, rewriter.base_url)
+    return content
+
+
+def localize_images(content, asset_store=None):
+    """Download the (absolute, see rewrite_links()) <img src> images in html content into asset_store (defaults to
+    w2d.assets.get_asset_store(), W2D_ASSET_DIR) concurrently and re-write src to the local copies, srcset is removed.
+    Image paths are relative to the current directory, see relocate_assets(). Images that fail to download keep their remote url.
+    content maybe a string or a ParsedDocument (modified in place)
+    Returns (html string, list of local image paths)
+    """
+    from .assets import get_asset_store
+    asset_store = asset_store or get_asset_store()
+
+    def get_path(filename):
+        return '%s/%s' % (asset_store.directory.replace(os.sep, '/').rstrip('/'), filename)
+
+    def is_remote(src):
+        return src and (src.startswith('http://') or src.startswith('https://'))
+
+    if lxml:
+        if not isinstance(content, ParsedDocument):
+            content = ParsedDocument(content)
+        images = [element for element in content.tree.iter('img') if is_remote(element.get('src'))]
+        filenames = asset_store.get_many([element.get('src') for element in images])
+        for element in images:
+            filename = filenames.get(element.get('src'))
+            if filename:
+                element.set('src', get_path(filename))
+                element.attrib.pop('srcset', None)
+        return content.tostring(), sorted(get_path(filename) for filename in set(filenames.values()))
+
+    content = get_page_text(content)
+    if bs4:
+        soup = bs4.BeautifulSoup(content, "html.parser")
+        images = [tag for tag in soup.find_all('img') if is_remote(tag.get('src'))]
+        filenames = asset_store.get_many([tag.get('src') for tag in images])
+        for tag in images:
+            filename = filenames.get(tag.get('src'))
+            if filename:
+                tag['src'] = get_path(filename)
+                if tag.get('srcset') is not None:
+                    del tag['srcset']
+        return str(soup), sorted(get_path(filename) for filename in set(filenames.values()))
+    log.debug('MISSING lxml and BeautifulSoup - no image localization support')
+    return content, []
+
+
+def relocate_assets(content, asset_paths, output_filename):
+    """Re-write local image paths (from localize_images(), relative to the current directory) to be relative to output_filename's directory"""
+    output_dir = os.path.dirname(output_filename)
+    if not output_dir or not asset_paths:
+        return content
+    for asset_path in asset_paths:
+        relative_path = os.path.relpath(asset_path, output_dir).replace(os.sep, '/')
+        content = content.replace(asset_path, relative_path)  # paths are content hashes, no false matches
+    return content
+
+
+def extract_page(url, content=None, content_format=FORMAT_HTML, extractor_function=extractor_readability, title=None, extract_cache=None):
+    """Extract and re-write links for url/content, no output is written
+    extract_cache - use (and fill) the extraction cache, defaults to env W2D_EXTRACT_CACHE (true)
+    Returns a page_info dict suitable for render_page(), the same page_info can be rendered into multiple output formats
+    page_info['timings'] is a PageTimings of the fetch/extract/link_rewrite stages.
+    NOTE content **maybe** used, it may be ignored depending on the extractor used (i.e. may scrape URL even if content provided).
+    """
+    assert url.startswith('http')  # FIXME DEBUG
+    configure()
+
+    if extract_cache is None:
+        extract_cache = EXTRACT_CACHE
+
+    timings = PageTimings()
+    asset_paths = []
+    start = timer()
+    with active_page_timings(timings):
+        uses_content = extractor_function in EXTRACTORS_USING_CONTENT
+        if content is None and uses_content:
+            # fetch here rather than in the extractor, content is needed for the extraction cache key.
+            # Extractors that fetch the url themselves (postlight) are not given content, their cache key is the url
+            with timed_stage('fetch'):
+                content = get_url(url).decode('utf-8')  # FIXME revisit this - cache encoding
+
+        # extracted content no longer has the page <head>, so find <base href> in the original
+        base_url = get_base_url(url, content) if content is not None else url
+
+        extract_cache_filename = None
+        postlight_metadata = None
+        with timed_stage('extract'):
+            if extract_cache:
+                extract_cache_filename = get_extract_cache_filename(extractor_function, content, content_format, title, url=url)
+                postlight_metadata = read_extract_cache(extract_cache_filename)
+                record_cache_result('extract', 'miss' if postlight_metadata is None else 'hit')
+
+            parsed_document = None
+            if postlight_metadata is None:
+                if content is not None and lxml and uses_content:
+                    # parse once, shared between the extractor and (for raw) link re-writing
+                    content = parsed_document = ParsedDocument(content)
+
+                log.debug('calling extractor function %r with content_format=%r', extractor_function, content_format)
+                postlight_metadata = extractor_function(url, page_content=content, format=content_format, title=title)
+                #print(json.dumps(postlight_metadata, indent=4))
+                if extract_cache_filename and not postlight_metadata.get('error', False):
+                    try:
+                        write_extract_cache(extract_cache_filename, postlight_metadata, url=url)
+                    except TypeError as info:
+                        log.warning('extraction result not cached, not json serializable %r', info)
+
+        # TODO old dict format, replace
+        content = postlight_metadata['content']  # TODO or content? FIXME handle case where postlight fails to get data
+        doc_metadata = {
+            'author': postlight_metadata['author'],
+            'date': postlight_metadata['date_published'],  # maybe None/Null -- 'UnknownDate',  # TODO use now? Ideally if had http headers could use last-updated
+            'description': postlight_metadata['excerpt'],  # maybe None/Null
+            'title': postlight_metadata['title'],
+            'word_count': postlight_metadata['word_count'],
+            'image': None, ## FIXME!!!
+        }
+
+        # if html re-write/fix images/href
+        if content_format == FORMAT_HTML:
+            if parsed_document is not None and extractor_function == extractor_raw:
+                content = parsed_document  # raw content is the original page, re-use the parsed tree
+            with timed_stage('link_rewrite'):
+                content = rewrite_links(content, url, base_url=base_url)
+            if LOCALIZE_IMAGES:
+                with timed_stage('images'):
+                    content, asset_paths = localize_images(content)
+    timings.add('extract_page', timer() - start)
+
+    page_info = {
+        'url': url,
+        'content': content,
+        'content_format': content_format,
+        'doc_metadata': doc_metadata,
+        'title': title or doc_metadata['title'],
+        'timings': timings,
+        'assets': asset_paths,  # local image paths, see localize_images()
     }
+    return page_info
+
+
+output_sink = None  # see get_output_sink()
+output_sink_lock = threading.Lock()
+
+
+def get_output_sink():
+    """Shared default output sink, env W2D_OUTPUT_SINK is a directory (default current directory) or archive filename
+    (.zip, .tar, .tar.gz, etc.), see w2d/sinks.py. Archive sinks are closed (and the manifest written) on exit or by close_output_sink()
+    """
+    global output_sink
+    with output_sink_lock:
+        if output_sink is None:
+            from . import sinks
+            output_sink = sinks.open_output_sink(os.environ.get('W2D_OUTPUT_SINK') or '.')
+            if not isinstance(output_sink, sinks.DirectorySink):
+                import atexit
+                atexit.register(close_output_sink)
+        return output_sink
+
+
+def close_output_sink():
+    global output_sink
+    with output_sink_lock:
+        if output_sink is not None:
+            output_sink.close()
+            output_sink = None
+
+
+def write_epub_file(output_sink, output_filename, epub_function, metadata=None):
+    """Call epub_function(epub_filename), epub tools write a file, and record (directory sink) or copy (archive sinks) it into output_sink"""
+    epub_filename = output_sink.local_path(output_filename)
+    temp_dir = None
+    if epub_filename is None:
+        temp_dir = tempfile.mkdtemp(prefix='w2d_epub_')
+        epub_filename = os.path.join(temp_dir, 'document.epub')
+    try:
+        epub_function(epub_filename)
+        output_sink.write_file(output_filename, epub_filename, metadata=metadata)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
 
-    title = title or doc_metadata['title']
 
-    print(output_format)  # TODO logging
+def render_page(page_info, output_format=FORMAT_MARKDOWN, output_filename=None, filename_prefix=None, epub_output_function=None, output_sink=None):
+    """Render (previously extracted) page_info from extract_page() to disk in output_format
+    output_sink - where the document is written, defaults to get_output_sink() (current directory)
+    Returns result_metadata, result_metadata['timings'] is a dict of stage name to seconds (extraction
+    stages from page_info plus convert/epub/write), result_metadata['cache'] is fetch/extract cache hit or miss
+    result_metadata['filename'] is the document name in output_sink (unique, see sinks.OutputSink.reserve())
+    """
+    if output_format not in SUPPORTED_FORMATS:
+        raise NotImplementedError('output_format %r not supported (or missing dependency)' % output_format)
+
+    start = timer()
+    timings = page_info.get('timings')
+    timings = timings.copy() if timings else PageTimings()  # each format gets its own render timings
+    url = page_info['url']
+    content = page_info['content']
+    content_format = page_info['content_format']
+    doc_metadata = page_info['doc_metadata']
+    title = page_info['title']
+
+    log.debug('rendering %r as %r', url, output_format)
+    output_sink = output_sink or get_output_sink()
     if not output_filename:
         filename_prefix = filename_prefix or ''
         output_filename = '%s%s.%s' % (filename_prefix, safe_filename(title), output_format)
-    print(output_filename)  # TODO logging
-
-    # if html re-write/fix images/href
-    if bs4:
-        log.debug('url re-writting with BeautifulSoup')
-        log.debug('url %r', url)
-        def dumb_url_strip(in_url):
-            result = in_url[:in_url.rfind('/')]
-            if not result.endswith('/'):
-                result = result + '/'
-            return result
-        url_prefix = dumb_url_strip(url)
-        log.debug('strip url %r', url_prefix)
-        soup = bs4.BeautifulSoup(content, "html.parser")  # TODO consider using SoupStrainer for performance?
-        tags = soup.find_all('a')
-        for i, link in enumerate(tags):
-            link_address = link.get("href")
-            if not link_address:
-                continue
-            log.debug('link_address %r', link_address)
-            if not link_address.startswith('http://') and not link_address.startswith('https://'):
-                log.debug('new link_address %r', url_prefix + link_address)
-                link['href'] = url_prefix + link_address
-        tags = soup.find_all('img')
-        for i, link in enumerate(tags):
-            link_address = link.get("src")
-            log.debug('link_address %r', link_address)
-            if not link_address.startswith('http://') and not link_address.startswith('https://'):
-                log.debug('new link_address %r', url_prefix + link_address)
-                link['src'] = url_prefix + link_address
-        content = str(soup)
-    else:
-        log.debug('MISSING BeautifulSoup - no url re-writting support')
+    output_filename = output_sink.reserve(output_filename, url)
+    log.debug('output filename %r', output_filename)
+    sink_metadata = {'url': url, 'title': title, 'format': output_format}
 
     if output_format == FORMAT_EPUB:
         log.debug('converting to epub')
-        epub_output_function(output_filename, url=url, content=content, title=title, content_format=content_format)
+        epub_content_format = get_content_format(output_format)
+        if content_format == FORMAT_HTML and epub_content_format == FORMAT_MARKDOWN:
+            # extracted once as html (e.g. FORMAT_ALL), intermediate format requested is markdown
+            with timed_stage('convert', timings):
+                content = html_to_markdown(content, title=title, content_format=content_format)
+            content_format = epub_content_format
+        epub_output_function = epub_output_function or get_epub_output_function()
+        with timed_stage('epub', timings):  # conversion and write
+            write_epub_file(output_sink, output_filename, lambda epub_filename: epub_output_function(epub_filename, url=url, content=content, title=title, content_format=content_format), sink_metadata)
     else:
         if content_format != output_format and output_format == FORMAT_MARKDOWN:
             log.debug('converting to markdown assuming html')
-            if markdownify:
-                log.debug('converting to markdown (markdownify.markdownify)')
-                # assume html - TODO add check?
-                content = markdownify.markdownify(content.encode('utf-8'))
-            else:
-                # fall back to pandoc
-                log.debug('converting to markdown (pandoc)')
-                #import pdb ; pdb.set_trace()
-                content = pandoc_markdown_output_filter_function(content=content, title=title, content_format=content_format)
+            with timed_stage('convert', timings):
+                content = html_to_markdown(content, title=title, content_format=content_format)
 
         if output_format == FORMAT_MARKDOWN:
             # TODO TOC?
@@ -798,13 +2410,19 @@ def process_page(url, content=None, output_format=FORMAT_MARKDOWN, extractor_fun
                 # ensure there is a newline at the end, this allows concatinating files (e.g. with cat, pandoc, etc.) and avoids headers getting combined with last paragraph
                 content += '\n'  # consider multiple?
 
+        local_path = output_sink.local_path(output_filename)
+        if local_path is None and page_info.get('assets'):
+            # archive sink, images are added to the archive
+            from . import sinks
+            content = sinks.write_assets(output_sink, content, page_info['assets'], output_filename)
+        else:
+            content = relocate_assets(content, page_info.get('assets'), local_path or output_filename)
         out_bytes = to_byte(content)
         #print(type(out_bytes))
 
         log.debug('about to write to %r', output_filename)
-        f = open(output_filename, 'wb')
-        f.write(out_bytes)
-        f.close()
+        with timed_stage('write', timings):
+            output_sink.write(output_filename, out_bytes, metadata=sink_metadata)
 
     #import pdb; pdb.set_trace()  # DEBUG
 
@@ -815,6 +2433,7 @@ def process_page(url, content=None, output_format=FORMAT_MARKDOWN, extractor_fun
         'author': doc_metadata['author'],
         'date': doc_metadata['date'],
         'filename': output_filename,
+        'format': output_format,
     }
 
     # FIXME this is from old approch before refactor to extractor functions
@@ -825,15 +2444,109 @@ def process_page(url, content=None, output_format=FORMAT_MARKDOWN, extractor_fun
         f.write(doc_metadata.get('text').encode('utf-8'))
         f.close()
 
+    timings.add('render_page', timer() - start)
+    timings.add('total', timings.stages.get('extract_page', 0.0) + timings.stages['render_page'])
+    result_metadata['timings'] = timings.stages
+    result_metadata['cache'] = timings.cache
     return result_metadata
 
-def get_extractor_function():  # TODO pass in optional parameter
-    extractor_function_name = os.environ.get('W2D_EXTRACTOR', 'readability')
+
+# FIXME / TODO need an output directory option, W2D_ARCHIVE_DIR and / or command line option? Alternative is caller chdir
+def process_page(url, content=None, output_format=FORMAT_MARKDOWN, extractor_function=extractor_readability, output_filename=None, title=None, filename_prefix=None, epub_output_function=None, output_sink=None, extract_cache=None):
+    """Process html content, writes to disk
+    TODO add option to pass in file, rather than filename
+    extractor - function to extract useful info from content
+    NOTE content **maybe** used, it may be ignored depending on the extractor used (i.e. may scrape URL even if content provided).
+    Returns result_metadata, with per stage timings (see render_page()), also sent to metrics_callback/W2D_TRACE_FILE,
+    and result_metadata['profile'] if W2D_PROFILE is set (see PageProfiler)
+    """
+
+    if output_format not in SUPPORTED_FORMATS:
+        raise NotImplementedError('output_format %r not supported (or missing dependency)' % output_format)
+    configure()
+    content_format = get_content_format(output_format, extractor_function)
+    if LOCALIZE_IMAGES:
+        content_format = FORMAT_HTML  # images are localized in html, markdown is rendered from that
+
+    with PageProfiler(url) as profiler:
+        page_info = extract_page(url, content=content, content_format=content_format, extractor_function=extractor_function, title=title, extract_cache=extract_cache)
+        result_metadata = render_page(page_info, output_format=output_format, output_filename=output_filename, filename_prefix=filename_prefix, epub_output_function=epub_output_function, output_sink=output_sink)
+    if profiler.result:
+        result_metadata['profile'] = profiler.result
+    report_page_metrics(url, [result_metadata])
+    return result_metadata
+
+
+def get_page_content_format(output_formats, extractor_function=extractor_readability):
+    """Format to extract a page as, in order to render it into each of output_formats (see process_page_formats())"""
+    configure()
+    if len(output_formats) == 1 and not LOCALIZE_IMAGES:
+        return get_content_format(output_formats[0], extractor_function)
+    return FORMAT_HTML  # markdown (and epub intermediate) can be generated from html, not the other way around. Images are localized in html
+
+
+def get_render_pandoc_jobs(page_info, output_formats, epub_output_function=None):
+    """pandoc conversions (see pandoc_convert_batch()) render_page() of page_info into each of output_formats performs,
+    for pandoc_batch(). Chained conversions (html to markdown to epub) are not included, they are converted as rendered
+    """
+    content = page_info['content']
+    content_format = page_info['content_format']
+    title = page_info['title']
+    jobs = []
+    if FORMAT_MARKDOWN in output_formats and content_format == FORMAT_HTML and not markdownify:
+        jobs.append({'content': content, 'from': FORMAT_HTML, 'to': 'markdown', 'title': title})  # see html_to_markdown()
+    if FORMAT_EPUB in output_formats and (epub_output_function or get_epub_output_function()) == pandoc_epub_output_function:
+        if content_format != FORMAT_HTML:
+            jobs.append({'content': content, 'from': 'gfm', 'to': 'epub', 'title': title})
+        elif get_content_format(FORMAT_EPUB) == FORMAT_HTML:
+            jobs.append({'content': content, 'from': FORMAT_HTML, 'to': 'epub', 'title': title})
+    return jobs
+
+
+def process_page_formats(url, content=None, output_formats=None, extractor_function=extractor_readability, title=None, filename_prefix=None, epub_output_function=None, extracted_callback=None, output_sink=None, extract_cache=None, page_info=None):
+    """Process html content once, writes to disk in each of output_formats (defaults to SUPPORTED_FORMATS)
+    Extraction and link re-writing is only performed once (as html) and the result is rendered into each format.
+    pandoc conversions for the formats are made in one batch, see pandoc_batch().
+    extracted_callback - optional function, called with page_info after extraction (before rendering), e.g. progress tracking
+    extract_cache - see extract_page()
+    page_info - already extracted (as get_page_content_format()) page, only rendered
+    Returns list of result_metadata, one per output format (in the same order as output_formats)
+    """
+    output_formats = output_formats or SUPPORTED_FORMATS
+    for output_format in output_formats:
+        if output_format not in SUPPORTED_FORMATS:
+            raise NotImplementedError('output_format %r not supported (or missing dependency)' % output_format)
+    content_format = get_page_content_format(output_formats, extractor_function)
+
+    with PageProfiler(url) as profiler:
+        if page_info is None:
+            page_info = extract_page(url, content=content, content_format=content_format, extractor_function=extractor_function, title=title, extract_cache=extract_cache)
+        if extracted_callback:
+            extracted_callback(page_info)
+        result_metadata_list = []
+        with pandoc_batch(get_render_pandoc_jobs(page_info, output_formats, epub_output_function)):
+            for output_format in output_formats:
+                result_metadata = render_page(page_info, output_format=output_format, filename_prefix=filename_prefix, epub_output_function=epub_output_function, output_sink=output_sink)
+                result_metadata_list.append(result_metadata)
+    if profiler.result:
+        for result_metadata in result_metadata_list:
+            result_metadata['profile'] = profiler.result
+    report_page_metrics(url, result_metadata_list)
+    return result_metadata_list
+
+EXTRACTOR_NAMES = ('readability', 'postlight', 'postlight_exe', 'postlight_worker', 'raw')
+
+
+def get_extractor_function(extractor_function_name=None):
+    """extractor_function_name - one of EXTRACTOR_NAMES, defaults to env W2D_EXTRACTOR (readability)"""
+    extractor_function_name = extractor_function_name or os.environ.get('W2D_EXTRACTOR', 'readability')
     # TODO use introspection api rather than this hard coded one
     if extractor_function_name == 'postlight':
         extractor_function = extractor_postlight
     elif extractor_function_name == 'postlight_exe':
         extractor_function = extractor_postlight_exe
+    elif extractor_function_name == 'postlight_worker':
+        extractor_function = extractor_postlight_worker
     elif extractor_function_name == 'raw':
         extractor_function = extractor_raw
     else:
@@ -844,16 +2557,15 @@ def get_extractor_function():  # TODO pass in optional parameter
             extractor_function = extractor_postlight
     return extractor_function
 
-def dump_url(url, output_format=FORMAT_MARKDOWN, filename_prefix=None):
-    print(url)  # FIXME logging
-
+def get_output_format_list(output_format):
     if output_format == FORMAT_ALL:
         output_format_list = SUPPORTED_FORMATS
     else:
         output_format_list = [output_format]
+    return output_format_list
 
-    extractor_function = get_extractor_function()
 
+def get_epub_output_function():
     epub_output_function_name = os.environ.get('W2D_EPUB_TOOL')
     if epub_output_function_name == 'pypub':
         epub_output_function = pypub_epub_output_function
@@ -865,29 +2577,355 @@ def dump_url(url, output_format=FORMAT_MARKDOWN, filename_prefix=None):
         else:
             log.info('pypub (epub) not installed, defaulting to pandoc, check pandoc is in the path')
             epub_output_function = pandoc_epub_output_function
+    return epub_output_function
+
+
+def dump_url(url, output_format=FORMAT_MARKDOWN, filename_prefix=None, output_sink=None):
+    """Returns result_metadata, the last one for output_format == FORMAT_ALL, see dump_url_formats() for all of them"""
+    return dump_url_formats(url, output_format=output_format, filename_prefix=filename_prefix, output_sink=output_sink)[-1]
+
+
+def dump_url_formats(url, output_format=FORMAT_MARKDOWN, filename_prefix=None, output_sink=None, page_info=None):
+    """dump_url(), returns list of result_metadata, one per format (all of SUPPORTED_FORMATS for output_format == FORMAT_ALL)
+    page_info - already extracted page (see extract_url_formats()), only rendered
+    """
+    print(url)  # FIXME logging
+    configure()
+
+    output_format_list = get_output_format_list(output_format)
+
+    extractor_function = get_extractor_function()
+    epub_output_function = get_epub_output_function()
 
     log.info('extractor_function=%r', extractor_function)
     log.info('epub_output_function=%r', epub_output_function)
-    for output_format in output_format_list:
-        result_metadata = process_page(url=url, output_format=output_format, extractor_function=extractor_function, filename_prefix=filename_prefix, epub_output_function=epub_output_function)
-    return result_metadata  # the most recent one for output_format == FORMAT_ALL
+    # extract once, render into each format
+    return process_page_formats(url=url, output_formats=output_format_list, extractor_function=extractor_function, filename_prefix=filename_prefix, epub_output_function=epub_output_function, output_sink=output_sink, page_info=page_info)
+
+
+def extract_url_formats(url, output_format=FORMAT_MARKDOWN):
+    """Extraction stage of dump_url_formats(), returns page_info for dump_url_formats(page_info=...)"""
+    configure()
+    extractor_function = get_extractor_function()
+    content_format = get_page_content_format(get_output_format_list(output_format), extractor_function)
+    return extract_page(url, content_format=content_format, extractor_function=extractor_function)
+
+
+def dump_url_documents(url, output_format=FORMAT_MARKDOWN):
+    """dump_url_formats() into memory, for worker processes; the parent process writes the documents into the (shared) output sink.
+    Returns (result_metadata_list, documents), see sinks.MemorySink and sinks.write_documents()
+    """
+    from . import sinks
+    memory_sink = sinks.MemorySink()
+    result_metadata_list = dump_url_formats(url, output_format=output_format, output_sink=memory_sink)
+    return result_metadata_list, memory_sink.documents
+
+
+def prefetch_url(url, output_format=FORMAT_MARKDOWN, extractor_function=None):
+    """Network (IO bound) stage of dump_url(), populate the cache so that
+    dump_url() for the same url and output_format does not need the network
+    extractor_function - defaults to get_extractor_function()
+    """
+    extractor_function = extractor_function or get_extractor_function()
+    if extractor_function == extractor_postlight:
+        extractor_postlight(url, format=get_page_content_format(get_output_format_list(output_format), extractor_function))
+    elif extractor_function in (extractor_readability, extractor_raw):
+        get_url(url)
+    # else extractor does its own network IO (e.g. extractor_postlight_exe and extractor_postlight_worker), nothing to cache
+
+
+def prefetch_postlight(urls, content_format=FORMAT_HTML):
+    """Populate the postlight cache for urls (see postlight_batch()), W2D_POSTLIGHT_CONCURRENCY requests to the
+    postlight server in flight rather than one per fetch worker. Failures are logged, prefetch_url() reports them per url
+    """
+    postlight_batch(urls, format=content_format, ignore_errors=True)
+
+
+def get_worker_count(env_name, default=1):
+    workers = os.environ.get(env_name)
+    if workers:
+        workers = int(workers)
+    else:
+        workers = default
+    return workers
+
+
+def start_process_pool(workers):
+    """ProcessPoolExecutor with its worker processes already started.
+    Call before starting threads, forking while another thread holds a lock (e.g. inside sqlite or the connection pool) deadlocks the child
+    """
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    pool.submit(os.getpid).result()  # (fork) starts all the workers
+    return pool
 
 
-def dump_urls(urls, output_format=FORMAT_MARKDOWN):
-    for url in urls:
-        # TODO capture result_metadata? return as list, dictionary on filename?
-        dump_url(url, output_format=output_format)
+def dump_urls(urls, output_format=FORMAT_MARKDOWN, fetch_workers=None, cpu_workers=None, output_sink=None, ignore_errors=True):
+    """Process a list of urls, returns list (in the same order as urls) of result_metadata lists, one result_metadata
+    per output format, see dump_url_formats()
+
+    fetch_workers - number of threads used for network fetches, defaults to env W2D_FETCH_WORKERS or 1
+    cpu_workers - number of processes used for extraction/conversion, defaults to env W2D_CPU_WORKERS or 1
+    output_sink - where documents are written, defaults to get_output_sink(). Documents rendered by
+        worker processes are written by this process, so archive sinks have a single writer
+    ignore_errors - a url that fails (fetch, extraction or conversion) is logged, returned as the exception instance
+        rather than a list, and the rest of the batch carries on. Otherwise the first failure is raised
+
+    With 1 of each (the default), urls are processed one at a time.
+    Py2 (without concurrent.futures) always processes one at a time.
+    """
+    configure()
+    if fetch_workers is None:
+        fetch_workers = get_worker_count('W2D_FETCH_WORKERS')
+    if cpu_workers is None:
+        cpu_workers = get_worker_count('W2D_CPU_WORKERS')
+    urls = list(urls)
+
+    def dump(url, page_info=None):
+        try:
+            return dump_url_formats(url, output_format=output_format, output_sink=output_sink, page_info=page_info)
+        except Exception as info:
+            if not ignore_errors:
+                raise
+            log.error('dump failed for %r %r', url, info, exc_info=True)
+            return info
+
+    def dump_batch(batch_urls):
+        """dump() each url, pages are all extracted first so their pandoc conversions are one pandoc server request"""
+        if len(batch_urls) <= 1:
+            return [dump(url) for url in batch_urls]
+        page_info_list = []
+        for url in batch_urls:
+            try:
+                page_info_list.append(extract_url_formats(url, output_format))
+            except Exception as info:
+                if not ignore_errors:
+                    raise
+                log.error('dump failed for %r %r', url, info, exc_info=True)
+                page_info_list.append(info)
+        jobs = []
+        for page_info in page_info_list:
+            if not isinstance(page_info, Exception):
+                jobs.extend(get_render_pandoc_jobs(page_info, get_output_format_list(output_format)))
+        with pandoc_batch(jobs):
+            return [page_info if isinstance(page_info, Exception) else dump(url, page_info) for url, page_info in zip(batch_urls, page_info_list)]
+
+    batch_size = PANDOC_BATCH_SIZE if PANDOC_SERVER else 1  # without a pandoc server, nothing to gain from batching
+    if concurrent is None or (fetch_workers <= 1 and cpu_workers <= 1):
+        results = []
+        for offset in range(0, len(urls), batch_size):
+            results += dump_batch(urls[offset:offset + batch_size])
+        return results
+
+    log.info('batch of %d urls, fetch_workers=%d cpu_workers=%d', len(urls), fetch_workers, cpu_workers)
+    cpu_pool = None
+    if cpu_workers > 1:
+        cpu_pool = start_process_pool(cpu_workers)
+    fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(fetch_workers, 1))
+    try:
+        if get_extractor_function() == extractor_postlight:
+            prefetch_postlight(urls, get_page_content_format(get_output_format_list(output_format), extractor_postlight))
+        fetch_futures = {}
+        for index, url in enumerate(urls):
+            fetch_futures[fetch_pool.submit(prefetch_url, url, output_format)] = index
+        results = [None] * len(urls)
+        pending = []  # fetched, not yet rendered, see dump_batch()
+
+        def render_pending():
+            for pending_index, result in zip(pending, dump_batch([urls[x] for x in pending])):
+                results[pending_index] = result
+            del pending[:]
+
+        for future in concurrent.futures.as_completed(fetch_futures):
+            index = fetch_futures[future]
+            try:
+                future.result()
+            except Exception as info:
+                if not ignore_errors:
+                    raise
+                log.error('fetch failed for %r %r', urls[index], info)
+                results[index] = info
+                continue
+            # cache is now warm, hand over to the cpu bound stage
+            if cpu_pool:
+                results[index] = cpu_pool.submit(dump_url_documents, urls[index], output_format)
+            else:
+                pending.append(index)
+                if len(pending) >= batch_size:
+                    render_pending()
+        if pending:
+            render_pending()
+        if cpu_pool:
+            # write each document as it is rendered, rather than holding them all in memory
+            from . import sinks
+            output_sink = output_sink or get_output_sink()
+            cpu_futures = dict((future, index) for index, future in enumerate(results) if isinstance(future, concurrent.futures.Future))
+            for future in concurrent.futures.as_completed(cpu_futures):
+                index = cpu_futures[future]
+                try:
+                    result_metadata_list, documents = future.result()
+                    sinks.write_documents(output_sink, documents, result_metadata_list)
+                except Exception as info:
+                    if not ignore_errors:
+                        raise
+                    log.error('dump failed for %r %r', urls[index], info)
+                    results[index] = info
+                    continue
+                results[index] = result_metadata_list
+    finally:
+        fetch_pool.shutdown()
+        if cpu_pool:
+            cpu_pool.shutdown()
+    return results
+
+def extract_pages(urls, content_format=FORMAT_HTML, extractor_function=None, fetch_workers=None, cpu_workers=None, ignore_errors=False):
+    """Fetch and extract many urls, returns list of page_info (see extract_page()) in the same order as urls.
+    Same parallelism as dump_urls(), fetch_workers threads fetch (W2D_FETCH_WORKERS) and extraction runs in
+    cpu_workers processes (W2D_CPU_WORKERS). If ignore_errors, failed urls are returned as the exception instance rather than raised.
+    """
+    configure()
+    extractor_function = extractor_function or get_extractor_function()
+    if fetch_workers is None:
+        fetch_workers = get_worker_count('W2D_FETCH_WORKERS')
+    if cpu_workers is None:
+        cpu_workers = get_worker_count('W2D_CPU_WORKERS')
+    urls = list(urls)
+
+    def extract(url):
+        try:
+            return extract_page(url, content_format=content_format, extractor_function=extractor_function)
+        except Exception as info:
+            if not ignore_errors:
+                raise
+            log.error('extract failed for %r %r', url, info)
+            return info
+
+    if concurrent is None or (fetch_workers <= 1 and cpu_workers <= 1):
+        return [extract(url) for url in urls]
+
+    log.info('extracting %d urls, fetch_workers=%d cpu_workers=%d', len(urls), fetch_workers, cpu_workers)
+    cpu_pool = None
+    if cpu_workers > 1:
+        cpu_pool = start_process_pool(cpu_workers)
+    fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(fetch_workers, 1))
+    try:
+        if extractor_function == extractor_postlight:
+            prefetch_postlight(urls, content_format)
+        fetch_futures = {}
+        for index, url in enumerate(urls):
+            fetch_futures[fetch_pool.submit(prefetch_url, url, content_format, extractor_function)] = index
+        results = [None] * len(urls)
+        for future in concurrent.futures.as_completed(fetch_futures):
+            index = fetch_futures[future]
+            try:
+                future.result()
+            except Exception as info:
+                if not ignore_errors:
+                    raise
+                log.error('fetch failed for %r %r', urls[index], info)
+                results[index] = info
+                continue
+            # cache is now warm, hand over to the cpu bound stage
+            if cpu_pool:
+                results[index] = cpu_pool.submit(extract_page, urls[index], content_format=content_format, extractor_function=extractor_function)
+            else:
+                results[index] = extract(urls[index])
+        if cpu_pool:
+            for index, result in enumerate(results):
+                if isinstance(result, concurrent.futures.Future):
+                    try:
+                        results[index] = result.result()
+                    except Exception as info:
+                        if not ignore_errors:
+                            raise
+                        log.error('extract failed for %r %r', urls[index], info)
+                        results[index] = info
+    finally:
+        fetch_pool.shutdown()
+        if cpu_pool:
+            cpu_pool.shutdown()
+    return results
+
+
+def get_epub_bundle_output_function():
+    """Multi chapter equivalent of get_epub_output_function(), same W2D_EPUB_TOOL setting"""
+    epub_output_function = get_epub_output_function()
+    if epub_output_function == pypub_epub_output_function:
+        return pypub_epub_bundle_output_function
+    return pandoc_epub_bundle_output_function
+
+
+def render_epub_bundle(page_info_list, output_filename=None, title=None, epub_bundle_output_function=None, output_sink=None):
+    """Build one epub from many (previously extracted, as html) page_info (see extract_page()/extract_pages()),
+    a chapter per page, in list order, with a table of contents.
+    title - defaults to "w2d digest YYYY-MM-DD", output_filename defaults to title + '.epub'
+    output_sink - where the epub is written, defaults to get_output_sink()
+    Returns result_metadata, result_metadata['filename'] is the name in output_sink
+    """
+    if not page_info_list:
+        raise ValueError('no pages to bundle')
+    start = timer()
+    title = title or 'w2d digest %s' % time.strftime('%Y-%m-%d')
+    output_sink = output_sink or get_output_sink()
+    output_filename = output_sink.reserve(output_filename or '%s.%s' % (safe_filename(title), FORMAT_EPUB))
+    chapters = []
+    for page_info in page_info_list:
+        if page_info['content_format'] != FORMAT_HTML:
+            raise NotImplementedError('epub bundle needs html content, got %r for %r' % (page_info['content_format'], page_info['url']))
+        doc_metadata = page_info['doc_metadata']
+        chapters.append({
+            'title': page_info['title'] or page_info['url'],
+            'content': page_info['content'],
+            'url': page_info['url'],
+            'author': doc_metadata['author'],
+            'date': doc_metadata['date'],
+        })
+    epub_bundle_output_function = epub_bundle_output_function or get_epub_bundle_output_function()
+    log.info('building epub %r with %d chapters', output_filename, len(chapters))
+    write_epub_file(output_sink, output_filename, lambda epub_filename: epub_bundle_output_function(epub_filename, chapters, title=title, content_format=FORMAT_HTML), {'title': title, 'format': FORMAT_EPUB})
+    result_metadata = {
+        'title': title,
+        'filename': output_filename,
+        'format': FORMAT_EPUB,
+        'chapters': [dict((key, chapter[key]) for key in ('title', 'url', 'author', 'date')) for chapter in chapters],
+        'timings': {'epub': timer() - start},
+    }
+    return result_metadata
+
+
+def dump_epub_bundle(urls, output_filename=None, title=None, fetch_workers=None, cpu_workers=None, ignore_errors=True, output_sink=None):
+    """Extract urls (in parallel, see extract_pages()) then build a single epub with a chapter per url, see render_epub_bundle()
+    With ignore_errors (the default) urls that fail are left out, and listed in result_metadata['failed']
+    """
+    configure()
+    urls = list(urls)
+    page_info_list = extract_pages(urls, content_format=FORMAT_HTML, fetch_workers=fetch_workers, cpu_workers=cpu_workers, ignore_errors=ignore_errors)
+    failed = [(url, str(page_info)) for url, page_info in zip(urls, page_info_list) if isinstance(page_info, Exception)]
+    result_metadata = render_epub_bundle([page_info for page_info in page_info_list if not isinstance(page_info, Exception)], output_filename=output_filename, title=title, output_sink=output_sink)
+    result_metadata['failed'] = failed
+    for url, error in failed:
+        log.warning('not in epub bundle %r %s', url, error)
+    return result_metadata
+
 
 def main(argv=None):
     if argv is None:
         argv = sys.argv
 
+    setup_logging()
+    configure()
+
+    if argv[1:2] == ['serve']:
+        # long running conversion server, see w2d/server.py
+        from . import server
+        return server.main(argv[1:])
+
     print('Python %s on %s' % (sys.version, sys.platform))
 
     urls = argv[1:]  # no argument processing (yet)
     print(urls)
-    if not urls:
-        # demo
+    job_store_filename = os.environ.get('W2D_JOB_STORE')
+    if not urls and not job_store_filename:
+        # demo (with a job store, no urls means resume the batch)
         urls = [
         'http://www.pcgamer.com/2012/08/09/an-illusionist-in-skyrim-part-1/',
         ]
@@ -899,10 +2937,30 @@ def main(argv=None):
             print('%s' % env_key)
     """
 
-    output_format = os.environ.get('W2D_OUTPUT_FORMAT', FORMAT_MARKDOWN)
-    dump_urls(urls, output_format=output_format)
+    bundle_filename = os.environ.get('W2D_EPUB_BUNDLE')
+    if bundle_filename:
+        # one epub, a chapter per url
+        result_metadata = dump_epub_bundle(urls, output_filename=bundle_filename, title=os.environ.get('W2D_EPUB_BUNDLE_TITLE'))
+        close_output_sink()
+        print(result_metadata['filename'])  # TODO logging
+        return 1 if result_metadata['failed'] else 0
 
-    return 0
+    output_format = os.environ.get('W2D_OUTPUT_FORMAT', FORMAT_MARKDOWN)
+    if job_store_filename:
+        # resumable, per url state and errors recorded, see w2d/jobs.py
+        from . import jobs
+        try:
+            counts = jobs.run_batch(job_store_filename, urls=urls, output_format=output_format)
+        except ValueError as info:
+            print(info)  # TODO logging
+            return 1
+        close_output_sink()
+        print(counts)  # TODO logging
+        return 1 if counts[jobs.STATE_FAILED] else 0
+    results = dump_urls(urls, output_format=output_format)
+    close_output_sink()
+
+    return 1 if [result for result in results if isinstance(result, Exception)] else 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""asyncio fetcher, Python 3 only.
+
+Keeps many downloads in flight, with a per-host concurrency limit and a
+minimum delay between requests to the same host. Results are written into
+the same scrape_cache layout as w2d.get_url(), so a later (sync) w2d call
+picks them up from the cache.
+
+    import w2d.aio
+    pages = w2d.aio.get_urls(urls, per_host=2, host_delay=0.5)
+
+Uses aiohttp if installed, otherwise w2d.easy_get_url() in a thread pool
+(the limits still apply).
+"""
+
+import asyncio
+import concurrent.futures
+import json
+from urllib.parse import urlparse
+
+try:
+    import aiohttp  # optional - pip install aiohttp
+except ImportError:
+    aiohttp = None
+
+import w2d
+from w2d import log
+
+
+get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)  # Py3.7+
+
+
+def get_host(url):
+    url_components = urlparse(url)
+    return (url_components.scheme, url_components.hostname, url_components.port)
+
+
+class AsyncFetcher(object):
+    """Fetch urls concurrently with per-host politeness.
+
+    max_in_flight - total number of concurrent downloads
+    per_host - maximum concurrent connections to a single host
+    host_delay - minimum number of seconds between starting requests to the same host
+    postlight_concurrency - maximum concurrent requests to the Postlight server (MP_URL), it has its own cap as all postlight requests go to one (local) server
+    """
+    def __init__(self, max_in_flight=100, per_host=4, host_delay=0.0, postlight_concurrency=4, postlight_server_url=None, headers=None):
+        w2d.configure()
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.postlight_concurrency = postlight_concurrency
+        self.postlight_server_url = postlight_server_url or w2d.MP_URL
+        self.postlight_host = get_host(self.postlight_server_url)
+        if headers is None:
+            headers = w2d.MOZILLA_FIREFOX_HEADERS
+        self.headers = headers
+        # created on first use, need a running loop on older Python 3 versions
+        self._in_flight = None
+        self._host_semaphores = {}
+        self._host_locks = {}
+        self._host_next_start = {}
+        self._session = None
+        self._executor = None
+
+    def _get_host_semaphore(self, host):
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            if host == self.postlight_host:
+                limit = self.postlight_concurrency
+            else:
+                limit = self.per_host
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(limit)
+            self._host_locks[host] = asyncio.Lock()
+        return semaphore
+
+    async def _wait_for_host(self, host):
+        """Enforce host_delay between request starts to the same host"""
+        if not self.host_delay or host == self.postlight_host:
+            return
+        loop = get_running_loop()
+        async with self._host_locks[host]:
+            now = loop.time()
+            next_start = self._host_next_start.get(host, now)
+            if next_start > now:
+                await asyncio.sleep(next_start - now)
+                now = loop.time()
+            self._host_next_start[host] = now + self.host_delay
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_in_flight)
+        return self._executor
+
+    async def _run_sync(self, function, *args):
+        """Run blocking function (scrape cache disk and index access, etc.) in the thread pool, not the event loop"""
+        return await get_running_loop().run_in_executor(self._get_executor(), function, *args)
+
+    async def _download(self, url, headers=None):
+        headers = headers or self.headers
+        if aiohttp and '@' not in urlparse(url).netloc:
+            # aiohttp has no digest auth support, auth urls go via easy_get_url()
+            if self._session is None:
+                connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=0)  # limits managed here
+                self._session = aiohttp.ClientSession(connector=connector)
+            async with self._session.get(url, headers=headers) as response:
+                response.raise_for_status()
+                response_headers = dict((header_name.lower(), header_value) for header_name, header_value in response.headers.items())
+                max_bytes = w2d.MAX_DOWNLOAD_BYTES  # same limit as w2d.easy_get_url_response()
+                if max_bytes and response.content_length and response.content_length > max_bytes:
+                    raise w2d.DownloadTooLargeError('%d bytes (content-length), maximum %d' % (response.content_length, max_bytes))
+                chunks = []
+                size = 0
+                async for chunk in response.content.iter_chunked(w2d.CHUNK_SIZE):
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        raise w2d.DownloadTooLargeError('over %d bytes, maximum %d' % (size, max_bytes))
+                    chunks.append(chunk)
+                return response.status, response_headers, b''.join(chunks)
+        response_url, code, response_headers, page = await self._run_sync(w2d.easy_get_url_response, url, headers)
+        return code, response_headers, page
+
+    async def fetch(self, url, force=False, cache=True, revalidate=None):
+        """Return page bytes for url, from the scrape cache if present (unless force).
+        Same cache rules as w2d.get_url(); expired entries (W2D_CACHE_MAX_AGE) are downloaded again,
+        revalidate (default W2D_CACHE_REVALIDATE) issues a conditional request for cached entries
+        """
+        if revalidate is None:
+            revalidate = w2d.REVALIDATE
+        filename = await self._run_sync(w2d.get_cache_filename, url)
+        cache_exists = await self._run_sync(w2d.is_cache_entry_fresh, filename, force)
+        if cache_exists and not revalidate:
+            return await self._run_sync(w2d.read_cache_hit, filename)
+        headers = None
+        metadata = None
+        if cache_exists:
+            metadata = await self._run_sync(w2d.read_cache_metadata, filename)
+            revalidation_headers = w2d.get_revalidation_headers(metadata)
+            if revalidation_headers:
+                log.debug('revalidating cached file %r with %r', filename, revalidation_headers)
+                headers = self.headers.copy()
+                headers.update(revalidation_headers)
+        code, response_headers, page = await self._fetch_network(url, headers=headers)
+        if code == 304:
+            return await self._run_sync(w2d.read_not_modified, url, filename, metadata)
+        if cache:
+            await self._run_sync(w2d.cache_page, url, page, filename, code, response_headers)
+        return page
+
+    async def _fetch_network(self, url, headers=None):
+        """Download url honoring the concurrency limits, returns (code, headers, page), no caching"""
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        host = get_host(url)
+        # host limit and politeness delay first, a burst of urls for one host must not hold global slots other hosts could use
+        async with self._get_host_semaphore(host):
+            await self._wait_for_host(host)
+            async with self._in_flight:
+                log.debug('getting web page %r', url)
+                return await self._download(url, headers=headers)
+
+    async def fetch_postlight(self, url, format=None, force=False, retries=None, backoff=None):
+        """Postlight parser result (dict) for url, same cache entry and retries as w2d.postlight_parse(), error results are not cached"""
+        if retries is None:
+            retries = w2d.POSTLIGHT_RETRIES
+        if backoff is None:
+            backoff = w2d.POSTLIGHT_BACKOFF
+        postlight_format = w2d.get_postlight_format(format)
+        cache_key = w2d.get_postlight_cache_key(url, postlight_format)
+        filename = await self._run_sync(w2d.get_cache_filename, cache_key)
+        postlight_metadata = await self._run_sync(w2d.read_postlight_cache_hit, filename, force)
+        if postlight_metadata is not None:
+            return postlight_metadata
+        tmp_url = w2d.gen_postlight_url(url, format=postlight_format, headers=w2d.MOZILLA_FIREFOX_HEADERS, postlight_server_url=self.postlight_server_url)
+        for attempt in range(retries + 1):
+            try:
+                code, response_headers, postlight_json = await self._fetch_network(tmp_url)
+                postlight_metadata = json.loads(postlight_json)
+            except Exception as info:
+                if not w2d.is_postlight_retryable(info):
+                    raise
+                postlight_metadata = {'error': True, 'message': 'postlight server failed %r' % (info,)}
+            if not postlight_metadata.get('error', False):
+                break
+            if attempt < retries:
+                delay = backoff * (2 ** attempt)
+                log.warning('postlight failed %r, retrying in %r seconds', postlight_metadata, delay)
+                await asyncio.sleep(delay)
+        else:
+            log.error('postlight failed %r', postlight_metadata)
+            return postlight_metadata
+        await self._run_sync(w2d.cache_page, cache_key, postlight_json, filename, code, response_headers)
+        return postlight_metadata
+
+    async def fetch_all(self, urls, force=False, ignore_errors=False):
+        """Return list of page bytes, in the same order as urls.
+        If ignore_errors, failed downloads are returned as the exception instance rather than raised.
+        """
+        tasks = [self.fetch(url, force=force) for url in urls]
+        return await asyncio.gather(*tasks, return_exceptions=ignore_errors)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def run(coroutine):
+    # asyncio.run() is 3.7+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def get_urls(urls, force=False, ignore_errors=False, **kwargs):
+    """Sync wrapper, fetch all urls into the scrape cache, returns list of page bytes (same order as urls).
+    kwargs are passed to AsyncFetcher()
+    """
+    async def fetch_urls():
+        fetcher = AsyncFetcher(**kwargs)
+        try:
+            return await fetcher.fetch_all(urls, force=force, ignore_errors=ignore_errors)
+        finally:
+            await fetcher.close()
+    return run(fetch_urls())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Local copies of page images, so html/md/epub output can be read offline.
+
+Images are stored once per (original) content hash, in a directory shared
+by all pages, e.g. the same logo in 1,000 articles is one file:
+
+    assets/ab/ab12...ef.png
+    assets/urls/<hash of url>.json   - url to asset file, each url is only fetched once
+
+Enable with W2D_LOCALIZE_IMAGES=true, see w2d.localize_images().
+
+W2D_ASSET_DIR - directory (default assets, relative to the current directory)
+W2D_ASSET_WORKERS - number of concurrent image downloads (default 8)
+W2D_IMAGE_MAX_DIMENSION - pixels, larger images are scaled down (default 0, no limit)
+W2D_IMAGE_MAX_BYTES - larger images are re-compressed (default 0, no limit)
+W2D_IMAGE_QUALITY - jpeg quality for re-compressed images (default 85)
+
+Resizing/re-compressing needs Pillow (pip install Pillow), without it images are stored as downloaded.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+try:
+    from io import BytesIO
+except ImportError:
+    # Py2
+    from StringIO import StringIO as BytesIO
+
+try:
+    # Py3
+    from urllib.parse import urlparse
+except ImportError:
+    # Py2
+    from urlparse import urlparse
+
+try:
+    import concurrent.futures  # Py3
+except ImportError:
+    # Py2 (without futures backport), images are fetched serially
+    concurrent = None
+
+import w2d
+from .cache import replace_file
+
+
+log = logging.getLogger("w2d")
+
+PIL_Image = w2d.LazyModule('PIL.Image')  # optional - pip install Pillow
+
+URLS_DIRNAME = 'urls'
+
+CONTENT_TYPE_EXTENSIONS = {
+    'image/avif': '.avif',
+    'image/bmp': '.bmp',
+    'image/gif': '.gif',
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/svg+xml': '.svg',
+    'image/webp': '.webp',
+    'image/x-icon': '.ico',
+}
+IMAGE_EXTENSIONS = set(CONTENT_TYPE_EXTENSIONS.values()) | set(['.jpeg'])
+
+
+def get_image_extension(url, content_type=None):
+    """File extension (with dot) from content type, falling back to the url path"""
+    if content_type:
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type.split(';')[0].strip().lower())
+        if extension:
+            return extension
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return extension
+    return '.img'
+
+
+def shrink_image(data, max_dimension=0, max_bytes=0, quality=85):
+    """Scale down (to fit max_dimension) and/or re-compress (if over max_bytes) image data with Pillow.
+    Returns (data, extension), extension is None if data was not changed (not needed, not possible, or no smaller).
+    Images with transparency are saved as png, others as jpeg. Animated images, svg, etc. are not changed.
+    """
+    too_many_bytes = max_bytes and len(data) > max_bytes
+    if not (max_dimension or too_many_bytes):
+        return data, None
+    if not PIL_Image:
+        log.debug('Pillow not installed, image not resized')
+        return data, None
+    try:
+        image = PIL_Image.open(BytesIO(data))
+        image.load()
+    except Exception as info:
+        # not an image Pillow understands, e.g. svg
+        log.debug('image not resized %r', info)
+        return data, None
+    if getattr(image, 'is_animated', False):
+        return data, None
+    too_large = max_dimension and max(image.size) > max_dimension
+    if not (too_large or too_many_bytes):
+        return data, None
+    if too_large:
+        image.thumbnail((max_dimension, max_dimension))  # keeps aspect ratio
+    out_file = BytesIO()
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image.save(out_file, 'PNG', optimize=True)
+        extension = '.png'
+    else:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(out_file, 'JPEG', quality=quality, optimize=True, progressive=True)
+        extension = '.jpg'
+    result = out_file.getvalue()
+    if not too_large and len(result) >= len(data):
+        return data, None  # re-compressing did not help
+    return result, extension
+
+
+class AssetStore(object):
+    """Content addressed image store, thread safe and safe for multiple processes sharing directory.
+    Each url is downloaded at most once (per store), concurrent requests for the same url share one download.
+    """
+    def __init__(self, directory=None, max_dimension=None, max_bytes=None, quality=None):
+        self.directory = directory or os.environ.get('W2D_ASSET_DIR', 'assets')
+        self.max_dimension = max_dimension if max_dimension is not None else int(os.environ.get('W2D_IMAGE_MAX_DIMENSION', 0))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.environ.get('W2D_IMAGE_MAX_BYTES', 0))
+        self.quality = quality or int(os.environ.get('W2D_IMAGE_QUALITY', 85))
+        self.lock = threading.Lock()
+        self.url_locks = {}  # url -> lock, held while url is being downloaded
+        self.fetch_count = 0  # downloads by this instance
+
+    def get_url_filename(self, url):
+        return os.path.join(self.directory, URLS_DIRNAME, w2d.hash_url(url) + '.json')
+
+    def lookup(self, url):
+        """Returns asset filename (relative to directory) for url if already stored, else None"""
+        url_filename = self.get_url_filename(url)
+        if not os.path.exists(url_filename):
+            return None
+        f = open(url_filename, 'rb')
+        entry = json.loads(f.read().decode('utf-8'))
+        f.close()
+        if not os.path.exists(os.path.join(self.directory, entry['filename'])):
+            return None  # asset removed, fetch again
+        return entry['filename']
+
+    def find_content(self, content_hash):
+        """Returns asset filename (relative to directory) for content_hash (of the original image) if stored, else None"""
+        hash_dir = os.path.join(self.directory, content_hash[:2])
+        if os.path.isdir(hash_dir):
+            for name in os.listdir(hash_dir):
+                if name.startswith(content_hash + '.') and not name.endswith('.tmp'):
+                    return '%s/%s' % (content_hash[:2], name)
+        return None
+
+    def write_file(self, filename, data):
+        """Write via a temporary file, so readers never see a partial file"""
+        w2d.safe_mkdir(os.path.dirname(filename))
+        tmp_filename = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.current_thread().ident or 0)
+        f = open(tmp_filename, 'wb')
+        f.write(data)
+        f.close()
+        replace_file(tmp_filename, filename)
+
+    def get(self, url):
+        """Returns asset filename (relative to directory) for image url, downloading it if needed. Raises on download failure"""
+        filename = self.lookup(url)
+        if filename:
+            return filename
+        with self.lock:
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            try:
+                filename = self.lookup(url)  # another thread may have just fetched it
+                if filename:
+                    return filename
+                response_url, code, response_headers, data = w2d.easy_get_url_response(url, headers=w2d.MOZILLA_FIREFOX_HEADERS)
+                if code != 200:
+                    raise IOError('image %r http status %r' % (url, code))
+                with self.lock:
+                    self.fetch_count += 1
+                content_hash = hashlib.sha256(data).hexdigest()  # of the original, identical images from different urls are stored once
+                extension = get_image_extension(response_url, response_headers.get('content-type'))
+                filename = self.find_content(content_hash)
+                if not filename:
+                    data, new_extension = shrink_image(data, max_dimension=self.max_dimension, max_bytes=self.max_bytes, quality=self.quality)
+                    filename = '%s/%s%s' % (content_hash[:2], content_hash, new_extension or extension)
+                    self.write_file(os.path.join(self.directory, filename), data)
+                entry = {'url': url, 'filename': filename, 'sha256': content_hash}
+                self.write_file(self.get_url_filename(url), json.dumps(entry).encode('utf-8'))
+            finally:
+                # inside url_lock, waiting threads then find the stored asset (or retry after a failure)
+                with self.lock:
+                    if self.url_locks.get(url) is url_lock:
+                        del self.url_locks[url]
+        return filename
+
+    def get_many(self, urls, workers=None):
+        """Returns dict of url to asset filename (relative to directory), urls that fail to download are left out.
+        Downloads are concurrent, workers defaults to env W2D_ASSET_WORKERS (8)
+        """
+        if workers is None:
+            workers = int(os.environ.get('W2D_ASSET_WORKERS', 8))
+        urls = sorted(set(urls))
+        results = {}
+
+        def get(url):
+            try:
+                return self.get(url)
+            except Exception as info:
+                log.warning('image not localized %r %r', url, info)
+                return None
+
+        if concurrent is None or workers <= 1 or len(urls) <= 1:
+            filenames = [get(url) for url in urls]
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(urls)))
+            try:
+                filenames = list(pool.map(get, urls))
+            finally:
+                pool.shutdown()
+        for url, filename in zip(urls, filenames):
+            if filename:
+                results[url] = filename
+        return results
+
+
+asset_stores = {}  # directory -> AssetStore
+asset_stores_lock = threading.Lock()
+
+
+def get_asset_store(directory=None):
+    """Shared AssetStore for directory (defaults to W2D_ASSET_DIR)"""
+    directory = directory or os.environ.get('W2D_ASSET_DIR', 'assets')
+    with asset_stores_lock:
+        store = asset_stores.get(directory)
+        if store is None:
+            store = asset_stores[directory] = AssetStore(directory)
+        return store
@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""w2d benchmarks, results are written to stdout as json
+
+    python -m w2d.bench corpus directory [--scale 1] [--pages 3]
+    python -m w2d.bench --results pipelines.json pipelines [--corpus directory] [--repeat 3] [--pipelines raw,readability] [--formats md,html]
+
+corpus - write the synthetic benchmark pages (long articles, table heavy
+and image heavy pages) to directory, deterministic for a given scale.
+
+pipelines - extract and render every page of the corpus (the synthetic
+corpus if no directory is given) with each extractor pipeline into each
+output format. Pages are served by a local http server on an ephemeral
+port (no network access needed) and downloaded once into a temporary
+scrape cache, the extraction cache is disabled. Each pipeline/format runs
+in its own process so that peak RSS is per pipeline. Reports per page
+latency percentiles, throughput and peak RSS. Output formats that are not
+available (epub without pypub or pandoc) are reported as skipped.
+"""
+
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlparse
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlparse
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+timer = getattr(time, 'perf_counter', time.time)  # Py3.3+
+
+
+def percentile(values, percent):
+    """nearest-rank percentile, values need not be sorted"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(math.ceil(percent / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+WORDS = (
+    'the of and to in is that for it as was with be by on not he this are or his from at which but have an they you were her '
+    'she there been one all we their has would when if so no what up out can more about who also time its into only some could '
+    'other than then now first any new very these may like over such our most where after year years people through back much '
+    'before well should between three state world still same great own under last never while might house another system '
+    'program question government number night point during without again place around however home small found thought went '
+    'say part once general high upon school every does got united left number course water less public put think almost hand '
+    'enough far took head yet within free able given form among whole change early social order light later family local '
+    'epub markdown parser article reader content extract render network cache server latency memory throughput archive'
+).split()
+
+# 1x1 transparent png
+TINY_PNG = (
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+    b'\x00\x00\x00\x0bIDATx\x9cc`\x00\x02\x00\x00\x05\x00\x01z^\xab?\x00\x00\x00\x00IEND\xaeB`\x82'
+)
+IMAGE_COUNT = 16  # distinct image files, pages cycle through them
+
+
+class CorpusWriter(object):
+    """Deterministic (for a given seed) html in the shape of real pages, i.e. with site navigation, sidebar, and footer boilerplate around the content"""
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+
+    def words(self, minimum, maximum):
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(minimum, maximum)))
+
+    def sentence(self):
+        text = self.words(6, 18)
+        return text[0].upper() + text[1:] + '.'
+
+    def paragraph(self, link_base='/'):
+        sentences = []
+        for _ in range(self.random.randint(3, 7)):
+            sentence = self.sentence()
+            choice = self.random.random()
+            if choice < 0.2:
+                sentence = '%s <a href="%s%s.html">%s</a>.' % (sentence[:-1], link_base, self.random.choice(WORDS), self.words(1, 3))
+            elif choice < 0.3:
+                sentence = '%s <a href="https://example.com/%s/%s">%s</a>.' % (sentence[:-1], self.random.choice(WORDS), self.random.choice(WORDS), self.words(1, 3))
+            elif choice < 0.4:
+                sentence = '<em>%s</em> <strong>%s</strong>' % (self.words(1, 3), sentence)
+            sentences.append(sentence)
+        return '<p>%s</p>' % ' '.join(sentences)
+
+    def page(self, title, body):
+        nav = ''.join('<li><a href="/section/%s.html">%s</a></li>' % (word, word.title()) for word in self.random.sample(WORDS, 12))
+        sidebar = ''.join('<li><a href="/related/%d.html">%s</a></li>' % (counter, self.words(3, 8)) for counter in range(20))
+        comments = ''.join('<div class="comment"><p class="author">%s</p>%s</div>' % (self.words(1, 2), self.paragraph()) for _ in range(10))
+        return '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<meta name="description" content="%(description)s">
+<meta name="author" content="w2d bench">
+<link rel="stylesheet" href="/static/site.css">
+<script>var analytics = {"page": "%(title)s"};</script>
+</head>
+<body>
+<header class="site-header"><a href="/">Example Site</a><nav><ul>%(nav)s</ul></nav></header>
+<div class="container">
+<main><article>
+<h1>%(title)s</h1>
+<p class="byline">By w2d bench, <time datetime="2023-01-01">2023-01-01</time></p>
+%(body)s
+</article></main>
+<aside class="sidebar"><h3>Related</h3><ul>%(sidebar)s</ul></aside>
+<section class="comments"><h3>Comments</h3>%(comments)s</section>
+</div>
+<footer class="site-footer"><p>Copyright Example Site</p><ul>%(nav)s</ul></footer>
+</body>
+</html>
+''' % dict(title=title, description=self.sentence(), nav=nav, sidebar=sidebar, comments=comments, body=body)
+
+    def article(self, title, scale=1):
+        parts = []
+        for section in range(30 * scale):
+            parts.append('<h2 id="section-%d">%s</h2>' % (section, self.words(2, 6)))
+            for _ in range(self.random.randint(6, 12)):
+                parts.append(self.paragraph())
+            if section % 3 == 0:
+                parts.append('<blockquote>%s</blockquote>' % self.paragraph())
+            if section % 4 == 0:
+                parts.append('<ul>%s</ul>' % ''.join('<li>%s</li>' % self.sentence() for _ in range(self.random.randint(3, 8))))
+            if section % 5 == 0:
+                parts.append('<pre><code>%s</code></pre>' % '\n'.join('%s = %s(%s)' % (self.random.choice(WORDS), self.random.choice(WORDS), self.random.choice(WORDS)) for _ in range(8)))
+        return self.page(title, '\n'.join(parts))
+
+    def tables(self, title, scale=1):
+        parts = []
+        for table in range(20 * scale):
+            parts.append('<h2>%s</h2>' % self.words(2, 5))
+            parts.append(self.paragraph())
+            columns = self.random.randint(4, 10)
+            rows = ['<tr>%s</tr>' % ''.join('<th>%s</th>' % self.words(1, 2) for _ in range(columns))]
+            for _ in range(self.random.randint(20, 60)):
+                cells = []
+                for column in range(columns):
+                    if column == 0:
+                        cells.append('<td><a href="/item/%d.html">%s</a></td>' % (self.random.randint(0, 9999), self.words(1, 3)))
+                    elif column % 2:
+                        cells.append('<td>%0.2f</td>' % (self.random.random() * 10000))
+                    else:
+                        cells.append('<td>%s</td>' % self.words(1, 4))
+                rows.append('<tr>%s</tr>' % ''.join(cells))
+            parts.append('<table><caption>Table %d</caption><thead>%s</thead><tbody>%s</tbody></table>' % (table, rows[0], '\n'.join(rows[1:])))
+        return self.page(title, '\n'.join(parts))
+
+    def images(self, title, scale=1):
+        parts = []
+        for figure in range(150 * scale):
+            image_number = self.random.randint(0, IMAGE_COUNT - 1)
+            parts.append(
+                '<figure><img src="images/%02d.png" srcset="images/%02d.png 1x, /images/%02d.png 2x" alt="%s" width="640" height="480" loading="lazy">'
+                '<figcaption>%s</figcaption></figure>' % (image_number, image_number, image_number, self.words(2, 6), self.sentence())
+            )
+            if figure % 5 == 0:
+                parts.append(self.paragraph(link_base=''))
+        return self.page(title, '\n'.join(parts))
+
+
+CORPUS_PAGE_TYPES = ('article', 'tables', 'images')
+
+
+def write_corpus(directory, scale=1, pages=3):
+    """Write synthetic benchmark pages (pages of each of CORPUS_PAGE_TYPES) to directory, returns list of relative page filenames"""
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    image_dir = os.path.join(directory, 'images')
+    if not os.path.exists(image_dir):
+        os.mkdir(image_dir)
+    for counter in range(IMAGE_COUNT):
+        f = open(os.path.join(image_dir, '%02d.png' % counter), 'wb')
+        f.write(TINY_PNG)
+        f.close()
+    result = []
+    for page_type in CORPUS_PAGE_TYPES:
+        for counter in range(pages):
+            writer = CorpusWriter(seed='%s-%d-%d' % (page_type, scale, counter))
+            title = '%s %d %s' % (page_type.title(), counter, writer.words(3, 6))
+            page_content = getattr(writer, page_type)(title, scale=scale)
+            filename = '%s_%02d.html' % (page_type, counter)
+            f = open(os.path.join(directory, filename), 'wb')
+            f.write(page_content.encode('utf-8'))
+            f.close()
+            result.append(filename)
+    return result
+
+
+def find_corpus_pages(directory):
+    """Returns sorted list of relative filenames of the html pages under directory"""
+    result = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(('.html', '.htm')):
+                result.append(os.path.relpath(os.path.join(dirpath, filename), directory).replace(os.sep, '/'))
+    return result
+
+
+class CorpusRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like a real server
+    content_types = {'.html': 'text/html; charset=utf-8', '.htm': 'text/html; charset=utf-8', '.png': 'image/png'}
+
+    def log_message(self, format, *args):
+        pass  # would be timed as part of the fetch
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path).lstrip('/')
+        filename = os.path.normpath(os.path.join(self.server.directory, path))
+        if not filename.startswith(self.server.directory) or not os.path.isfile(filename):
+            self.send_error(404)
+            return
+        f = open(filename, 'rb')
+        body = f.read()
+        f.close()
+        self.send_response(200)
+        self.send_header('Content-Type', self.content_types.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CorpusServer(ThreadingMixIn, HTTPServer):
+    """Serves directory on localhost, port 0 picks a free port, see base_url"""
+    daemon_threads = True
+
+    def __init__(self, directory, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), CorpusRequestHandler)
+        self.directory = os.path.abspath(directory)
+        self.base_url = 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# name -> (w2d extractor function name, use trafilatura)
+PIPELINES = {
+    'raw': ('extractor_raw', False),
+    'readability': ('extractor_readability', True),  # trafilatura metadata, if installed
+    'readability_no_trafilatura': ('extractor_readability', False),
+}
+PIPELINE_ORDER = ('raw', 'readability', 'readability_no_trafilatura')
+PIPELINE_FORMATS = ('md', 'html', 'epub')
+
+
+def get_peak_rss():
+    """Peak resident set size of this process in bytes, None if not supported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024  # kilobytes on Linux/BSD, bytes on macOS
+    return peak
+
+
+def latency_stats(times):
+    """dict of latency (milliseconds) percentiles for times (seconds)"""
+    return {
+        'ms_p50': percentile(times, 50) * 1000,
+        'ms_p90': percentile(times, 90) * 1000,
+        'ms_p99': percentile(times, 99) * 1000,
+        'ms_max': max(times) * 1000,
+        'ms_mean': sum(times) / len(times) * 1000,
+    }
+
+
+def get_format_unavailable_reason(output_format):
+    """Returns None if w2d can render output_format here, otherwise why not"""
+    import w2d
+
+    if output_format != w2d.FORMAT_EPUB:
+        return None
+    epub_output_function = w2d.get_epub_output_function()
+    if epub_output_function == w2d.pypub_epub_output_function:
+        return None if w2d.pypub else 'pypub not installed'
+    w2d.configure()
+    if w2d.PANDOC_SERVER:
+        return None
+    if hasattr(shutil, 'which'):  # Py3.3+
+        return None if shutil.which(w2d.PANDOC_EXE) else 'pandoc (%s) not found' % w2d.PANDOC_EXE
+    return None  # no way to check, try it
+
+
+def run_pipeline(pipeline_name, output_format, urls, repeat=3, warmup=1, output_dir=None):
+    """Extract and render urls (already in the scrape cache) repeat times, in this process.
+    Returns dict of per page latency stats, throughput, and peak RSS.
+    """
+    import w2d
+
+    w2d.configure()
+    extractor_name, use_trafilatura = PIPELINES[pipeline_name]
+    extractor_function = getattr(w2d, extractor_name)
+    if not use_trafilatura:
+        w2d.trafilatura = None  # extractor_readability() skips trafilatura metadata extraction
+    filename_prefix = os.path.join(output_dir, '') if output_dir else None
+    page_bytes = sum(len(w2d.get_url(url)) for url in urls)
+
+    def process(url):
+        w2d.process_page_formats(url, output_formats=[output_format], extractor_function=extractor_function, filename_prefix=filename_prefix)
+
+    start = timer()
+    for _ in range(warmup):
+        for url in urls:
+            process(url)  # lazy imports, first use setup, etc.
+    warmup_seconds = timer() - start
+
+    times = []
+    start = timer()
+    for _ in range(repeat):
+        for url in urls:
+            page_start = timer()
+            process(url)
+            times.append(timer() - page_start)
+    total_seconds = timer() - start
+
+    results = {
+        'pipeline': pipeline_name,
+        'format': output_format,
+        'extractor': extractor_name,
+        'trafilatura': bool(use_trafilatura and w2d.trafilatura),
+        'page_count': len(urls),
+        'repeat': repeat,
+        'warmup_seconds': warmup_seconds,
+        'total_seconds': total_seconds,
+        'pages_per_second': len(times) / total_seconds if total_seconds else None,
+        'input_mb_per_second': page_bytes * repeat / total_seconds / (1024 * 1024) if total_seconds else None,
+        'peak_rss_bytes': get_peak_rss(),
+    }
+    results.update(latency_stats(times))
+    return results
+
+
+def bench_pipelines(corpus_dir=None, pipelines=None, formats=None, repeat=3, warmup=1, scale=1, pages=3):
+    """Serve corpus_dir (defaults to a generated synthetic corpus) locally and run each pipeline/format
+    in a child process (python -m w2d.bench run-pipeline), returns dict of results
+    """
+    import platform
+
+    import w2d
+
+    pipelines = pipelines or PIPELINE_ORDER
+    formats = formats or PIPELINE_FORMATS
+    for pipeline_name in pipelines:
+        if pipeline_name not in PIPELINES:
+            raise ValueError('unknown pipeline %r, expected one of %r' % (pipeline_name, PIPELINE_ORDER))
+
+    work_dir = tempfile.mkdtemp(prefix='w2d_bench_')
+    server = None
+    try:
+        if corpus_dir is None:
+            corpus_dir = os.path.join(work_dir, 'corpus')
+            write_corpus(corpus_dir, scale=scale, pages=pages)
+        page_filenames = find_corpus_pages(corpus_dir)
+        if not page_filenames:
+            raise ValueError('no html pages in %r' % corpus_dir)
+        server = CorpusServer(corpus_dir)
+        server.start()
+        urls = [server.base_url + filename for filename in page_filenames]
+
+        env = os.environ.copy()
+        env['W2D_CACHE_DIR'] = os.path.join(work_dir, 'scrape_cache')
+        env['W2D_EXTRACT_CACHE'] = 'false'  # measure extraction, not the extraction cache
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + [x for x in [env.get('PYTHONPATH')] if x])
+        os.environ['W2D_CACHE_DIR'] = env['W2D_CACHE_DIR']
+        w2d.load_config()
+
+        # download once (over http, local server) into the scrape cache shared by the child processes
+        fetch_times = []
+        corpus_pages = []
+        for filename, url in zip(page_filenames, urls):
+            start = timer()
+            page = w2d.get_url(url)
+            fetch_times.append(timer() - start)
+            corpus_pages.append({'url': url, 'filename': filename, 'bytes': len(page)})
+
+        results = {
+            'environment': {
+                'python': sys.version.split()[0],
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'versions': w2d.get_library_versions(),
+            },
+            'corpus': {
+                'directory': corpus_dir if corpus_dir != os.path.join(work_dir, 'corpus') else None,
+                'scale': scale,
+                'pages': corpus_pages,
+                'total_bytes': sum(x['bytes'] for x in corpus_pages),
+            },
+            'fetch': latency_stats(fetch_times),
+            'pipelines': {},
+        }
+
+        url_list_filename = os.path.join(work_dir, 'urls.txt')
+        f = open(url_list_filename, 'w')
+        f.write('\n'.join(urls))
+        f.close()
+        for pipeline_name in pipelines:
+            for output_format in formats:
+                key = '%s/%s' % (pipeline_name, output_format)
+                reason = get_format_unavailable_reason(output_format)
+                if reason:
+                    results['pipelines'][key] = {'skipped': reason}
+                    continue
+                output_dir = os.path.join(work_dir, 'output', pipeline_name, output_format)
+                os.makedirs(output_dir)
+                results_filename = os.path.join(output_dir, 'results.json')
+                cmd = [sys.executable, '-m', 'w2d.bench', '--results', results_filename, 'run-pipeline', pipeline_name, output_format, url_list_filename,
+                       '--repeat', str(repeat), '--warmup', str(warmup), '--output-dir', output_dir]
+                p = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stdout_value, stderr_value = p.communicate()
+                if p.returncode != 0:
+                    error_lines = stderr_value.decode('utf-8', 'replace').strip().splitlines()
+                    results['pipelines'][key] = {'failed': error_lines[-1] if error_lines else 'exit code %d' % p.returncode}
+                    continue
+                f = open(results_filename)
+                results['pipelines'][key] = json.load(f)
+                f.close()
+        results['ok'] = not [x for x in results['pipelines'].values() if 'failed' in x]
+        return results
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(work_dir)
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(prog='python -m w2d.bench', description='w2d benchmarks')
+    parser.add_argument('--results', metavar='FILENAME', help='write json results to FILENAME rather than stdout (w2d prints progress to stdout)')
+    subparsers = parser.add_subparsers(dest='command')
+    corpus_parser = subparsers.add_parser('corpus', help='write the synthetic benchmark pages')
+    corpus_parser.add_argument('directory')
+    corpus_parser.add_argument('--scale', type=int, default=1, help='page size multiplier')
+    corpus_parser.add_argument('--pages', type=int, default=3, help='number of pages of each type')
+    pipelines_parser = subparsers.add_parser('pipelines', help='extract and render a local page corpus with every extractor and output format')
+    pipelines_parser.add_argument('--corpus', metavar='DIRECTORY', help='directory of html pages, defaults to a generated synthetic corpus')
+    pipelines_parser.add_argument('--scale', type=int, default=1, help='synthetic page size multiplier')
+    pipelines_parser.add_argument('--pages', type=int, default=3, help='number of synthetic pages of each type')
+    pipelines_parser.add_argument('--pipelines', default=','.join(PIPELINE_ORDER), help='comma separated, default %(default)s')
+    pipelines_parser.add_argument('--formats', default=','.join(PIPELINE_FORMATS), help='comma separated, default %(default)s')
+    pipelines_parser.add_argument('--repeat', type=int, default=3)
+    pipelines_parser.add_argument('--warmup', type=int, default=1, help='untimed passes over the corpus before timing')
+    run_parser = subparsers.add_parser('run-pipeline', help='(used by pipelines) time one pipeline/format in this process, urls must be in the scrape cache')
+    run_parser.add_argument('pipeline', choices=PIPELINE_ORDER)
+    run_parser.add_argument('format')
+    run_parser.add_argument('url_list', help='file with one url per line')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--output-dir')
+    options = parser.parse_args(argv[1:])
+
+    exit_code = 0
+    if options.command == 'corpus':
+        results = {'directory': options.directory, 'pages': write_corpus(options.directory, scale=options.scale, pages=options.pages)}
+    elif options.command == 'pipelines':
+        results = bench_pipelines(corpus_dir=options.corpus, pipelines=options.pipelines.split(','), formats=options.formats.split(','), repeat=options.repeat, warmup=options.warmup, scale=options.scale, pages=options.pages)
+        if not results['ok']:
+            exit_code = 1
+    elif options.command == 'run-pipeline':
+        f = open(options.url_list)
+        urls = f.read().split()
+        f.close()
+        results = run_pipeline(options.pipeline, options.format, urls, repeat=options.repeat, warmup=options.warmup, output_dir=options.output_dir)
+    else:
+        parser.print_help()
+        return 1
+    if options.results:
+        f = open(options.results, 'w')
+        f.write(json.dumps(results, indent=4, sort_keys=True))
+        f.close()
+    else:
+        print(json.dumps(results, indent=4, sort_keys=True))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
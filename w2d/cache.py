@@ -0,0 +1,608 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Scrape cache catalogue, sqlite3 index of the pages in the scrape cache
+
+    python -m w2d.cache stats
+    python -m w2d.cache domains
+    python -m w2d.cache oldest 20
+    python -m w2d.cache lookup https://en.wikipedia.org/wiki/EPUB
+    python -m w2d.cache compact --max-bytes 1000000000 --max-age 2592000
+
+Cache limits (used by compact and inline by w2d.get_url()) default to env vars;
+W2D_CACHE_MAX_BYTES, W2D_CACHE_MAX_ENTRIES, and W2D_CACHE_MAX_AGE (seconds).
+Entries older than max age are evicted first, then least recently used entries
+until both the size and entry count limits are met.
+
+Cache entries are optionally stored compressed, W2D_CACHE_COMPRESSION may be
+set to none (default), zlib, gzip, or zstd (needs zstandard). The codec of
+each entry is recorded in the index and entries are only decompressed as
+recorded, a body that is itself compressed data (e.g. a .gz download) is
+returned exactly as stored. Entries without a recorded codec (written before
+compression support) are uncompressed, so caches with a mix of compressed
+and uncompressed entries work, no migration needed.
+
+Identical bodies are stored once, in objects/ keyed on the sha256 of the
+(uncompressed) body, each url cache entry is a hard link to the shared object
+(falls back to a copy where hard links are not supported), compressed
+objects have the codec as a filename suffix. Disable with W2D_CACHE_DEDUPE=false.
+
+Extraction results (see w2d.extract_page()) are stored under extract/ and
+indexed too (hash is the path relative to the cache directory), they are
+evicted with, and count towards the limits of, the scrape cache.
+
+Cache directory is W2D_CACHE_DIR (default scrape_cache), or use --cache-dir
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+try:
+    # Py3
+    from urllib.parse import urlparse
+except ImportError:
+    # Py2
+    from urlparse import urlparse
+
+try:
+    import zstandard  # optional - pip install zstandard
+except ImportError:
+    zstandard = None
+
+
+log = logging.getLogger("w2d")
+
+INDEX_FILENAME = 'index.sqlite3'
+EXTRACT_DIRNAME = 'extract'
+LEGACY_INDEX_FILENAME = 'index.tsv'
+
+CREATE_SQL = '''
+CREATE TABLE IF NOT EXISTS entries (
+    hash TEXT PRIMARY KEY,  -- cache filename (basename), or extract/... path for extraction results
+    url TEXT NOT NULL,
+    domain TEXT,
+    size INTEGER,
+    fetch_time REAL,
+    status INTEGER,
+    content_type TEXT,
+    access_time REAL,
+    content_hash TEXT,  -- sha256 of uncompressed body, see objects/
+    codec TEXT  -- storage codec, see compress(), NULL (before compression support) is none
+);
+CREATE INDEX IF NOT EXISTS entries_url ON entries (url);
+CREATE INDEX IF NOT EXISTS entries_domain ON entries (domain);
+CREATE INDEX IF NOT EXISTS entries_fetch_time ON entries (fetch_time);
+'''
+
+ENTRY_COLUMNS = ('hash', 'url', 'domain', 'size', 'fetch_time', 'status', 'content_type', 'access_time', 'content_hash', 'codec')
+
+
+def get_env_number(env_name, number_type=int):
+    value = os.environ.get(env_name)
+    if value:
+        return number_type(value)
+    return None
+
+
+def get_cache_limits():
+    """Returns dict of cache limits from environment, None means no limit"""
+    return {
+        'max_bytes': get_env_number('W2D_CACHE_MAX_BYTES'),
+        'max_entries': get_env_number('W2D_CACHE_MAX_ENTRIES'),
+        'max_age': get_env_number('W2D_CACHE_MAX_AGE', float),
+    }
+
+
+CODEC_NONE = 'none'
+CODEC_ZLIB = 'zlib'
+CODEC_GZIP = 'gzip'
+CODEC_ZSTD = 'zstd'
+
+SUPPORTED_CODECS = [CODEC_NONE, CODEC_ZLIB, CODEC_GZIP]
+if zstandard:
+    SUPPORTED_CODECS.append(CODEC_ZSTD)
+
+def get_cache_codec():
+    codec = os.environ.get('W2D_CACHE_COMPRESSION', CODEC_NONE).lower() or CODEC_NONE
+    if codec not in SUPPORTED_CODECS:
+        raise NotImplementedError('W2D_CACHE_COMPRESSION=%r not supported (or missing dependency), expected one of %r' % (codec, SUPPORTED_CODECS))
+    return codec
+
+
+def compress(data, codec=CODEC_NONE):
+    if codec == CODEC_NONE:
+        return data
+    elif codec == CODEC_ZLIB:
+        return zlib.compress(data, 6)
+    elif codec == CODEC_GZIP:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container, no filename/mtime header (unlike gzip.compress in older pythons)
+        return compressor.compress(data) + compressor.flush()
+    elif codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    raise NotImplementedError('codec=%r' % codec)
+
+
+class IdentityCompressor(object):
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def get_compressor(codec=CODEC_NONE):
+    """Streaming compressor, object with compress(data) and flush() methods, output matches compress()"""
+    if codec == CODEC_NONE:
+        return IdentityCompressor()
+    elif codec == CODEC_ZLIB:
+        return zlib.compressobj(6)
+    elif codec == CODEC_GZIP:
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor().compressobj()
+    raise NotImplementedError('codec=%r' % codec)
+
+
+def decompress(data, codec=CODEC_NONE):
+    """Returns uncompressed data, codec is the one the data was compressed with (see CacheIndex.get_codec()), never guessed"""
+    if codec == CODEC_NONE:
+        return data
+    elif codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    elif codec == CODEC_GZIP:
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    elif codec == CODEC_ZSTD:
+        if not zstandard:
+            raise ImportError('No module named zstandard, needed to read zstd compressed cache entry')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)  # decompressobj handles frames without content size
+    raise NotImplementedError('codec=%r' % codec)
+
+
+def read_cache_file(filename, codec=CODEC_NONE):
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    return decompress(data, codec)
+
+
+def get_tmp_filename(filename):
+    """Temporary filename, next to filename, unique per process and thread"""
+    return '%s.%d.%d.tmp' % (filename, os.getpid(), threading.current_thread().ident)
+
+
+def write_cache_file(filename, data, codec=None):
+    """Write data to filename, compressed with codec (defaults to W2D_CACHE_COMPRESSION)
+    Written to a temporary file which then replaces filename, an existing filename is never written to
+    as it may be a (hard) link to a shared object (see write_cache_entry()) and readers never see a partial file.
+    Returns number of bytes written (i.e. on disk size)
+    """
+    if codec is None:
+        codec = get_cache_codec()
+    data = compress(data, codec)
+    tmp_filename = get_tmp_filename(filename)
+    f = open(tmp_filename, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    replace_file(tmp_filename, filename)
+    return len(data)
+
+
+class CacheFileWriter(object):
+    """Write only file-like object, for streaming a body into a (new) cache file without holding it in memory.
+    Data is compressed with codec (defaults to W2D_CACHE_COMPRESSION) and the sha256 of the
+    uncompressed data is computed as it is written.
+    """
+    def __init__(self, filename, codec=None):
+        if codec is None:
+            codec = get_cache_codec()
+        self.filename = filename
+        self.compressor = get_compressor(codec)
+        self.content_hash = hashlib.sha256()
+        self.size = 0  # uncompressed
+        self.disk_size = 0
+        self.file = open(filename, 'wb')
+
+    def _write(self, data):
+        if data:
+            self.file.write(data)
+            self.disk_size += len(data)
+
+    def write(self, data):
+        self.content_hash.update(data)
+        self.size += len(data)
+        self._write(self.compressor.compress(data))
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            self._write(self.compressor.flush())
+        finally:
+            self.file.close()
+            self.file = None
+
+    def hexdigest(self):
+        return self.content_hash.hexdigest()
+
+
+OBJECTS_DIRNAME = 'objects'
+
+def is_dedupe_enabled():
+    return os.environ.get('W2D_CACHE_DEDUPE', 'true').lower() not in ('false', '0', 'no', 'off')
+
+
+def hash_content(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_object_filename(cache_dir, content_hash, codec=CODEC_NONE):
+    """Shared body filename, the same body stored with a different codec is a different object"""
+    filename = os.path.join(cache_dir, OBJECTS_DIRNAME, content_hash[:2], content_hash)
+    if codec != CODEC_NONE:
+        filename += '.' + codec
+    return filename
+
+
+def make_parent_dir(filename):
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise  # not a race with another writer
+
+
+def replace_file(src, dst):
+    """Atomic where the platform allows"""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)  # Py3.3+
+    else:
+        if sys.platform.startswith('win') and os.path.exists(dst):
+            os.remove(dst)  # NOTE not atomic
+        os.rename(src, dst)
+
+
+def write_cache_entry(cache_dir, filename, data, codec=None, content_hash=None):
+    """Write data for cache entry filename, the body is stored once under objects/ (by content hash and codec,
+    defaults to W2D_CACHE_COMPRESSION) and filename is (hard) linked to it. NOTE existing filename is replaced, not written to, as it may be shared.
+    Returns (on disk size, content_hash)
+    """
+    if codec is None:
+        codec = get_cache_codec()
+    content_hash = content_hash or hash_content(data)
+    object_filename = get_object_filename(cache_dir, content_hash, codec)
+    if os.path.exists(object_filename):
+        size = os.path.getsize(object_filename)
+    else:
+        make_parent_dir(object_filename)
+        size = write_cache_file(object_filename, data, codec=codec)
+
+    link_to_object(object_filename, filename)
+    return size, content_hash
+
+
+def link_to_object(object_filename, filename):
+    """Atomically replace filename with a (hard) link to object_filename"""
+    tmp_filename = get_tmp_filename(filename)
+    try:
+        os.link(object_filename, tmp_filename)
+    except (AttributeError, OSError):
+        # no hard link support (e.g. FAT, Py2 on Windows), store a copy
+        shutil.copyfile(object_filename, tmp_filename)
+    replace_file(tmp_filename, filename)
+    if os.path.exists(tmp_filename):
+        # rename() is a no-op when both names are links to the same file (unchanged body)
+        os.remove(tmp_filename)
+
+
+def install_cache_entry(cache_dir, filename, tmp_filename, content_hash=None, codec=CODEC_NONE):
+    """Move a completely written tmp_filename (e.g. from CacheFileWriter, compressed with codec) into place as cache entry filename.
+    If content_hash is set, the body is stored once under objects/ and filename is linked to it (see write_cache_entry())
+    Returns on disk size
+    """
+    if content_hash is None:
+        size = os.path.getsize(tmp_filename)
+        replace_file(tmp_filename, filename)
+        return size
+    object_filename = get_object_filename(cache_dir, content_hash, codec)
+    if os.path.exists(object_filename):
+        os.remove(tmp_filename)  # identical body already stored
+    else:
+        make_parent_dir(object_filename)
+        replace_file(tmp_filename, object_filename)
+    link_to_object(object_filename, filename)
+    return os.path.getsize(object_filename)
+
+
+def remove_unreferenced_object(cache_dir, content_hash, codec=CODEC_NONE):
+    """Remove object if no cache entry links to it any more"""
+    object_filename = get_object_filename(cache_dir, content_hash, codec)
+    try:
+        if os.stat(object_filename).st_nlink <= 1:
+            os.remove(object_filename)
+    except OSError:
+        if os.path.exists(object_filename):
+            raise
+
+
+def remove_unreferenced_objects(cache_dir):
+    """Garbage collect objects/, returns number removed"""
+    count = 0
+    objects_dir = os.path.join(cache_dir, OBJECTS_DIRNAME)
+    if not os.path.isdir(objects_dir):
+        return count
+    for dirpath, dirnames, filenames in os.walk(objects_dir):
+        for filename in filenames:
+            pathname = os.path.join(dirpath, filename)
+            if os.stat(pathname).st_nlink <= 1:
+                os.remove(pathname)
+                count += 1
+    return count
+
+
+class CacheIndex(object):
+    """sqlite3 catalogue of a cache directory.
+    Safe for use from multiple threads and processes, each thread (and process) gets its own connection,
+    the database is in WAL mode and writers wait (timeout seconds) for locks.
+    """
+    def __init__(self, cache_dir, timeout=30.0):
+        self.cache_dir = cache_dir
+        self.db_filename = os.path.join(cache_dir, INDEX_FILENAME)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_connection(self):
+        # pid check, connections must not be shared with forked (e.g. multiprocessing) children
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            new_db = not os.path.exists(self.db_filename)
+            connection = sqlite3.connect(self.db_filename, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(CREATE_SQL)
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(entries)')]
+            if 'access_time' not in columns:
+                # upgrade index created before LRU support
+                with connection:
+                    connection.execute('ALTER TABLE entries ADD COLUMN access_time REAL')
+                    connection.execute('UPDATE entries SET access_time = fetch_time')
+            if 'content_hash' not in columns:
+                # upgrade index created before content de-duplication
+                with connection:
+                    connection.execute('ALTER TABLE entries ADD COLUMN content_hash TEXT')
+            if 'codec' not in columns:
+                # upgrade index created before the codec was recorded, existing entries are uncompressed
+                with connection:
+                    connection.execute('ALTER TABLE entries ADD COLUMN codec TEXT')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_access_time ON entries (access_time)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_content_hash ON entries (content_hash)')
+            self._local.connection = connection
+            self._local.pid = pid
+            if new_db:
+                self.import_tsv()
+        return self._local.connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+        self._local.pid = None
+
+    def _query(self, sql, params=()):
+        cursor = self._get_connection().execute(sql, params)
+        return [dict(zip(ENTRY_COLUMNS, row)) for row in cursor.fetchall()]
+
+    def record(self, hash, url, size, fetch_time=None, status=None, content_type=None, content_hash=None, codec=None):
+        """Add (or replace) entry for cache file hash, codec is how the file is stored (see compress())"""
+        if fetch_time is None:
+            fetch_time = time.time()
+        connection = self._get_connection()
+        with connection:
+            if codec is None:
+                # e.g. 304 Not Modified, body unchanged (a rewritten body always has a codec)
+                row = connection.execute('SELECT content_hash, codec FROM entries WHERE hash = ?', (hash,)).fetchone()
+                if row:
+                    content_hash = content_hash or row[0]
+                    codec = codec or row[1]
+            connection.execute(
+                'INSERT OR REPLACE INTO entries (hash, url, domain, size, fetch_time, status, content_type, access_time, content_hash, codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (hash, url, urlparse(url).hostname, size, fetch_time, status, content_type, time.time(), content_hash, codec)
+            )
+
+    def get_codec(self, hash):
+        """Returns codec cache file hash is stored with, none for unknown entries and entries from before compression support"""
+        row = self._get_connection().execute('SELECT codec FROM entries WHERE hash = ?', (hash,)).fetchone()
+        return (row and row[0]) or CODEC_NONE
+
+    def lookup_content_hash(self, content_hash):
+        """Returns list of entry dicts sharing the same body"""
+        return self._query('SELECT %s FROM entries WHERE content_hash = ?' % ', '.join(ENTRY_COLUMNS), (content_hash,))
+
+    def touch(self, hash):
+        """Record a cache hit (for least recently used eviction)"""
+        connection = self._get_connection()
+        with connection:
+            connection.execute('UPDATE entries SET access_time = ? WHERE hash = ?', (time.time(), hash))
+
+    def is_expired(self, hash, max_age):
+        entry = self.lookup_hash(hash)
+        return entry is not None and entry['fetch_time'] < time.time() - max_age
+
+    def eviction_candidates(self, max_bytes=None, max_entries=None, max_age=None):
+        """Returns list of entry dicts that need removing to meet the limits (None means no limit)"""
+        result = []
+        if max_age is not None:
+            result += self._query('SELECT %s FROM entries WHERE fetch_time < ?' % ', '.join(ENTRY_COLUMNS), (time.time() - max_age,))
+        if max_bytes is None and max_entries is None:
+            return result
+        expired = set(entry['hash'] for entry in result)
+        count, total_size = self.totals()
+        count -= len(result)
+        total_size -= sum(entry['size'] or 0 for entry in result)
+        if (max_entries is None or count <= max_entries) and (max_bytes is None or total_size <= max_bytes):
+            return result
+        cursor = self._get_connection().execute('SELECT %s FROM entries ORDER BY access_time ASC' % ', '.join(ENTRY_COLUMNS))
+        for row in cursor:
+            if (max_entries is None or count <= max_entries) and (max_bytes is None or total_size <= max_bytes):
+                break
+            entry = dict(zip(ENTRY_COLUMNS, row))
+            if entry['hash'] in expired:
+                continue
+            result.append(entry)
+            count -= 1
+            total_size -= entry['size'] or 0
+        return result
+
+    def remove(self, hash):
+        connection = self._get_connection()
+        with connection:
+            connection.execute('DELETE FROM entries WHERE hash = ?', (hash,))
+
+    def lookup_url(self, url):
+        """Returns most recent (scrape cache, not extraction result) entry dict for url, or None"""
+        result = self._query('SELECT %s FROM entries WHERE url = ? AND hash NOT LIKE ? ORDER BY fetch_time DESC LIMIT 1' % ', '.join(ENTRY_COLUMNS), (url, EXTRACT_DIRNAME + '/%'))
+        return result[0] if result else None
+
+    def lookup_hash(self, hash):
+        """Returns entry dict for hash, or None"""
+        result = self._query('SELECT %s FROM entries WHERE hash = ?' % ', '.join(ENTRY_COLUMNS), (hash,))
+        return result[0] if result else None
+
+    def oldest(self, limit=10):
+        """Returns list of entry dicts, oldest fetch_time first"""
+        return self._query('SELECT %s FROM entries ORDER BY fetch_time ASC LIMIT ?' % ', '.join(ENTRY_COLUMNS), (limit,))
+
+    def size_by_domain(self):
+        """Returns list of (domain, entry count, total size) largest total size first"""
+        cursor = self._get_connection().execute('SELECT domain, COUNT(*), SUM(size) FROM entries GROUP BY domain ORDER BY SUM(size) DESC')
+        return cursor.fetchall()
+
+    def totals(self):
+        """Returns (entry count, total size), single scan, cheap enough for every cache write"""
+        count, total_size = self._get_connection().execute('SELECT COUNT(*), SUM(size) FROM entries').fetchone()
+        return count, total_size or 0
+
+    def stats(self):
+        """Returns dict with entry count, total size, and unique bodies (and their size, i.e. disk usage after de-duplication)"""
+        connection = self._get_connection()
+        count, total_size = self.totals()
+        unique_count, unique_size = connection.execute('SELECT COUNT(*), SUM(size) FROM (SELECT MAX(size) AS size FROM entries GROUP BY COALESCE(content_hash, hash))').fetchone()
+        return {'count': count, 'size': total_size, 'unique_count': unique_count, 'unique_size': unique_size or 0}
+
+    def import_tsv(self, tsv_filename=None):
+        """Import entries from legacy append-only index.tsv (hash<TAB>url per line), if present"""
+        tsv_filename = tsv_filename or os.path.join(self.cache_dir, LEGACY_INDEX_FILENAME)
+        if not os.path.exists(tsv_filename):
+            return 0
+        log.info('importing legacy cache index %r', tsv_filename)
+        count = 0
+        f = open(tsv_filename, 'rb')
+        for line in f:
+            line = line.decode('utf-8').rstrip('\r\n')
+            if not line:
+                continue
+            hash, url = line.split('\t', 1)
+            filename = os.path.join(self.cache_dir, hash)
+            if not os.path.exists(filename):
+                continue
+            stat_info = os.stat(filename)
+            self.record(hash, url, stat_info.st_size, fetch_time=stat_info.st_mtime)
+            count += 1
+        f.close()
+        return count
+
+
+def remove_cache_files(cache_dir, hash):
+    """Remove cache entry (and sidecar files) from disk"""
+    filename = os.path.join(cache_dir, hash)
+    for entry_filename in (filename, filename + '.json'):
+        try:
+            os.remove(entry_filename)
+        except OSError:
+            if os.path.exists(entry_filename):
+                raise
+
+
+def compact(cache_dir, max_bytes=None, max_entries=None, max_age=None, index=None):
+    """Evict entries from cache_dir to meet the limits (None means no limit)
+    NOTE size limit is based on per url entry sizes, shared (de-duplicated) bodies
+    are counted once per url so eviction stops early rather than evicting too much.
+    Returns list of removed entry dicts
+    """
+    index = index or CacheIndex(cache_dir)
+    removed = index.eviction_candidates(max_bytes=max_bytes, max_entries=max_entries, max_age=max_age)
+    for entry in removed:
+        log.debug('evicting cache entry %r %r', entry['hash'], entry['url'])
+        remove_cache_files(cache_dir, entry['hash'])
+        index.remove(entry['hash'])
+        if entry['content_hash']:
+            remove_unreferenced_object(cache_dir, entry['content_hash'], entry['codec'] or CODEC_NONE)
+    if removed:
+        log.info('evicted %d cache entries from %r', len(removed), cache_dir)
+    return removed
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(prog='python -m w2d.cache', description='w2d scrape cache catalogue')
+    parser.add_argument('--cache-dir', default=os.environ.get('W2D_CACHE_DIR', 'scrape_cache'))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('stats', help='entry count and total size')
+    subparsers.add_parser('domains', help='total size per domain')
+    oldest_parser = subparsers.add_parser('oldest', help='oldest entries')
+    oldest_parser.add_argument('limit', nargs='?', type=int, default=10)
+    lookup_parser = subparsers.add_parser('lookup', help='lookup url or hash')
+    lookup_parser.add_argument('url_or_hash')
+    limits = get_cache_limits()
+    compact_parser = subparsers.add_parser('compact', help='evict entries to meet cache limits')
+    compact_parser.add_argument('--max-bytes', type=int, default=limits['max_bytes'])
+    compact_parser.add_argument('--max-entries', type=int, default=limits['max_entries'])
+    compact_parser.add_argument('--max-age', type=float, default=limits['max_age'], help='seconds')
+    options = parser.parse_args(argv[1:])
+
+    index = CacheIndex(options.cache_dir)
+    if options.command == 'domains':
+        for domain, count, size in index.size_by_domain():
+            print('%s\t%d\t%d' % (domain, count, size or 0))
+    elif options.command == 'oldest':
+        for entry in index.oldest(options.limit):
+            print('%s\t%s\t%s' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['fetch_time'])), entry['hash'], entry['url']))
+    elif options.command == 'compact':
+        removed = compact(options.cache_dir, max_bytes=options.max_bytes, max_entries=options.max_entries, max_age=options.max_age, index=index)
+        print('removed: %d' % len(removed))
+        print('size removed: %d' % sum(entry['size'] or 0 for entry in removed))
+        print('unreferenced objects removed: %d' % remove_unreferenced_objects(options.cache_dir))
+    elif options.command == 'lookup':
+        entry = index.lookup_url(options.url_or_hash) or index.lookup_hash(options.url_or_hash)
+        if entry is None:
+            print('not found')
+            return 1
+        for key in ENTRY_COLUMNS:
+            print('%s: %s' % (key, entry[key]))
+    else:
+        stats = index.stats()
+        print('entries: %d' % stats['count'])
+        print('size: %d' % stats['size'])
+        print('unique bodies: %d' % stats['unique_count'])
+        print('unique size: %d' % stats['unique_size'])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Resumable batch jobs, the state of each url is kept in a sqlite3 job store
+
+    python -m w2d.jobs run batch.sqlite3 http://example.com/one http://example.com/two
+    python -m w2d.jobs run batch.sqlite3 --url-file urls.txt --format all
+    python -m w2d.jobs run batch.sqlite3  # continue an interrupted batch
+    python -m w2d.jobs run batch.sqlite3 --retry-failed
+    python -m w2d.jobs status batch.sqlite3
+    python -m w2d.jobs failed batch.sqlite3
+
+Or set W2D_JOB_STORE=batch.sqlite3 for python -m w2d (urls are added to the store).
+
+Each url moves through the states pending, fetched, extracted, rendered
+(done), each state change is committed as it happens. A url that raises is
+marked failed, with the error, and the rest of the batch carries on. Running
+the batch again skips rendered (and failed, unless --retry-failed) urls and
+continues the others, the scrape and extraction caches mean work done before
+an interruption is not repeated.
+
+Same parallelism as w2d.dump_urls(), W2D_FETCH_WORKERS threads fetch and
+W2D_CPU_WORKERS processes extract and render.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import concurrent.futures  # Py3
+except ImportError:
+    # Py2 (without futures backport), urls are processed serially
+    concurrent = None
+
+import w2d
+from . import sinks
+
+
+log = logging.getLogger("w2d")
+
+STATE_PENDING = 'pending'
+STATE_FETCHED = 'fetched'
+STATE_EXTRACTED = 'extracted'
+STATE_RENDERED = 'rendered'
+STATE_FAILED = 'failed'
+STATES = (STATE_PENDING, STATE_FETCHED, STATE_EXTRACTED, STATE_RENDERED, STATE_FAILED)
+UNFINISHED_STATES = (STATE_PENDING, STATE_FETCHED, STATE_EXTRACTED)
+
+CREATE_SQL = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    url TEXT PRIMARY KEY,
+    output_format TEXT NOT NULL,
+    state TEXT NOT NULL,
+    failed_state TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT,
+    added_time REAL,
+    updated_time REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+'''
+JOB_COLUMNS = ('url', 'output_format', 'state', 'failed_state', 'attempts', 'error', 'result', 'added_time', 'updated_time')
+
+
+class JobStore(object):
+    """sqlite3 store of url job states, one file per batch.
+    Safe for use from multiple threads and processes (same approach as w2d.cache.CacheIndex).
+    """
+    def __init__(self, db_filename, timeout=30.0):
+        self.db_filename = db_filename
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_connection(self):
+        # pid check, connections must not be shared with forked (e.g. multiprocessing) children
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.db_filename, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(CREATE_SQL)
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+        self._local.pid = None
+
+    def add(self, urls, output_format=w2d.FORMAT_MARKDOWN):
+        """Add urls as pending, urls already in the store keep their state. Returns number added"""
+        now = time.time()
+        connection = self._get_connection()
+        with connection:
+            before = connection.total_changes
+            connection.executemany(
+                'INSERT OR IGNORE INTO jobs (url, output_format, state, added_time, updated_time) VALUES (?, ?, ?, ?, ?)',
+                [(url, output_format, STATE_PENDING, now, now) for url in urls]
+            )
+            return connection.total_changes - before
+
+    def set_state(self, url, state, result=None):
+        connection = self._get_connection()
+        with connection:
+            if result is None:
+                connection.execute('UPDATE jobs SET state = ?, updated_time = ? WHERE url = ?', (state, time.time(), url))
+            else:
+                connection.execute('UPDATE jobs SET state = ?, result = ?, error = NULL, failed_state = NULL, updated_time = ? WHERE url = ?', (state, json.dumps(result, default=str), time.time(), url))
+
+    def set_failed(self, url, error):
+        """Record error (string) for url, failed_state is the state it failed in (i.e. the stage after it)"""
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                'UPDATE jobs SET failed_state = state, state = ?, error = ?, attempts = attempts + 1, updated_time = ? WHERE url = ? AND state != ?',
+                (STATE_FAILED, error, time.time(), url, STATE_FAILED)
+            )
+
+    def retry_failed(self):
+        """Mark failed urls as pending again, returns number of urls"""
+        connection = self._get_connection()
+        with connection:
+            cursor = connection.execute('UPDATE jobs SET state = ?, updated_time = ? WHERE state = ?', (STATE_PENDING, time.time(), STATE_FAILED))
+            return cursor.rowcount
+
+    def get_jobs(self, states=None):
+        """Returns list of job dicts (in the order added), optionally only those in states"""
+        sql = 'SELECT %s FROM jobs' % ', '.join(JOB_COLUMNS)
+        params = ()
+        if states:
+            sql += ' WHERE state IN (%s)' % ', '.join('?' * len(states))
+            params = tuple(states)
+        sql += ' ORDER BY rowid'
+        cursor = self._get_connection().execute(sql, params)
+        result = []
+        for row in cursor.fetchall():
+            job = dict(zip(JOB_COLUMNS, row))
+            if job['result']:
+                job['result'] = json.loads(job['result'])
+            result.append(job)
+        return result
+
+    def counts(self):
+        """Returns dict of state to number of urls"""
+        result = dict((state, 0) for state in STATES)
+        for state, count in self._get_connection().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+            result[state] = count
+        return result
+
+
+def format_error(info):
+    return '%s: %s' % (info.__class__.__name__, info)
+
+
+job_stores = {}  # db_filename -> JobStore, per process
+
+
+def get_job_store(db_filename):
+    store = job_stores.get(db_filename)
+    if store is None:
+        store = job_stores[db_filename] = JobStore(db_filename)
+    return store
+
+
+def fetch_job(db_filename, url, output_format):
+    """Network stage, returns True if url was fetched (or is not fetched by this extractor), failures are recorded"""
+    store = get_job_store(db_filename)
+    try:
+        w2d.prefetch_url(url, output_format)
+    except Exception as info:
+        log.error('fetch failed %r %r', url, info)
+        store.set_failed(url, format_error(info))
+        return False
+    store.set_state(url, STATE_FETCHED)
+    return True
+
+
+def convert_job(db_filename, url, output_format, output_sink=None, record_rendered=True):
+    """Extract and render stage, returns (state, result_metadata_list), failures are recorded.
+    output_sink - defaults to w2d.get_output_sink()
+    record_rendered - False when run in a worker process, output_sink is then a sinks.MemorySink and the rendered
+    state is recorded by the caller once the documents are written, see convert_job_documents()
+    """
+    w2d.configure()
+    store = get_job_store(db_filename)
+    try:
+        result_metadata_list = w2d.process_page_formats(
+            url,
+            output_formats=w2d.get_output_format_list(output_format),
+            extractor_function=w2d.get_extractor_function(),
+            epub_output_function=w2d.get_epub_output_function(),
+            extracted_callback=lambda page_info: store.set_state(url, STATE_EXTRACTED),
+            output_sink=output_sink,
+        )
+    except Exception as info:
+        log.error('convert failed %r %r', url, info, exc_info=True)
+        store.set_failed(url, format_error(info))
+        return STATE_FAILED, None
+    if record_rendered:
+        store.set_state(url, STATE_RENDERED, result=result_metadata_list)
+    return STATE_RENDERED, result_metadata_list
+
+
+def convert_job_documents(db_filename, url, output_format):
+    """convert_job() in a worker process, returns (state, result_metadata_list, documents) for the parent process to write"""
+    memory_sink = sinks.MemorySink()
+    state, result_metadata_list = convert_job(db_filename, url, output_format, output_sink=memory_sink, record_rendered=False)
+    return state, result_metadata_list, memory_sink.documents
+
+
+def check_output_archive(store):
+    """Raises ValueError if the default output sink (W2D_OUTPUT_SINK) would replace an existing archive
+    holding documents rendered by a previous run of the batch in store
+    """
+    target = os.environ.get('W2D_OUTPUT_SINK')
+    if not target or not sinks.is_archive_filename(target) or not os.path.exists(target):
+        return
+    if w2d.output_sink is not None:
+        return  # already opened (created) by this process
+    if store.counts()[STATE_RENDERED]:
+        raise ValueError('output archive %r exists and would be replaced, set W2D_OUTPUT_SINK to a new archive (or a directory) to resume %r' % (target, store.db_filename))
+
+
+def run_batch(db_filename, urls=None, output_format=None, retry_failed=False, fetch_workers=None, cpu_workers=None, output_sink=None):
+    """Process the unfinished urls in the job store db_filename (after adding urls, if any).
+    output_format defaults to env W2D_OUTPUT_FORMAT (md), used for newly added urls only.
+    output_sink defaults to w2d.get_output_sink(), NOTE archive sinks are not appended to, use a new archive per run.
+    Resuming (urls already rendered) onto an existing W2D_OUTPUT_SINK archive raises ValueError, rather than replacing it.
+    Returns dict of state to number of urls (for the whole store).
+    """
+    w2d.configure()
+    if fetch_workers is None:
+        fetch_workers = w2d.get_worker_count('W2D_FETCH_WORKERS')
+    if cpu_workers is None:
+        cpu_workers = w2d.get_worker_count('W2D_CPU_WORKERS')
+    cpu_pool = None
+    if concurrent is not None and cpu_workers > 1:
+        cpu_pool = w2d.start_process_pool(cpu_workers)  # before any threads or sqlite connections
+
+    try:
+        store = get_job_store(db_filename)
+        if output_sink is None:
+            check_output_archive(store)
+        if urls:
+            added = store.add(urls, output_format=output_format or os.environ.get('W2D_OUTPUT_FORMAT', w2d.FORMAT_MARKDOWN))
+            log.info('added %d urls to %r', added, db_filename)
+        if retry_failed:
+            log.info('retrying %d failed urls', store.retry_failed())
+        jobs = store.get_jobs(states=UNFINISHED_STATES)
+        log.info('%d urls to process, fetch_workers=%d cpu_workers=%d', len(jobs), fetch_workers, cpu_workers)
+
+        def fetch(job):
+            if job['state'] != STATE_PENDING:
+                return True  # already fetched before the interruption
+            return fetch_job(db_filename, job['url'], job['output_format'])
+
+        def job_failed(url, info):
+            # unexpected (e.g. BrokenProcessPool) rather than a per url error already recorded by fetch_job()/convert_job()
+            log.error('job failed %r %r', url, info, exc_info=True)
+            store.set_failed(url, format_error(info))
+
+        if concurrent is None or (fetch_workers <= 1 and cpu_pool is None):
+            for job in jobs:
+                try:
+                    if fetch(job):
+                        convert_job(db_filename, job['url'], job['output_format'], output_sink=output_sink)
+                except Exception as info:
+                    job_failed(job['url'], info)
+        else:
+            fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(fetch_workers, 1))
+            try:
+                fetch_futures = dict((fetch_pool.submit(fetch, job), job) for job in jobs)
+                convert_futures = {}  # future -> url
+                for future in concurrent.futures.as_completed(fetch_futures):
+                    job = fetch_futures[future]
+                    try:
+                        if not future.result():
+                            continue
+                        if cpu_pool:
+                            convert_futures[cpu_pool.submit(convert_job_documents, db_filename, job['url'], job['output_format'])] = job['url']
+                        else:
+                            convert_job(db_filename, job['url'], job['output_format'], output_sink=output_sink)
+                    except Exception as info:
+                        job_failed(job['url'], info)
+                # single writer, documents rendered by the workers are written (and marked rendered) here
+                output_sink = output_sink or w2d.get_output_sink()
+                for future in concurrent.futures.as_completed(convert_futures):
+                    url = convert_futures[future]
+                    try:
+                        state, result_metadata_list, documents = future.result()
+                    except Exception as info:
+                        job_failed(url, info)
+                        continue
+                    if state == STATE_RENDERED:
+                        try:
+                            sinks.write_documents(output_sink, documents, result_metadata_list)
+                        except Exception as info:
+                            log.error('write failed %r %r', url, info)
+                            store.set_failed(url, format_error(info))
+                            continue
+                        store.set_state(url, STATE_RENDERED, result=result_metadata_list)
+            finally:
+                fetch_pool.shutdown()
+        return store.counts()
+    finally:
+        if cpu_pool:
+            cpu_pool.shutdown()
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(prog='python -m w2d.jobs', description='w2d resumable batch jobs')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='add urls (if any) and process unfinished urls')
+    run_parser.add_argument('store', help='job store filename (sqlite3), created if missing')
+    run_parser.add_argument('urls', nargs='*')
+    run_parser.add_argument('--url-file', help='file with one url per line')
+    run_parser.add_argument('--format', default=None, help='output format for added urls (default W2D_OUTPUT_FORMAT or md)')
+    run_parser.add_argument('--retry-failed', action='store_true', help='process failed urls again')
+    status_parser = subparsers.add_parser('status', help='number of urls in each state')
+    status_parser.add_argument('store')
+    failed_parser = subparsers.add_parser('failed', help='failed urls and their errors')
+    failed_parser.add_argument('store')
+    options = parser.parse_args(argv[1:])
+
+    if options.command == 'run':
+        urls = list(options.urls)
+        if options.url_file:
+            f = open(options.url_file)
+            urls += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            f.close()
+        w2d.setup_logging()
+        try:
+            counts = run_batch(options.store, urls=urls, output_format=options.format, retry_failed=options.retry_failed)
+        except ValueError as info:
+            print(info)
+            return 1
+    elif options.command in ('status', 'failed'):
+        if not os.path.exists(options.store):
+            print('not found')
+            return 1
+        store = JobStore(options.store)
+        if options.command == 'failed':
+            for job in store.get_jobs(states=[STATE_FAILED]):
+                print('%s\t%s\t%d\t%s' % (job['url'], job['failed_state'], job['attempts'], job['error']))
+        counts = store.counts()
+    else:
+        parser.print_help()
+        return 1
+    for state in STATES:
+        print('%s: %d' % (state, counts[state]))
+    return 1 if counts[STATE_FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
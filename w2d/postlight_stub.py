@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Stub Postlight (Mercury) parser server, for testing without Node.js.
+
+    python -m w2d.postlight_stub --serve 3000
+    MP_URL=http://localhost:3000/parser python -m w2d http://example.com/
+
+Responds to the same GET request as https://github.com/HenryQW/mercury-parser-api
+The target url is fetched with w2d.easy_get_url() and "parsed" (title from
+<title>, content is the <body>). With --fail N the first N requests for each
+url fail, to exercise retries. --fail-mode is how; error responds with
+{"error": true}, status with a 503, json with a truncated (invalid) json body.
+
+Stub postlight worker (see w2d.postlight_worker), JSON lines on stdin/stdout:
+
+    env W2D_EXTRACTOR=postlight_worker W2D_POSTLIGHT_WORKER_CMD="python -m w2d.postlight_stub --worker" python -m w2d http://localhost:8000/one.html
+
+With --crash-after N the worker exits (without responding) on request N+1, to exercise restarts.
+"""
+
+import json
+import re
+import sys
+import threading
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+import w2d
+
+
+title_re = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+body_re = re.compile(r'<body[^>]*>(.*)</body>', re.IGNORECASE | re.DOTALL)
+
+
+def parse_page(url, page_content, content_type='html'):
+    """Return dict in postlight format, for html page_content (string)"""
+    match = title_re.search(page_content)
+    title = match.group(1).strip() if match else None
+    match = body_re.search(page_content)
+    content = match.group(1).strip() if match else page_content
+    if content_type == 'markdown':
+        content = w2d.html_to_markdown(content)
+    return {
+        'title': title,
+        'content': content,
+        'url': url,
+        'domain': urlparse(url).hostname,
+        'word_count': len(content.split()),
+        'author': None,
+        'date_published': None,
+        'lead_image_url': None,
+        'excerpt': None,
+    }
+
+
+class StubPostlightHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def log_message(self, format, *args):
+        w2d.log.debug(format, *args)
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        url = query.get('url', [None])[0]
+        content_type = query.get('contentType', ['html'])[0]
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            attempt = server.attempts[url] = server.attempts.get(url, 0) + 1
+        if not url:
+            result = {'error': True, 'message': 'missing url'}
+        elif attempt <= server.fail_count:
+            result = {'error': True, 'message': 'stub failure %d' % attempt}
+            if server.fail_mode == FAIL_STATUS:
+                self.send_body(json.dumps(result).encode('utf-8'), status=503)
+                return
+            elif server.fail_mode == FAIL_JSON:
+                body = json.dumps(result).encode('utf-8')
+                self.send_body(body[:len(body) // 2])
+                return
+        else:
+            try:
+                result = fetch_and_parse(url, content_type)
+            except Exception as info:
+                result = {'error': True, 'message': str(info)}
+        self.send_body(json.dumps(result).encode('utf-8'))  # mercury-parser-api errors are also 200
+
+    def send_body(self, body, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+FAIL_ERROR = 'error'  # {"error": true}
+FAIL_STATUS = 'status'  # 503 Service Unavailable
+FAIL_JSON = 'json'  # truncated json
+FAIL_MODES = (FAIL_ERROR, FAIL_STATUS, FAIL_JSON)
+
+
+class StubPostlightServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, fail_count=0, fail_mode=FAIL_ERROR):
+        HTTPServer.__init__(self, server_address, StubPostlightHandler)
+        self.fail_count = fail_count
+        self.fail_mode = fail_mode
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.attempts = {}  # url -> number of requests seen
+
+
+def fetch_and_parse(url, content_type='html'):
+    page_content = w2d.easy_get_url(url).decode('utf-8')
+    return parse_page(url, page_content, content_type)
+
+
+def run_worker(crash_after=None, stdin=None, stdout=None):
+    """Serve postlight_worker.js protocol requests from stdin until EOF"""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    request_count = 0
+    for line in iter(stdin.readline, ''):
+        request = json.loads(line)
+        request_count += 1
+        if crash_after is not None and request_count > crash_after:
+            sys.exit(1)
+        try:
+            response = {'id': request['id'], 'result': fetch_and_parse(request['url'], request.get('format', 'html'))}
+        except Exception as info:
+            response = {'id': request['id'], 'error': str(info)}
+        stdout.write(json.dumps(response) + '\n')
+        stdout.flush()
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(prog='python -m w2d.postlight_stub', description='stub Postlight parser, for testing')
+    parser.add_argument('--serve', type=int, metavar='PORT', default=3000, help='port to listen on')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--fail', type=int, default=0, metavar='N', help='fail the first N requests for each url')
+    parser.add_argument('--fail-mode', choices=FAIL_MODES, default=FAIL_ERROR, help='how requests fail, {"error": true}, 503 status, or invalid json')
+    parser.add_argument('--worker', action='store_true', help='postlight worker, JSON lines on stdin/stdout instead of http server')
+    parser.add_argument('--crash-after', type=int, default=None, metavar='N', help='worker exits on request N+1')
+    options = parser.parse_args(argv[1:])
+
+    if options.worker:
+        run_worker(crash_after=options.crash_after)
+        return 0
+
+    server = StubPostlightServer((options.host, options.serve), fail_count=options.fail, fail_mode=options.fail_mode)
+    print('stub postlight server on http://%s:%d/parser' % (options.host, options.serve))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+#!/usr/bin/env node
+// Long running postlight-parser worker for w2d, see w2d/postlight_worker.py
+// Copyright (C) 2023 Chris Clark - clach04
+//
+//     npm install @postlight/parser
+//     node postlight_worker.js
+//
+// One JSON request per line on stdin:
+//     {"id": 1, "url": "https://...", "format": "html", "headers": {...}}
+// One JSON response per line on stdout:
+//     {"id": 1, "result": {...postlight result...}}  or  {"id": 1, "error": "message"}
+
+var readline = require('readline');
+
+var Parser;
+try {
+    Parser = require('@postlight/parser');
+} catch (e) {
+    Parser = require('@postlight/mercury-parser');  // older name
+}
+
+// stdout is the response channel, keep library logging off it
+console.log = console.error;
+console.info = console.error;
+
+function respond(response) {
+    process.stdout.write(JSON.stringify(response) + '\n');
+}
+
+var lines = readline.createInterface({input: process.stdin, terminal: false});
+lines.on('line', function (line) {
+    var request;
+    try {
+        request = JSON.parse(line);
+    } catch (e) {
+        return;  // ignore garbage, caller matches on id
+    }
+    var options = {contentType: request.format || 'html', headers: request.headers || {}};
+    Parser.parse(request.url, options).then(function (result) {
+        respond({id: request.id, result: result});
+    }, function (e) {
+        respond({id: request.id, error: String((e && e.message) || e)});
+    });
+});
+lines.on('close', function () {
+    process.exitCode = 0;
+});
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Pool of long running postlight-parser worker processes.
+
+Avoids the Node.js startup (and module load) cost of running
+postlight-parser once per page, see w2d.extractor_postlight_worker().
+Each worker reads one JSON request per line on stdin and writes one JSON
+response per line on stdout (see postlight_worker.js for the protocol).
+Workers that crash, exit, or time out are restarted.
+
+W2D_POSTLIGHT_WORKER_CMD - worker command line, defaults to
+    node postlight_worker.js (needs @postlight/parser in NODE_PATH), use
+    "python -m w2d.postlight_stub --worker" for a stub worker (no Node.js)
+W2D_POSTLIGHT_WORKERS - number of worker processes (default 2)
+W2D_POSTLIGHT_WORKER_TIMEOUT - seconds per page (default 60)
+"""
+
+import json
+import logging
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+try:
+    # Py3
+    import queue
+except ImportError:
+    # Py2
+    import Queue as queue
+
+
+log = logging.getLogger("w2d")
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'postlight_worker.js')
+
+
+class PostlightWorkerError(Exception):
+    '''Worker crashed, exited, or timed out'''
+
+
+def get_worker_command():
+    command = os.environ.get('W2D_POSTLIGHT_WORKER_CMD')
+    if command:
+        return shlex.split(command)
+    return ['node', WORKER_SCRIPT]
+
+
+class PostlightWorker(object):
+    """A single worker process, one request at a time"""
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.lines = None
+        self.request_id = 0
+        self.start()
+
+    def start(self):
+        log.debug('starting postlight worker %r', self.command)
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)  # stderr inherited, for diagnostics
+        # reader thread so that reads can time out (portable, no select() on Windows pipes)
+        self.lines = lines = queue.Queue()
+        stdout = self.process.stdout
+        def read_lines():
+            for line in iter(stdout.readline, b''):
+                lines.put(line)
+            lines.put(None)  # EOF, process exited
+        reader = threading.Thread(target=read_lines)
+        reader.daemon = True
+        reader.start()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout=2):
+        """Close stdin (worker should exit), kill if still running after timeout seconds"""
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        deadline = time.time() + timeout
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def restart(self):
+        self.stop(timeout=0)  # only called for dead or unresponsive workers
+        self.start()
+
+    def request(self, url, format='html', headers=None, timeout=60):
+        """Returns response dict, raises PostlightWorkerError if worker dies or times out"""
+        self.request_id += 1
+        request = {'id': self.request_id, 'url': url, 'format': format, 'headers': headers or {}}
+        try:
+            self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+        except (IOError, OSError) as info:
+            raise PostlightWorkerError('postlight worker write failed %r' % (info,))
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            try:
+                if remaining <= 0:
+                    raise queue.Empty
+                line = self.lines.get(timeout=remaining)
+            except queue.Empty:
+                raise PostlightWorkerError('postlight worker timed out after %r seconds for %r' % (timeout, url))
+            if line is None:
+                raise PostlightWorkerError('postlight worker exited (closed stdout) for %r' % (url,))
+            try:
+                response = json.loads(line.decode('utf-8'))
+            except ValueError:
+                log.debug('ignoring postlight worker output %r', line)
+                continue
+            if not isinstance(response, dict) or response.get('id') != self.request_id:
+                log.debug('ignoring postlight worker response %r', line)
+                continue
+            return response
+
+
+class PostlightWorkerPool(object):
+    """Thread safe, parse() blocks until a worker is free.
+
+    command - list, defaults to get_worker_command()
+    size - number of worker processes
+    timeout - seconds per page, worker is restarted on timeout
+    retries - number of times a page is retried (on a restarted worker) after a crash/timeout
+    """
+    def __init__(self, command=None, size=None, timeout=None, retries=1):
+        self.command = command or get_worker_command()
+        self.size = size or int(os.environ.get('W2D_POSTLIGHT_WORKERS', 2))
+        self.timeout = timeout or float(os.environ.get('W2D_POSTLIGHT_WORKER_TIMEOUT', 60))
+        self.retries = retries
+        self.workers = []
+        self.idle = queue.Queue()
+        for _ in range(self.size):
+            worker = PostlightWorker(self.command)
+            self.workers.append(worker)
+            self.idle.put(worker)
+
+    def parse(self, url, format='html', headers=None):
+        """Returns postlight dict, on failure {"error": true, "message": ...} (same as the postlight server)"""
+        worker = self.idle.get()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    if not worker.is_alive():
+                        log.warning('postlight worker exited %r, restarting', worker.process and worker.process.poll())
+                        worker.restart()
+                    response = worker.request(url, format=format, headers=headers, timeout=self.timeout)
+                    break
+                except PostlightWorkerError as info:
+                    log.warning('%s, restarting worker', info)
+                    worker.restart()
+                    if attempt >= self.retries:
+                        return {'error': True, 'message': str(info)}
+        finally:
+            self.idle.put(worker)
+        if 'error' in response:
+            return {'error': True, 'message': response['error']}
+        return response['result']
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+
+worker_pool = None
+worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Shared PostlightWorkerPool, started on first use and stopped on exit"""
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is None:
+            import atexit
+            worker_pool = PostlightWorkerPool()
+            atexit.register(close_worker_pool)
+        return worker_pool
+
+
+def close_worker_pool():
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is not None:
+            worker_pool.close()
+            worker_pool = None
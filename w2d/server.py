@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Long running w2d conversion server.
+
+Keeps one process (with the extractors imported, caches and connection
+pools warm) and accepts conversion jobs over HTTP, or a Unix domain socket.
+
+    python -m w2d serve --port 8100 --output-dir out
+    python -m w2d serve --unix-socket /tmp/w2d.sock
+
+    curl -d '{"url": "http://example.com/", "format": "md", "wait": true}' http://localhost:8100/jobs
+    curl -d '{"url": "http://example.com/", "format": "all"}' http://localhost:8100/jobs  # returns job id immediately
+    curl http://localhost:8100/jobs/<id>
+    curl http://localhost:8100/status
+    curl --unix-socket /tmp/w2d.sock -d '{"url": "http://example.com/"}' http://localhost/jobs
+
+POST /jobs json request:
+
+    url - required
+    format - md, html, epub, or all (default W2D_OUTPUT_FORMAT or md)
+    extractor - one of w2d.EXTRACTOR_NAMES (default W2D_EXTRACTOR)
+    title - optional, overrides the extracted title
+    content - optional html, used instead of fetching url (for extractors that use content)
+    wait - true (or number of seconds) to respond when the job finishes, rather than immediately, other values are a 400 error
+
+Response is the job as json; id, status (queued, running, done, failed),
+result (list of result_metadata, one per format, with absolute filenames
+in "filename"), and error. Jobs are queued in a bounded queue, when it is
+full new jobs are rejected with 503 (and Retry-After), rather than
+queueing unbounded work.
+
+W2D_SERVE_WORKERS - number of jobs run concurrently (threads, default 2)
+W2D_SERVE_QUEUE_SIZE - maximum number of queued jobs (default 100)
+W2D_SERVE_KEEP_JOBS - number of finished jobs kept for GET /jobs/<id> (default 1000)
+"""
+
+import collections
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    import queue
+    import socketserver
+    from urllib.parse import urlparse
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import Queue as queue
+    import SocketServer as socketserver
+    from urlparse import urlparse
+
+import w2d
+from . import sinks
+
+
+log = logging.getLogger("w2d")
+
+MAX_REQUEST_BYTES = 50 * 1024 * 1024
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    '''Job queue is at capacity, try again later'''
+
+
+class Job(object):
+    def __init__(self, url, output_format=w2d.FORMAT_MARKDOWN, extractor_name=None, title=None, content=None):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.output_format = output_format
+        self.extractor_name = extractor_name
+        self.title = title
+        self.content = content
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'format': self.output_format,
+            'extractor': self.extractor_name,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue(object):
+    """Bounded queue of conversion jobs, run by worker threads in this process.
+
+    workers - number of jobs run concurrently
+    max_queued - submit() raises QueueFullError when this many jobs are waiting
+    output_dir - directory output files are written to (default current directory)
+    keep_jobs - number of finished jobs remembered for get()
+    """
+    def __init__(self, workers=None, max_queued=None, output_dir=None, keep_jobs=None):
+        self.workers = workers or int(os.environ.get('W2D_SERVE_WORKERS', 2))
+        self.max_queued = max_queued or int(os.environ.get('W2D_SERVE_QUEUE_SIZE', 100))
+        self.keep_jobs = keep_jobs or int(os.environ.get('W2D_SERVE_KEEP_JOBS', 1000))
+        self.output_dir = os.path.abspath(output_dir or '.')
+        self.output_sink = sinks.DirectorySink(self.output_dir)  # names unique across jobs
+        self.pending = queue.Queue(maxsize=self.max_queued)
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()  # id -> Job, oldest first
+        self.counts = {'submitted': 0, 'rejected': 0, JOB_DONE: 0, JOB_FAILED: 0}
+        self.running = 0
+        self.started = time.time()
+        self.threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.run_worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, url, output_format=None, extractor_name=None, title=None, content=None):
+        """Returns queued Job, raises QueueFullError (back-pressure) or ValueError for bad parameters"""
+        if not url or not url.startswith(('http://', 'https://')):
+            raise ValueError('url must be http or https, got %r' % (url,))
+        output_format = output_format or os.environ.get('W2D_OUTPUT_FORMAT', w2d.FORMAT_MARKDOWN)
+        if output_format != w2d.FORMAT_ALL and output_format not in w2d.SUPPORTED_FORMATS:
+            raise ValueError('format %r not supported (or missing dependency)' % (output_format,))
+        if extractor_name and extractor_name not in w2d.EXTRACTOR_NAMES:
+            raise ValueError('extractor %r not one of %r' % (extractor_name, w2d.EXTRACTOR_NAMES))
+        job = Job(url, output_format=output_format, extractor_name=extractor_name, title=title, content=content)
+        with self.lock:
+            try:
+                self.pending.put_nowait(job)
+            except queue.Full:
+                self.counts['rejected'] += 1
+                raise QueueFullError('%d jobs queued' % self.max_queued)
+            self.counts['submitted'] += 1
+            self.jobs[job.id] = job
+            self.forget_old_jobs()
+        return job
+
+    def forget_old_jobs(self):
+        """Drop the oldest finished jobs over keep_jobs, call with lock held"""
+        excess = len(self.jobs) - self.keep_jobs
+        if excess <= 0:
+            return
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].done.is_set():
+                del self.jobs[job_id]
+                excess -= 1
+
+    def get(self, job_id):
+        """Returns Job or None"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counts)
+            result.update({
+                'queued': self.pending.qsize(),
+                'running': self.running,
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'uptime_seconds': time.time() - self.started,
+                'output_dir': self.output_dir,
+            })
+        return result
+
+    def run_job(self, job):
+        extractor_function = w2d.get_extractor_function(job.extractor_name)
+        result_metadata_list = w2d.process_page_formats(
+            job.url,
+            content=job.content,
+            output_formats=w2d.get_output_format_list(job.output_format),
+            extractor_function=extractor_function,
+            title=job.title,
+            output_sink=self.output_sink,
+        )
+        for result_metadata in result_metadata_list:
+            result_metadata['filename'] = os.path.abspath(self.output_sink.local_path(result_metadata['filename']))
+        return result_metadata_list
+
+    def run_worker(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                break  # close()
+            with self.lock:
+                self.running += 1
+            job.status = JOB_RUNNING
+            job.started = time.time()
+            try:
+                job.result = self.run_job(job)
+                job.status = JOB_DONE
+            except Exception as info:
+                log.error('job %s %r failed %r', job.id, job.url, info, exc_info=True)
+                job.error = '%s: %s' % (info.__class__.__name__, info)
+                job.status = JOB_FAILED
+            job.content = None  # no need to keep (possibly large) html around
+            job.finished = time.time()
+            with self.lock:
+                self.running -= 1
+                self.counts[job.status] += 1
+            job.done.set()
+
+    def close(self):
+        """Stop the workers once the queued jobs are complete"""
+        for _ in self.threads:
+            self.pending.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)  # NOTE address_string() is not usable with Unix sockets
+
+    def send_json(self, code, data, headers=None):
+        body = json.dumps(data, indent=4, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        job_queue = self.server.job_queue
+        if path in ('', '/status'):
+            self.send_json(200, job_queue.stats())
+        elif path.startswith('/jobs/'):
+            job = job_queue.get(path[len('/jobs/'):])
+            if job is None:
+                self.send_json(404, {'error': 'unknown job id'})
+            else:
+                self.send_json(200, job.to_dict())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path != '/jobs':
+            self.send_json(404, {'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True  # body not read
+            self.send_json(413, {'error': 'request over %d bytes' % MAX_REQUEST_BYTES})
+            return
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('expected a json object')
+            wait = request.get('wait')
+            if not (wait is None or isinstance(wait, bool) or (isinstance(wait, (int, float)) and 0 <= wait < float('inf'))):
+                raise ValueError('wait must be true, false or a number of seconds, got %r' % (wait,))  # NaN fails the range check
+            job = self.server.job_queue.submit(
+                request.get('url'),
+                output_format=request.get('format'),
+                extractor_name=request.get('extractor'),
+                title=request.get('title'),
+                content=request.get('content'),
+            )
+        except QueueFullError as info:
+            self.send_json(503, {'error': 'queue full, %s' % info}, headers={'Retry-After': '1'})
+            return
+        except ValueError as info:
+            self.send_json(400, {'error': str(info)})
+            return
+        if wait:
+            job.done.wait(None if wait is True else float(wait))
+        self.send_json(200 if job.done.is_set() else 202, job.to_dict())
+
+
+class JobHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, job_queue):
+        HTTPServer.__init__(self, server_address, JobRequestHandler)
+        self.job_queue = job_queue
+
+
+UnixStreamServer = getattr(socketserver, 'UnixStreamServer', None)  # not available on Windows
+
+if UnixStreamServer:
+    class JobUnixServer(socketserver.ThreadingMixIn, UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, job_queue):
+            if os.path.exists(path):
+                os.remove(path)  # stale socket from a previous run
+            UnixStreamServer.__init__(self, path, JobRequestHandler)
+            self.job_queue = job_queue
+
+        def get_request(self):
+            request, client_address = UnixStreamServer.get_request(self)
+            return request, ('unix', 0)  # BaseHTTPRequestHandler expects (host, port)
+
+        def server_close(self):
+            UnixStreamServer.server_close(self)
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+
+
+def make_server(job_queue, host='127.0.0.1', port=8100, unix_socket=None):
+    """Returns server (call serve_forever()) for job_queue, on unix_socket (path) if set, otherwise host:port"""
+    if unix_socket:
+        if not UnixStreamServer:
+            raise NotImplementedError('Unix domain sockets not supported on this platform')
+        return JobUnixServer(unix_socket, job_queue)
+    return JobHTTPServer((host, port), job_queue)
+
+
+def warm_up():
+    """Import the (lazily imported) extraction and conversion backends now, rather than on the first job"""
+    start = w2d.timer()
+    w2d.configure()
+    for module in (w2d.lxml, w2d.readability, w2d.trafilatura, w2d.markdownify, w2d.pypub):
+        bool(module)  # triggers the import
+    log.info('warm up %.3f seconds', w2d.timer() - start)
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(prog='python -m w2d serve', description='w2d conversion server, jobs are submitted over http')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--unix-socket', metavar='PATH', help='listen on a Unix domain socket rather than host:port')
+    parser.add_argument('--output-dir', metavar='DIRECTORY', default='.', help='directory output files are written to')
+    parser.add_argument('--workers', type=int, default=None, help='jobs run concurrently (default W2D_SERVE_WORKERS or 2)')
+    parser.add_argument('--queue-size', type=int, default=None, help='maximum queued jobs, more are rejected with 503 (default W2D_SERVE_QUEUE_SIZE or 100)')
+    options = parser.parse_args(argv[1:])
+
+    warm_up()
+    w2d.safe_mkdir(options.output_dir)
+    job_queue = JobQueue(workers=options.workers, max_queued=options.queue_size, output_dir=options.output_dir)
+    server = make_server(job_queue, host=options.host, port=options.port, unix_socket=options.unix_socket)
+    if options.unix_socket:
+        print('w2d serving on unix socket %s' % options.unix_socket)
+    else:
+        print('w2d serving on http://%s:%d/' % server.server_address[:2])
+    sys.stdout.flush()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)  # e.g. service manager stop, clean up the socket
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""Output sinks, where rendered documents (md, html, epub) are written.
+
+    DirectorySink - one file per document in a directory (default, current directory)
+    ZipSink - documents appended to a single zip file as they are rendered
+    TarSink - documents streamed into a single tar file (.tar, .tar.gz/.tgz, .tar.bz2, .tar.xz)
+
+Archive sinks write through a single (buffered) file handle and add a
+manifest.json (name, url, title, format, size, and sha256 of each document)
+when closed. Document names are unique within a sink, if two urls render to
+the same name (e.g. the same title) the later ones get a -2, -3, etc. suffix.
+Localised images (W2D_LOCALIZE_IMAGES) are added to archives once, under
+assets/, and documents link to them there.
+
+Set W2D_OUTPUT_SINK to a directory or archive filename (type from the
+extension), see w2d.get_output_sink(), or pass a sink to w2d.dump_urls().
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import tarfile
+import threading
+import time
+import zipfile
+
+try:
+    from io import BytesIO
+except ImportError:
+    # Py2
+    from StringIO import StringIO as BytesIO
+
+import w2d
+
+
+MANIFEST_NAME = 'manifest.json'
+ASSETS_DIRNAME = 'assets'
+ASSET_FORMAT = 'asset'  # manifest format of assets, see OutputSink.write_asset()
+BUFFER_SIZE = 1024 * 1024
+TAR_MODES = (
+    ('.tar.gz', 'w|gz'),
+    ('.tgz', 'w|gz'),
+    ('.tar.bz2', 'w|bz2'),
+    ('.tar.xz', 'w|xz'),
+    ('.tar', 'w|'),
+)
+STORED_EXTENSIONS = ('.epub', '.zip', '.png', '.jpg', '.gif')  # already compressed
+
+
+def get_manifest_entry(name, data, metadata=None):
+    entry = dict(metadata or {})
+    entry.update({'name': name, 'bytes': len(data), 'sha256': hashlib.sha256(data).hexdigest()})
+    return entry
+
+
+class OutputSink(object):
+    """Base class, sub classes implement write_data()"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = {}  # name -> url, names handed out by reserve()
+        self.asset_names = set()
+        self.manifest = []
+
+    def reserve(self, name, url=None):
+        """Returns unique name for url's document, the same name and url always gets the same result"""
+        with self.lock:
+            base, extension = os.path.splitext(name)
+            counter = 1
+            candidate = name
+            while candidate in self.names and self.names[candidate] != url:
+                counter += 1
+                candidate = '%s-%d%s' % (base, counter, extension)
+            self.names[candidate] = url
+            return candidate
+
+    def local_path(self, name):
+        """Filesystem path the document for name should be written to directly, None if the sink is not a directory"""
+        return None
+
+    def write(self, name, data, metadata=None):
+        """Write bytes data as name (from reserve()), metadata (url, title, format) is recorded in the manifest"""
+        entry = get_manifest_entry(name, data, metadata)
+        with self.lock:
+            self.write_data(name, data)
+            self.manifest.append(entry)
+        return name
+
+    def write_file(self, name, pathname, metadata=None):
+        """Write (local) file pathname as name, e.g. a temporary file from an epub tool"""
+        f = open(pathname, 'rb')
+        data = f.read()
+        f.close()
+        return self.write(name, data, metadata=metadata)
+
+    def claim_asset(self, name):
+        """True if asset name is not yet in this sink, the caller then writes it (asset names are content hashes)"""
+        with self.lock:
+            if name in self.asset_names:
+                return False
+            self.asset_names.add(name)
+            return True
+
+    def write_asset(self, name, pathname):
+        """Write (local) asset file pathname as name, once, shared by all documents"""
+        if self.claim_asset(name):
+            self.write_file(name, pathname, metadata={'format': ASSET_FORMAT})
+        return name
+
+    def write_data(self, name, data):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DirectorySink(OutputSink):
+    """One file per document, names are relative to directory (the existing w2d behavior).
+    manifest_name - if set, the manifest is written to this file (in directory) on close
+    """
+    def __init__(self, directory='.', manifest_name=None):
+        OutputSink.__init__(self)
+        self.directory = directory
+        self.manifest_name = manifest_name
+
+    def local_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write_data(self, name, data):
+        pathname = self.local_path(name)
+        dirname = os.path.dirname(pathname)
+        if dirname:
+            w2d.safe_mkdir(dirname)
+        f = open(pathname, 'wb')
+        f.write(data)
+        f.close()
+
+    def write_file(self, name, pathname, metadata=None):
+        if os.path.abspath(pathname) != os.path.abspath(self.local_path(name)):
+            return OutputSink.write_file(self, name, pathname, metadata=metadata)
+        # already in place (e.g. written by an epub tool), record only
+        f = open(pathname, 'rb')
+        data = f.read()
+        f.close()
+        entry = get_manifest_entry(name, data, metadata)
+        with self.lock:
+            self.manifest.append(entry)
+        return name
+
+    def close(self):
+        if self.manifest_name:
+            self.write_data(self.manifest_name, json.dumps(self.manifest, indent=4).encode('utf-8'))
+
+
+def get_archive_name(name):
+    """Relative name for an archive member, drops drive and leading /"""
+    name = os.path.splitdrive(name)[1].replace(os.sep, '/')
+    return name.lstrip('/')
+
+
+class ZipSink(OutputSink):
+    def __init__(self, filename):
+        OutputSink.__init__(self)
+        self.filename = filename
+        self.file = open(filename, 'wb', BUFFER_SIZE)
+        self.archive = zipfile.ZipFile(self.file, 'w', zipfile.ZIP_DEFLATED)
+
+    def write_data(self, name, data):
+        info = zipfile.ZipInfo(get_archive_name(name), date_time=time.localtime()[:6])
+        info.external_attr = 0o644 << 16
+        if name.lower().endswith(STORED_EXTENSIONS):
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+        self.archive.writestr(info, data)
+
+    def close(self):
+        with self.lock:
+            if self.archive is None:
+                return
+            self.write_data(MANIFEST_NAME, json.dumps(self.manifest, indent=4).encode('utf-8'))
+            self.archive.close()
+            self.file.close()
+            self.archive = None
+
+
+class TarSink(OutputSink):
+    """Streaming tar, compression from the filename extension"""
+    def __init__(self, filename):
+        OutputSink.__init__(self)
+        self.filename = filename
+        for extension, mode in TAR_MODES:
+            if filename.lower().endswith(extension):
+                break
+        self.file = open(filename, 'wb', BUFFER_SIZE)
+        self.archive = tarfile.open(fileobj=self.file, mode=mode)
+
+    def write_data(self, name, data):
+        info = tarfile.TarInfo(get_archive_name(name))
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        self.archive.addfile(info, BytesIO(data))
+
+    def close(self):
+        with self.lock:
+            if self.archive is None:
+                return
+            self.write_data(MANIFEST_NAME, json.dumps(self.manifest, indent=4).encode('utf-8'))
+            self.archive.close()
+            self.file.close()
+            self.archive = None
+
+
+class MemorySink(OutputSink):
+    """Documents kept in memory (documents list of (name, data, metadata)), e.g. rendered in a worker process
+    and written to the real sink by the parent process, see write_documents()
+    """
+    def __init__(self):
+        OutputSink.__init__(self)
+        self.documents = []
+
+    def write(self, name, data, metadata=None):
+        with self.lock:
+            self.documents.append((name, data, metadata))
+        return name
+
+
+def get_asset_name(asset_path):
+    """Name in an archive for local asset_path (from w2d.localize_images()), assets/ab/ab12...ef.png"""
+    return '/'.join([ASSETS_DIRNAME] + asset_path.replace(os.sep, '/').split('/')[-2:])
+
+
+def write_assets(sink, content, asset_paths, name):
+    """Write local assets (images) into sink, which has no local_path(), e.g. an archive.
+    Returns content with the asset paths re-written to be relative to document name
+    """
+    document_dir = posixpath.dirname(get_archive_name(name)) or '.'
+    for asset_path in asset_paths:
+        asset_name = sink.write_asset(get_asset_name(asset_path), asset_path)
+        content = content.replace(asset_path, posixpath.relpath(asset_name, document_dir))  # paths are content hashes, no false matches
+    return content
+
+
+def write_documents(sink, documents, result_metadata_list):
+    """Write documents (from a MemorySink) into sink, updating result_metadata filenames to the names used in sink"""
+    for name, data, metadata in documents:
+        if (metadata or {}).get('format') == ASSET_FORMAT:
+            if sink.claim_asset(name):
+                sink.write(name, data, metadata=metadata)
+            continue
+        new_name = sink.write(sink.reserve(name, (metadata or {}).get('url')), data, metadata=metadata)
+        for result_metadata in result_metadata_list:
+            if result_metadata.get('filename') == name:
+                result_metadata['filename'] = new_name
+
+
+def is_archive_filename(target):
+    """True if open_output_sink(target) is an archive sink, which replaces an existing file rather than adding to it"""
+    return target.lower().endswith(('.zip',) + tuple(extension for extension, mode in TAR_MODES))
+
+
+def open_output_sink(target):
+    """Sink for target, an archive filename (.zip, .tar, .tar.gz, etc.) or a directory"""
+    lower_target = target.lower()
+    if lower_target.endswith('.zip'):
+        return ZipSink(target)
+    for extension, mode in TAR_MODES:
+        if lower_target.endswith(extension):
+            return TarSink(target)
+    return DirectorySink(target)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+# Convert from html to on disk format
+# Copyright (C) 2023 Chris Clark - clach04
+"""WARC (web archive) crawl files as an input source, no network access.
+
+    python -m w2d.warc list crawl.warc.gz
+    python -m w2d.warc convert crawl.warc.gz [more.warc.gz ...] [--format md] [--workers 4] [--output out.zip]
+
+Records are streamed, one at a time, from .warc or .warc.gz (gzip member
+per record, or whole file compressed) files. Only "response" records for
+http(s) urls with a 200 status and an html content type are used, the HTTP
+payload is de-chunked (Transfer-Encoding: chunked) and decompressed
+(Content-Encoding: gzip, deflate, br if the brotli module is installed)
+then fed, with the original url, straight into the extractor. Nothing is
+fetched or copied into the scrape cache.
+
+    import w2d.warc
+    for response in w2d.warc.iter_html_responses('crawl.warc.gz'):
+        print(response.url, len(response.get_text()))
+    summary = w2d.warc.convert_warc(['crawl.warc.gz'], output_format='md', cpu_workers=4)
+
+Conversion runs in batches of pages (--batch-size) in a pool of worker
+processes (--workers, default W2D_CPU_WORKERS), documents are written to
+the output sink (see w2d/sinks.py, W2D_OUTPUT_SINK) by the main process.
+Only extractors that work from the page content can be used (readability,
+the default, and raw). The extraction cache is not used (every page in a
+crawl is new), pass --extract-cache to enable.
+"""
+
+import gzip
+import logging
+import os
+import re
+import sys
+import time
+import zlib
+
+try:
+    import concurrent.futures  # Py3
+except ImportError:
+    # Py2 (without futures backport), pages are converted serially
+    concurrent = None
+
+try:
+    import brotli  # optional - pip install brotli
+except ImportError:
+    brotli = None
+
+import w2d
+from . import sinks
+
+
+log = logging.getLogger("w2d")
+
+GZIP_MAGIC = b'\x1f\x8b'
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+SKIP_CHUNK_SIZE = 1024 * 1024
+charset_re = re.compile(r'charset\s*=\s*["\']?([-\w.:]+)', re.IGNORECASE)
+meta_charset_re = re.compile(br'<meta[^>]+charset\s*=\s*["\']?([-\w.:]+)', re.IGNORECASE)
+
+
+class WarcFormatError(Exception):
+    '''Not a WARC file, or a truncated/corrupt record'''
+
+
+def open_warc(filename):
+    """Binary file object for filename, gzip (.warc.gz) is detected from the content rather than the name"""
+    f = open(filename, 'rb')
+    magic = f.read(2)
+    f.seek(0)
+    if magic == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=f, mode='rb')  # reads all members, i.e. per record gzip
+    return f
+
+
+def read_headers(f):
+    """Read "Name: value" lines up to a blank line, returns dict with lower case names"""
+    headers = {}
+    while True:
+        line = f.readline()
+        if not line:
+            raise WarcFormatError('unexpected end of file in headers')
+        line = line.rstrip(b'\r\n')
+        if not line:
+            return headers
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower().decode('latin-1')] = value.strip().decode('utf-8', 'replace')
+
+
+def skip_bytes(f, length):
+    while length > 0:
+        data = f.read(min(length, SKIP_CHUNK_SIZE))
+        if not data:
+            raise WarcFormatError('unexpected end of file in record block')
+        length -= len(data)
+
+
+def iter_records(f, record_types=None):
+    """Yields (warc_headers, block bytes) for each record in WARC file object f.
+    record_types - optional collection of WARC-Type values (e.g. ['response']), blocks of other records are skipped without being kept in memory,
+    (warc_headers, None) is yielded for skipped records
+    """
+    while True:
+        line = f.readline()
+        if not line:
+            return  # end of file
+        if not line.strip():
+            continue  # record separator (or extra blank lines)
+        if not line.startswith(b'WARC/'):
+            raise WarcFormatError('expected WARC version line, got %r' % line[:100])
+        warc_headers = read_headers(f)
+        try:
+            length = int(warc_headers.get('content-length', ''))
+        except ValueError:
+            raise WarcFormatError('missing or bad Content-Length %r' % warc_headers.get('content-length'))
+        if record_types is not None and warc_headers.get('warc-type') not in record_types:
+            skip_bytes(f, length)
+            yield warc_headers, None
+            continue
+        block = f.read(length)
+        if len(block) != length:
+            raise WarcFormatError('truncated record %r' % warc_headers.get('warc-record-id'))
+        yield warc_headers, block
+
+
+def dechunk(data):
+    """Decode HTTP chunked transfer encoding, returns data unchanged if it is not valid chunked data"""
+    result = []
+    position = 0
+    try:
+        while True:
+            line_end = data.index(b'\r\n', position)
+            size = int(data[position:line_end].split(b';', 1)[0].strip(), 16)
+            position = line_end + 2
+            if size == 0:
+                return b''.join(result)
+            if position + size > len(data):
+                result.append(data[position:])  # truncated
+                return b''.join(result)
+            result.append(data[position:position + size])
+            position += size + 2  # chunk data is followed by CRLF
+    except ValueError:
+        if not result:
+            return data  # not chunked after all
+        return b''.join(result)
+
+
+def decode_content(data, content_encoding):
+    """Returns decompressed data, raises ValueError for unsupported or corrupt encoding"""
+    content_encoding = (content_encoding or '').strip().lower()
+    if content_encoding in ('', 'identity'):
+        return data
+    try:
+        if content_encoding in ('gzip', 'x-gzip'):
+            return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        if content_encoding == 'deflate':
+            try:
+                return zlib.decompress(data)
+            except zlib.error:
+                return zlib.decompress(data, -zlib.MAX_WBITS)  # raw deflate, no zlib header
+    except zlib.error as info:
+        raise ValueError('bad %s content %r' % (content_encoding, info))
+    if content_encoding == 'br' and brotli:
+        return brotli.decompress(data)
+    raise ValueError('unsupported Content-Encoding %r' % content_encoding)
+
+
+class WarcResponse(object):
+    """HTTP response from a WARC response record"""
+    def __init__(self, url, status, http_headers, body, warc_headers):
+        self.url = url
+        self.status = status
+        self.http_headers = http_headers  # lower case names
+        self.body = body  # bytes, de-chunked and decompressed
+        self.warc_headers = warc_headers
+
+    @property
+    def content_type(self):
+        return self.http_headers.get('content-type', '').split(';')[0].strip().lower()
+
+    @property
+    def date(self):
+        return self.warc_headers.get('warc-date')
+
+    def get_text(self):
+        """Body as a string, charset from the Content-Type header, then <meta charset>, then utf-8"""
+        match = charset_re.search(self.http_headers.get('content-type', ''))
+        charset = match and match.group(1)
+        if not charset:
+            match = meta_charset_re.search(self.body[:4096])
+            charset = match and match.group(1).decode('ascii', 'replace')
+        try:
+            return self.body.decode(charset or 'utf-8', 'replace')
+        except LookupError:
+            return self.body.decode('utf-8', 'replace')  # unknown charset name
+
+
+def parse_response(warc_headers, block):
+    """Returns WarcResponse for a response record block (HTTP status line, headers, and payload)"""
+    url = warc_headers.get('warc-target-uri', '').strip('<>')  # WARC 0.x/some tools wrap the uri in <>
+    header_end = block.find(b'\r\n\r\n')
+    if header_end == -1:
+        raise WarcFormatError('no HTTP headers in response record for %r' % url)
+    header_lines = block[:header_end].split(b'\r\n')
+    status_line = header_lines[0].split(None, 2)
+    try:
+        status = int(status_line[1])
+    except (IndexError, ValueError):
+        raise WarcFormatError('bad HTTP status line %r for %r' % (header_lines[0][:100], url))
+    http_headers = {}
+    for line in header_lines[1:]:
+        name, _, value = line.partition(b':')
+        http_headers[name.strip().lower().decode('latin-1')] = value.strip().decode('latin-1')
+    body = block[header_end + 4:]
+    if 'chunked' in http_headers.get('transfer-encoding', '').lower():
+        body = dechunk(body)
+    body = decode_content(body, http_headers.get('content-encoding'))
+    return WarcResponse(url, status, http_headers, body, warc_headers)
+
+
+def iter_responses(filename):
+    """Yields WarcResponse for every HTTP response record (any status or content type) in WARC file filename"""
+    f = open_warc(filename)
+    try:
+        for warc_headers, block in iter_records(f, record_types=('response',)):
+            if block is None:
+                continue
+            if not warc_headers.get('content-type', 'application/http').startswith('application/http'):
+                continue  # e.g. dns: responses
+            try:
+                yield parse_response(warc_headers, block)
+            except (WarcFormatError, ValueError) as info:
+                log.warning('skipping record %r', info)
+    finally:
+        f.close()
+
+
+def iter_html_responses(filename, stats=None):
+    """Yields WarcResponse for successful (200) html responses for http(s) urls in filename.
+    stats - optional dict, counts of records read and skipped are added to it
+    """
+    if stats is None:
+        stats = {}
+    for response in iter_responses(filename):
+        stats['responses'] = stats.get('responses', 0) + 1
+        if response.status != 200 or response.content_type not in HTML_CONTENT_TYPES or not response.url.startswith(('http://', 'https://')):
+            stats['skipped'] = stats.get('skipped', 0) + 1
+            continue
+        yield response
+
+
+def convert_pages(pages, output_format=w2d.FORMAT_MARKDOWN, extractor_name=None, extract_cache=False, output_sink=None):
+    """Extract and render pages, list of (url, html text), to output_sink. Failures are logged and counted, not raised.
+    Returns (list of result_metadata lists (None for failed pages), documents), documents is empty unless output_sink is a sinks.MemorySink
+    """
+    w2d.configure()
+    extractor_function = w2d.get_extractor_function(extractor_name)
+    epub_output_function = w2d.get_epub_output_function()
+    output_formats = w2d.get_output_format_list(output_format)
+    results = []
+    for url, content in pages:
+        try:
+            results.append(w2d.process_page_formats(url, content=content, output_formats=output_formats, extractor_function=extractor_function, epub_output_function=epub_output_function, output_sink=output_sink, extract_cache=extract_cache))
+        except Exception as info:
+            log.error('convert failed %r %r', url, info, exc_info=True)
+            results.append(None)
+    documents = output_sink.documents if isinstance(output_sink, sinks.MemorySink) else []
+    return results, documents
+
+
+def convert_pages_documents(pages, output_format=w2d.FORMAT_MARKDOWN, extractor_name=None, extract_cache=False):
+    """convert_pages() in a worker process, rendered documents are returned for the parent process to write"""
+    return convert_pages(pages, output_format=output_format, extractor_name=extractor_name, extract_cache=extract_cache, output_sink=sinks.MemorySink())
+
+
+def iter_batches(filenames, batch_size, stats):
+    batch = []
+    for filename in filenames:
+        log.info('reading %r', filename)
+        for response in iter_html_responses(filename, stats=stats):
+            batch.append((response.url, response.get_text()))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def convert_warc(filenames, output_format=w2d.FORMAT_MARKDOWN, extractor_name=None, cpu_workers=None, batch_size=20, output_sink=None, extract_cache=False):
+    """Convert the html responses in WARC files to output_format documents in output_sink (default w2d.get_output_sink())
+    cpu_workers - number of worker processes, defaults to env W2D_CPU_WORKERS or 1 (convert in this process)
+    Returns summary dict; pages, converted, failed, responses (read), skipped (not html, not 200, etc.), seconds
+    """
+    w2d.configure()
+    extractor_function = w2d.get_extractor_function(extractor_name)
+    if extractor_function not in w2d.EXTRACTORS_USING_CONTENT:
+        raise ValueError('extractor %r fetches pages itself, use readability or raw for WARC input' % (extractor_name or extractor_function.__name__,))
+    if cpu_workers is None:
+        cpu_workers = w2d.get_worker_count('W2D_CPU_WORKERS')
+    cpu_pool = None
+    if concurrent is not None and cpu_workers > 1:
+        cpu_pool = w2d.start_process_pool(cpu_workers)
+    output_sink = output_sink or w2d.get_output_sink()
+    stats = {'pages': 0, 'converted': 0, 'failed': 0, 'responses': 0, 'skipped': 0}
+    start = time.time()
+
+    def record_results(results):
+        for result_metadata_list in results:
+            stats['pages'] += 1
+            stats['converted' if result_metadata_list else 'failed'] += 1
+
+    try:
+        if cpu_pool is None:
+            for batch in iter_batches(filenames, batch_size, stats):
+                results, documents = convert_pages(batch, output_format=output_format, extractor_name=extractor_name, extract_cache=extract_cache, output_sink=output_sink)
+                record_results(results)
+        else:
+            # bounded number of batches in flight, reading the WARC does not get ahead of the workers (memory)
+            in_flight = set()
+
+            def write_completed(return_when):
+                done, not_done = concurrent.futures.wait(in_flight, return_when=return_when)
+                for future in done:
+                    results, documents = future.result()
+                    sinks.write_documents(output_sink, documents, [result_metadata for result_metadata_list in results if result_metadata_list for result_metadata in result_metadata_list])
+                    record_results(results)
+                return not_done
+
+            for batch in iter_batches(filenames, batch_size, stats):
+                in_flight.add(cpu_pool.submit(convert_pages_documents, batch, output_format, extractor_name, extract_cache))
+                if len(in_flight) >= cpu_workers * 2:
+                    in_flight = write_completed(concurrent.futures.FIRST_COMPLETED)
+            if in_flight:
+                write_completed(concurrent.futures.ALL_COMPLETED)
+    finally:
+        if cpu_pool:
+            cpu_pool.shutdown()
+    stats['seconds'] = time.time() - start
+    return stats
+
+
+def main(argv=None):
+    import argparse
+
+    if argv is None:
+        argv = sys.argv
+    parser = argparse.ArgumentParser(prog='python -m w2d.warc', description='convert html pages from WARC crawl files, no network access')
+    subparsers = parser.add_subparsers(dest='command')
+    list_parser = subparsers.add_parser('list', help='list the http responses in WARC files')
+    list_parser.add_argument('filenames', nargs='+')
+    convert_parser = subparsers.add_parser('convert', help='convert the html responses in WARC files')
+    convert_parser.add_argument('filenames', nargs='+')
+    convert_parser.add_argument('--format', default=None, help='md, html, epub, or all (default W2D_OUTPUT_FORMAT or md)')
+    convert_parser.add_argument('--extractor', default=None, choices=('readability', 'raw'), help='default W2D_EXTRACTOR or readability')
+    convert_parser.add_argument('--workers', type=int, default=None, help='worker processes (default W2D_CPU_WORKERS or 1)')
+    convert_parser.add_argument('--batch-size', type=int, default=20, help='pages per worker task')
+    convert_parser.add_argument('--output', default=None, help='output directory or archive (.zip, .tar.gz, etc.), default W2D_OUTPUT_SINK or current directory')
+    convert_parser.add_argument('--extract-cache', action='store_true', help='use (and fill) the extraction cache')
+    options = parser.parse_args(argv[1:])
+
+    if options.command == 'list':
+        for filename in options.filenames:
+            for response in iter_responses(filename):
+                print('%d\t%s\t%d\t%s' % (response.status, response.content_type or '-', len(response.body), response.url))
+        return 0
+    elif options.command == 'convert':
+        import json
+        w2d.setup_logging()
+        output_sink = sinks.open_output_sink(options.output) if options.output else w2d.get_output_sink()
+        try:
+            stats = convert_warc(
+                options.filenames,
+                output_format=options.format or os.environ.get('W2D_OUTPUT_FORMAT', w2d.FORMAT_MARKDOWN),
+                extractor_name=options.extractor,
+                cpu_workers=options.workers,
+                batch_size=options.batch_size,
+                output_sink=output_sink,
+                extract_cache=options.extract_cache,
+            )
+        finally:
+            if options.output:
+                output_sink.close()
+            else:
+                w2d.close_output_sink()
+        print(json.dumps(stats, indent=4, sort_keys=True))
+        return 1 if stats['failed'] else 0
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())